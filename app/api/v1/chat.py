@@ -1,82 +1,433 @@
 from fastapi import APIRouter, HTTPException, Body, UploadFile, File
-from app.schema.chat import ChatRequest, ChatResponse
-from langchain_community.agent_toolkits.sql.base import create_sql_agent
-from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_community.utilities import SQLDatabase
-from app.db.base import engine
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from app.schema.chat import BatchChatRequest, ChatRequest, ChatResponse
+from sqlalchemy.orm import Session
+from app.db.base import engine, SessionLocal
+from app.db.post import get_recent_posts
 from app.settings import settings
-from app.utils.faiss_utils import search_faiss_index
-from app.utils.pdf_utils import extract_text_from_pdf
-from app.utils.med_record_processor import ask_gemini_about_medicine
-import os
+from app.utils.context_assembler import AssembledContext, ContextAssembler
+from app.utils.admission import LLMAdmission, LLMOverloaded
+from app.utils.cache import normalize_text
+from app.utils.coalescing import SingleFlight
+from app.utils.faiss_utils import (
+    asearch_posts,
+    asearch_posts_many,
+    index_manager,
+    post_metadata,
+)
+from app.utils.metrics import LatencyRecorder, register_stats
+from app.utils.providers import lazy
+from app.utils.streaming import SSE_HEADERS, call_once, sse_event, sse_stream
+from app.utils.vector_store import SearchFilter
+from app.utils.patient_summary import cache_stats as summary_cache_stats
+from app.utils.patient_summary import format_summary, load_summary, summary_version
+from app.utils.record_index import record_context
+from app.utils.record_text import cache_stats, record_version
+from app.utils.med_record_processor import (
+    ask_gemini_about_medicine_async,
+    medicine_prompt,
+    stream_gemini_about_medicine,
+)
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import time
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
-db = SQLDatabase(engine)
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash", google_api_key=settings.GENAI_API_KEY
+
+def build_chat_llm():
+    if settings.LLM_BACKEND == "fake":
+        from app.utils.fake_llm import FakeChatModel
+
+        return FakeChatModel()
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
+        model="gemini-2.0-flash", google_api_key=settings.GENAI_API_KEY
+    )
+
+
+def build_sql_agent():
+    from langchain_community.agent_toolkits.sql.base import create_sql_agent
+    from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
+    from langchain_community.utilities import SQLDatabase
+
+    toolkit = SQLDatabaseToolkit(db=SQLDatabase(engine), llm=llm.get())
+    return create_sql_agent(llm=llm.get(), toolkit=toolkit, verbose=True)
+
+
+# Built on first use or at warm-up; the SQL agent is not used by any
+# endpoint, so it is never built unless something asks for it
+llm = lazy("chat_llm", build_chat_llm)
+agent = lazy("sql_agent", build_sql_agent, warm=False)
+
+# Keeps every prompt within the configured token budget
+context_assembler = ContextAssembler(
+    token_budget=settings.CHAT_CONTEXT_TOKEN_BUDGET,
+    record_share=settings.CHAT_RECORD_TOKEN_SHARE,
+    recency_half_life_days=settings.CHAT_RECENCY_HALF_LIFE_DAYS,
 )
-toolkit = SQLDatabaseToolkit(db=db, llm=llm)
-agent = create_sql_agent(llm=llm, toolkit=toolkit, verbose=True)
+register_stats("chat_context", context_assembler.stats)
+register_stats("record_text_cache", cache_stats)
+register_stats("patient_summary_cache", summary_cache_stats)
 
+# Caps concurrent upstream LLM calls; excess requests get 429/503
+llm_admission = LLMAdmission(
+    max_concurrent=settings.LLM_MAX_CONCURRENCY,
+    max_queue=settings.LLM_MAX_QUEUE,
+    queue_timeout=settings.LLM_QUEUE_TIMEOUT_SECONDS,
+)
+register_stats("llm_admission", llm_admission.stats)
 
-@router.post("/", response_model=ChatResponse)
-def chat(request: ChatRequest = Body(...)):
+# Coalesces identical /chat questions and briefly caches their answers
+chat_flights = SingleFlight(
+    cache_size=settings.CHAT_RESPONSE_CACHE_SIZE,
+    cache_ttl=settings.CHAT_RESPONSE_CACHE_TTL_SECONDS,
+)
+register_stats("chat_coalescing", chat_flights.stats)
+
+# Totals of the /chat/batch endpoint
+batch_stats = {"batches": 0, "items": 0, "errors": 0}
+batch_latency = LatencyRecorder()
+register_stats(
+    "chat_batch", lambda: {**batch_stats, "batch_latency": batch_latency.stats()}
+)
+
+# (time to first token, total time) of the streaming endpoints
+stream_latency = {
+    "chat": (LatencyRecorder(), LatencyRecorder()),
+    "ask_medicine": (LatencyRecorder(), LatencyRecorder()),
+}
+register_stats(
+    "chat_stream",
+    lambda: {
+        name: {"time_to_first_token": ttft.stats(), "total": total.stats()}
+        for name, (ttft, total) in stream_latency.items()
+    },
+)
+
+
+def recent_post_candidates(
+    search_filter: Optional[SearchFilter] = None,
+) -> List[Tuple[str, dict]]:
+    """
+    Fallback context when retrieval finds nothing: the most recent posts in
+    the same scope as the search.
+    """
+    search_filter = search_filter or SearchFilter()
+    db_session: Session = SessionLocal()
     try:
-        # Use FAISS vector search to get top relevant posts
-        top_k = 10
-        results = search_faiss_index(request.message, k=top_k)
-        posts_text = ""
-        if not results:
-            # fallback: no index or no results, use all posts (legacy)
-            from app.db.db_schema import Post as PostModel
-            from sqlalchemy.orm import Session
-            from app.db.base import SessionLocal
-
-            db_session: Session = SessionLocal()
-            posts = db_session.query(PostModel).all()
-            posts_text = "\n".join([f"- {p.text}" for p in posts if p.text])
-            db_session.close()
-        else:
-            posts_text = "\n".join([f"- {text}" for text, _ in results if text])
-
-        # If patient_username is provided, extract medical PDF text
+        posts = get_recent_posts(
+            db_session,
+            limit=settings.CHAT_FALLBACK_POSTS,
+            doctor_only=search_filter.doctor_only,
+            since=search_filter.since,
+            until=search_filter.until,
+            thread_id=search_filter.thread_id,
+        )
+        return [(p.text, post_metadata(p)) for p in posts]
+    finally:
+        db_session.close()
+
+
+async def build_chat_context(request: ChatRequest) -> AssembledContext:
+    """
+    Retrieve candidate posts and the patient's record and assemble the
+    prompt for a chat request. Blocking I/O runs in worker threads.
+    """
+    # Hybrid (BM25 + FAISS) search for candidate posts; the assembler
+    # picks as many of them as fit the token budget
+    search_filter = SearchFilter.create(
+        doctor_only=request.doctor_only,
+        since_days=request.since_days,
+        thread_id=request.thread_id,
+    )
+    candidates = await asearch_posts(
+        request.message,
+        k=settings.CHAT_CANDIDATE_POSTS,
+        search_filter=search_filter,
+    )
+    if not candidates:
+        # fallback: no index or no results, use the most recent posts
+        candidates = await asyncio.to_thread(recent_post_candidates, search_filter)
+
+    # If patient_username is provided, load their summary and/or record
+    pdf_text = ""
+    if request.patient_username:
+        pdf_text = await asyncio.to_thread(patient_record_text, request)
+
+    context = context_assembler.assemble(request.message, candidates, pdf_text)
+    print(
+        f"[Chat] Prompt tokens: {context.tokens}/{context_assembler.token_budget} "
+        f"(record {context.record_tokens}"
+        f"{', truncated' if context.record_truncated else ''}; "
+        f"{context.posts_used} posts, {context.duplicates_dropped} duplicates "
+        f"and {context.posts_dropped} over budget dropped)"
+    )
+    return context
+
+
+def patient_record_text(request: ChatRequest, summary: Optional[dict] = None) -> str:
+    """
+    The patient's current summary; with record_history (or before they have
+    a summary) also the latest visit and the parts of the medical record
+    relevant to the question. `summary` skips loading it again.
+    """
+    if summary is None:
+        summary = load_summary(request.patient_username)
+    if summary is not None and not request.record_history:
+        return format_summary(summary)
+    history = record_context(request.patient_username, request.message)
+    if summary is None:
+        return history
+    return f"{format_summary(summary)}\n\n{history}".strip()
+
+
+def sse_response(chunks, started_at: float, endpoint: str) -> StreamingResponse:
+    """
+    Stream `chunks` as SSE, releasing the LLM slot taken by the caller when
+    the stream ends or the client disconnects.
+    """
+    release = call_once(llm_admission.release)
+    return StreamingResponse(
+        sse_stream(chunks, started_at, *stream_latency[endpoint], on_close=release),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+        background=BackgroundTask(release),
+    )
+
+
+def chat_flight_key(request: ChatRequest) -> tuple:
+    """
+    Requests with the same key get the same answer: same question, same
+    retrieval scope, same record and summary versions and same index
+    generation. Reading the versions touches the disk, so call it off the
+    event loop.
+    """
+    return (
+        normalize_text(request.message),
+        request.patient_username,
+        record_version(request.patient_username) if request.patient_username else None,
+        summary_version(request.patient_username) if request.patient_username else None,
+        request.record_history,
+        index_manager.generation,
+        request.doctor_only,
+        request.since_days,
+        request.thread_id,
+    )
+
+
+async def complete(context: AssembledContext) -> str:
+    async with llm_admission.slot():
+        result = await llm.ainvoke(context.prompt)
+    return result.content
+
+
+async def answer_chat(request: ChatRequest) -> str:
+    context = await build_chat_context(request)
+    return await complete(context)
+
+
+def build_batch_contexts(
+    requests: List[ChatRequest],
+    candidates: List[List[Tuple[str, dict]]],
+    search_filter: Optional[SearchFilter],
+) -> List[AssembledContext]:
+    """
+    Assemble the prompts of a batch. Each patient's summary is loaded once
+    for all their questions, and the recent-posts fallback at most once.
+    """
+    summaries: Dict[str, Optional[dict]] = {}
+    fallback = None
+    contexts = []
+    for request, posts in zip(requests, candidates):
+        if not posts:
+            if fallback is None:
+                fallback = recent_post_candidates(search_filter)
+            posts = fallback
         pdf_text = ""
         if request.patient_username:
-            pdf_path = os.path.join(
-                "static", request.patient_username, "Medical_Record.pdf"
-            )
-            pdf_text = extract_text_from_pdf(pdf_path)
-
-        # Compose prompt
-        if pdf_text:
-            prompt = (
-                "Here is the patient's medical record (PDF):\n"
-                f"{pdf_text}\n\n"
-                "Here are the most relevant messages posted by users as context for your answer:\n"
-                f"{posts_text}\n\n"
-                f"User question: {request.message}\n"
-                "Answer based on the above medical record and messages."
-            )
-        else:
-            prompt = (
-                "Here are the most relevant messages posted by users as context for your answer:\n"
-                f"{posts_text}\n\n"
-                f"User question: {request.message}\n"
-                "Answer based on the above messages."
-            )
-        result = llm.invoke(prompt)
-        return ChatResponse(response=result.content)
+            username = request.patient_username
+            if username not in summaries:
+                summaries[username] = load_summary(username)
+            pdf_text = patient_record_text(request, summaries[username])
+        contexts.append(context_assembler.assemble(request.message, posts, pdf_text))
+    return contexts
+
+
+@router.post("/", response_model=ChatResponse)
+async def chat(request: ChatRequest = Body(...)):
+    try:
+        # Identical concurrent questions share one retrieval + LLM call
+        key = await asyncio.to_thread(chat_flight_key, request)
+        answer = await chat_flights.run(key, lambda: answer_chat(request))
+        return ChatResponse(response=answer)
+    except LLMOverloaded as e:
+        raise e.to_http()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/stream")
+async def chat_stream(request: ChatRequest = Body(...)):
+    """
+    Same as /chat, but the answer is streamed as Server-Sent Events while
+    the model generates it. Retrieval and admission happen before the first
+    byte, so their failures still surface as HTTP errors.
+    """
+    started_at = time.perf_counter()
+    try:
+        context = await build_chat_context(request)
+        await llm_admission.acquire()
+    except LLMOverloaded as e:
+        raise e.to_http()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    try:
+        # Building the provider or starting the stream can fail too
+        chunks = (chunk.content async for chunk in llm.astream(context.prompt))
+        return sse_response(chunks, started_at, "chat")
+    except Exception as e:
+        llm_admission.release()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/batch")
+async def chat_batch(batch: BatchChatRequest = Body(...)):
+    """
+    Answer many questions at once, streamed back as Server-Sent Events in
+    completion order: one "result" event per item (carrying its id and
+    position, and either "response" or "error") and a final "done" event.
+
+    All questions are retrieved together, with one batched embedding call
+    and one matrix FAISS search, and their LLM calls run at most
+    CHAT_BATCH_CONCURRENCY at a time.
+    """
+    if len(batch.items) > settings.CHAT_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.CHAT_BATCH_MAX_ITEMS} items per batch",
+        )
+    started_at = time.perf_counter()
+    requests = [
+        ChatRequest(
+            message=item.message,
+            patient_username=item.patient_username,
+            record_history=item.record_history,
+            doctor_only=batch.doctor_only,
+            since_days=batch.since_days,
+            thread_id=batch.thread_id,
+        )
+        for item in batch.items
+    ]
+    try:
+        search_filter = SearchFilter.create(
+            doctor_only=batch.doctor_only,
+            since_days=batch.since_days,
+            thread_id=batch.thread_id,
+        )
+        candidates = await asearch_posts_many(
+            [request.message for request in requests],
+            k=settings.CHAT_CANDIDATE_POSTS,
+            search_filter=search_filter,
+        )
+        contexts = await asyncio.to_thread(
+            build_batch_contexts, requests, candidates, search_filter
+        )
+        keys = await asyncio.to_thread(
+            lambda: [chat_flight_key(request) for request in requests]
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    semaphore = asyncio.Semaphore(settings.CHAT_BATCH_CONCURRENCY)
+
+    async def answer(index: int, key: tuple, context: AssembledContext):
+        result = {"index": index, "id": batch.items[index].id or str(index)}
+        async with semaphore:
+            try:
+                # Shares answers with /chat and with repeats inside the batch
+                result["response"] = await chat_flights.run(
+                    key, lambda: complete(context)
+                )
+            except LLMOverloaded as e:
+                result.update(error=e.detail, status_code=e.status_code)
+            except Exception as e:
+                result.update(error=str(e), status_code=500)
+        return result
+
+    async def events():
+        tasks = [
+            asyncio.ensure_future(answer(i, key, context))
+            for i, (key, context) in enumerate(zip(keys, contexts))
+        ]
+        errors = 0
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                if "error" in result:
+                    errors += 1
+                yield sse_event(result, event="result")
+        finally:
+            # Client went away: stop answering the rest
+            for task in tasks:
+                task.cancel()
+        elapsed = time.perf_counter() - started_at
+        batch_stats["batches"] += 1
+        batch_stats["items"] += len(tasks)
+        batch_stats["errors"] += errors
+        batch_latency.record(elapsed)
+        yield sse_event(
+            {
+                "items": len(tasks),
+                "errors": errors,
+                "elapsed_ms": round(elapsed * 1000.0, 1),
+            },
+            event="done",
+        )
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers=SSE_HEADERS
+    )
+
+
 @router.post("/ask-medicine", response_model=ChatResponse)
-def ask_medicine(patient_username: str = Body(...), file: UploadFile = File(...)):
+async def ask_medicine(patient_username: str = Body(...), file: UploadFile = File(...)):
     try:
-        image_bytes = file.file.read()
-        answer = ask_gemini_about_medicine(image_bytes, patient_username)
+        image_bytes = await file.read()
+        prompt = await asyncio.to_thread(medicine_prompt, patient_username)
+        async with llm_admission.slot():
+            answer = await ask_gemini_about_medicine_async(image_bytes, prompt)
         return ChatResponse(response=answer)
+    except LLMOverloaded as e:
+        raise e.to_http()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/ask-medicine/stream")
+async def ask_medicine_stream(
+    patient_username: str = Body(...), file: UploadFile = File(...)
+):
+    """
+    Same as /chat/ask-medicine, streamed as Server-Sent Events.
+    """
+    started_at = time.perf_counter()
+    try:
+        image_bytes = await file.read()
+        prompt = await asyncio.to_thread(medicine_prompt, patient_username)
+        await llm_admission.acquire()
+    except LLMOverloaded as e:
+        raise e.to_http()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    try:
+        return sse_response(
+            stream_gemini_about_medicine(image_bytes, prompt),
+            started_at,
+            "ask_medicine",
+        )
     except Exception as e:
+        llm_admission.release()
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from app.utils.metrics import collect_stats
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("/")
+def get_metrics():
+    """
+    Get the current in-process stats (index size, load times, caches...).
+    """
+    return collect_stats()
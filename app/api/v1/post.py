@@ -14,7 +14,11 @@ from app.db.post import (
     get_posts as db_get_posts,
     post_msg as db_post_msg,
 )
-from app.utils.faiss_utils import update_faiss_index
+from app.utils.faiss_utils import (
+    enqueue_faiss_delete,
+    enqueue_faiss_update,
+    post_metadata,
+)
 from app.db.doctor import is_doctor
 
 router = APIRouter(
@@ -68,15 +72,8 @@ async def post_msg(
     data = db_post_msg(
         db=db, post=post, user_or_doctor_id=current_user_or_doctor.id, doctor=_is_doctor
     )
-    # Update FAISS index with new post
-    update_faiss_index(
-        data.text,
-        metadata={
-            "post_id": data.post_id,
-            "user_id": data.user_id,
-            "doctor_id": data.doctor_id,
-        },
-    )
+    # Queue the new post for batched FAISS indexing
+    enqueue_faiss_update(data.text, metadata=post_metadata(data))
     return data
 
 
@@ -208,4 +205,6 @@ async def delete_post(
     db_post: Post = db_delete_post(db, str(post_id))
     if db_post is None:
         raise HTTPException(status_code=404, detail="Post not found")
+    # Tombstone the post's vector so /chat stops retrieving it
+    enqueue_faiss_delete(str(post_id))
     return db_post
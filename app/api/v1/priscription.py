@@ -1,14 +1,23 @@
+import datetime
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, status, Depends
+from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 from app.db.base import get_db
-import cloudinary.uploader
-from app.db.priscription import add_priscription, delete_priscription
-from app.utils.med_record_processor import extract_med_info_save
+from app.db.medication import active_medications, upcoming_visit
+from app.db.priscription import delete_priscription
+from app.schema.medication import ActiveMedications
+from app.utils.metrics import register_stats
+from app.utils.priscription_jobs import enqueue_priscription, job_queue, spool_upload
+from app.utils.record_store import record_pdf
+from app.utils.record_store import stats as record_pdf_stats
+from app.utils.reminders import reminder_scheduler
 
 router = APIRouter(prefix="/priscription", tags=["priscription"])
 
+register_stats("record_pdf", record_pdf_stats)
 
-@router.post("/upload")
+
+@router.post("/upload", status_code=status.HTTP_202_ACCEPTED)
 def upload_priscription(
     doctor_name: str = Form(...),
     visit_date: str = Form(...),
@@ -16,40 +25,43 @@ def upload_priscription(
     hospital_name: str = Form(...),
     username: str = Form(...),
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
 ):
+    """
+    Save the prescription image and queue its processing (upload, database
+    entry, medical record extraction). Returns the job id right away; poll
+    GET /priscription/jobs/{job_id} for progress and the result.
+    """
     # TODO: check whether the username exists or not
     try:
-        upload_result = cloudinary.uploader.upload(file.file, access_mode="public")
-        file_url = upload_result.get("secure_url")
-        if not file_url:
-            raise HTTPException(
-                status_code=500, detail="Failed to upload image to Cloudinary"
-            )
-        priscription = add_priscription(
-            db=db,
+        image_path = spool_upload(file.file, username)
+        job_id = enqueue_priscription(
+            image_path,
             doctor_name=doctor_name,
             visit_date=visit_date,
             visit_time=visit_time,
             hospital_name=hospital_name,
             username=username,
-            file_url=file_url,
-        )
-        print("Extracting medical information from the image...")
-        file.file.seek(0)
-        extract_med_info_save(
-            image_bytes=file.file.read(),
-            username=username,
         )
         return {
-            "detail": "Priscription uploaded successfully",
-            "file_url": file_url,
-            "id": priscription.id,
+            "detail": "Priscription queued for processing",
+            "job_id": job_id,
+            "status_url": f"{router.prefix}/jobs/{job_id}",
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/jobs/{job_id}")
+def get_priscription_job(job_id: str):
+    """
+    State, per-stage timing and result of a prescription upload job.
+    """
+    job = job_queue.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
 @router.delete("/{priscription_id}")
 def delete_priscription_api(priscription_id: int, db: Session = Depends(get_db)):
     success = delete_priscription(db, priscription_id)
@@ -69,3 +81,41 @@ def get_user_priscriptions(username: str, db: Session = Depends(get_db)):
         db.query(Priscription).filter(Priscription.username == username).all()
     )
     return priscriptions
+
+
+@router.get("/record/{username}")
+def get_medical_record(username: str):
+    """
+    The patient's medical record as a PDF, rendered from its sections when
+    they changed since the last request.
+    """
+    path = record_pdf(username)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Medical record not found")
+    return FileResponse(path, media_type="application/pdf")
+
+
+@router.get("/medications/{username}", response_model=ActiveMedications)
+def get_active_medications(
+    username: str, on: datetime.date | None = None, db: Session = Depends(get_db)
+):
+    """
+    Medications the patient takes on day `on` (today by default), with the
+    latest entry of each medicine, and their next follow-up visit.
+    """
+    on = on or datetime.date.today()
+    return ActiveMedications(
+        username=username,
+        on=on,
+        medications=active_medications(db, username, on),
+        next_visit=upcoming_visit(db, username, on),
+    )
+
+
+@router.get("/reminders/{username}")
+def get_reminders(username: str, since: datetime.datetime | None = None):
+    """
+    The patient's latest due doses (only those due after `since` if given),
+    newest last. Clients poll this with the due_at of the last one they saw.
+    """
+    return {"reminders": reminder_scheduler.reminders(username, since)}
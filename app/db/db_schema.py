@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Date, Index
 from app.db.base import Base, engine
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.sqlite import BLOB
@@ -55,6 +55,62 @@ class Priscription(Base):
     file_url = Column(String, nullable=False)
 
 
+class PriscriptionUpload(Base):
+    """Fingerprint of a processed prescription image and what it produced."""
+
+    __tablename__ = "priscription_uploads"
+    id = Column(Integer, primary_key=True, index=True)
+    username = Column(String, nullable=False)
+    sha256 = Column(String, nullable=False)
+    phash = Column(String, nullable=True)  # None when the image can't be decoded
+    priscription_id = Column(Integer, nullable=False)
+    file_url = Column(String, nullable=False)
+    record = Column(String, nullable=True)  # JSON of the extraction summary
+    created_at = Column(DateTime, nullable=False)
+    __table_args__ = (
+        Index("ix_priscription_uploads_username_sha256", "username", "sha256"),
+    )
+
+
+class Medication(Base):
+    """One medicine of a prescription, active from start_date to end_date."""
+
+    __tablename__ = "medications"
+    id = Column(Integer, primary_key=True, index=True)
+    username = Column(String, nullable=False)
+    name = Column(String, nullable=False)
+    dosage = Column(String, nullable=True)
+    # 1 when the dose is taken at that time of day, 0 otherwise
+    morning = Column(Integer, nullable=False, default=0)
+    afternoon = Column(Integer, nullable=False, default=0)
+    evening = Column(Integer, nullable=False, default=0)
+    night = Column(Integer, nullable=False, default=0)
+    duration = Column(String, nullable=True)
+    instructions = Column(String, nullable=True)
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=True)  # None when taken indefinitely
+    source = Column(String, nullable=True)  # Record section it came from
+    created_at = Column(DateTime, nullable=False)
+    __table_args__ = (
+        Index("ix_medications_username_end_date", "username", "end_date"),
+    )
+
+
+class NextVisit(Base):
+    """A follow-up visit the doctor asked for."""
+
+    __tablename__ = "next_visits"
+    id = Column(Integer, primary_key=True, index=True)
+    username = Column(String, nullable=False)
+    visit_date = Column(Date, nullable=False)
+    reason = Column(String, nullable=True)
+    source = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    __table_args__ = (
+        Index("ix_next_visits_username_visit_date", "username", "visit_date"),
+    )
+
+
 class Post(Base):
     __tablename__ = "posts"
 
@@ -71,3 +127,37 @@ class Post(Base):
 
 
 Base.metadata.create_all(bind=engine)
+
+
+def create_post_search_index(rebuild: bool = False) -> bool:
+    """
+    Create the FTS5 table mirroring posts.text (SQLite only), filling it from
+    the existing posts the first time or when `rebuild` is set. Each entry's
+    rowid is the rowid of its row in posts, so rebuild after a VACUUM (which
+    may renumber them). Returns whether full-text search is available.
+    """
+    if engine.dialect.name != "sqlite":
+        return False
+    try:
+        with engine.begin() as conn:
+            exists = conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'posts_fts'"
+            ).first()
+            if exists and not rebuild:
+                return True
+            conn.exec_driver_sql(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5("
+                "text, tokenize = 'porter unicode61')"
+            )
+            conn.exec_driver_sql("DELETE FROM posts_fts")
+            conn.exec_driver_sql(
+                "INSERT INTO posts_fts (rowid, text) "
+                "SELECT rowid, text FROM posts WHERE text IS NOT NULL"
+            )
+        return True
+    except Exception as e:
+        print(f"Full-text search unavailable: {str(e)}")
+        return False
+
+
+POSTS_FTS_ENABLED = create_post_search_index()
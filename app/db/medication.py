@@ -0,0 +1,233 @@
+"""
+Medications and follow-up visits extracted from prescriptions, queried by
+patient and date instead of reading a per-patient JSON file.
+"""
+
+import datetime
+import glob
+import json
+import os
+import re
+import threading
+from typing import Iterable, List, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from app.db.db_schema import Medication, NextVisit
+from app.settings import settings
+
+# Written by the pipeline before these tables existed; imported at startup,
+# see import_all_legacy_notifications()
+LEGACY_NOTIFICATIONS_FILE = "medical_notifications.json"
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)\s*(day|week|month|year)", re.IGNORECASE)
+_DAYS_PER_UNIT = {"day": 1, "week": 7, "month": 30, "year": 365}
+_INDEFINITE = (
+    "continue",
+    "ongoing",
+    "long term",
+    "long-term",
+    "lifelong",
+    "indefinite",
+)
+
+_import_lock = threading.Lock()
+
+
+def duration_days(duration: Optional[str]) -> Optional[int]:
+    """
+    Days a duration such as "7 days" or "2 weeks" spans; None when the
+    medicine is taken indefinitely. Durations that cannot be read count as
+    MEDICATION_DEFAULT_DAYS.
+    """
+    text = str(duration or "")
+    match = _DURATION.search(text)
+    if match:
+        days = float(match.group(1)) * _DAYS_PER_UNIT[match.group(2).lower()]
+        return max(1, round(days))
+    if any(word in text.lower() for word in _INDEFINITE):
+        return None
+    return settings.MEDICATION_DEFAULT_DAYS
+
+
+def _flag(value) -> int:
+    return int(str(value).strip().lower() in ("yes", "true", "1"))
+
+
+def _parse_date(value) -> Optional[datetime.date]:
+    try:
+        return datetime.date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def _prescription_rows(
+    username: str, json_data: dict, source: str, recorded_at: datetime.datetime
+) -> list:
+    start_date = recorded_at.date()
+    rows = []
+    for medication in json_data.get("medications") or []:
+        if not isinstance(medication, dict) or not medication.get("name"):
+            continue
+        days = duration_days(medication.get("duration"))
+        rows.append(
+            Medication(
+                username=username,
+                name=str(medication["name"]).strip(),
+                dosage=medication.get("dosage"),
+                morning=_flag(medication.get("morning")),
+                afternoon=_flag(medication.get("afternoon")),
+                evening=_flag(medication.get("evening")),
+                night=_flag(medication.get("night")),
+                duration=medication.get("duration"),
+                instructions=medication.get("instructions"),
+                start_date=start_date,
+                end_date=(
+                    start_date + datetime.timedelta(days=days - 1) if days else None
+                ),
+                source=source,
+                created_at=recorded_at,
+            )
+        )
+    visit = json_data.get("next_visit") or {}
+    visit_date = _parse_date(visit.get("date")) if isinstance(visit, dict) else None
+    if visit_date is not None:
+        rows.append(
+            NextVisit(
+                username=username,
+                visit_date=visit_date,
+                reason=visit.get("reason"),
+                source=source,
+                created_at=recorded_at,
+            )
+        )
+    return rows
+
+
+def _add_all(db: Session, rows: list):
+    try:
+        db.add_all(rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+def add_prescription_data(
+    db: Session,
+    username: str,
+    json_data: dict,
+    source: str = None,
+    recorded_at: datetime.datetime = None,
+) -> list:
+    """
+    Store the medications and next visit of one extracted prescription in a
+    single transaction. Medications start on the day they were recorded.
+    """
+    recorded_at = recorded_at or datetime.datetime.now()
+    rows = _prescription_rows(username, json_data, source, recorded_at)
+    _add_all(db, rows)
+    return rows
+
+
+def import_legacy_notifications(db: Session, username: str) -> bool:
+    """
+    Move the entries of the patient's medical_notifications.json, if any,
+    into the tables. The file is renamed afterwards so it is imported once.
+    """
+    path = os.path.join("static", username, LEGACY_NOTIFICATIONS_FILE)
+    if not os.path.exists(path):
+        return False
+    with _import_lock:
+        if not os.path.exists(path):
+            return False
+        with open(path, "r") as f:
+            entries = json.load(f)
+        rows = []
+        for entry in entries:
+            try:
+                recorded_at = datetime.datetime.fromisoformat(
+                    entry.get("processing_time", "")
+                )
+            except ValueError:
+                recorded_at = datetime.datetime.now()
+            rows += _prescription_rows(
+                username, entry, LEGACY_NOTIFICATIONS_FILE, recorded_at
+            )
+        # All or nothing, so a failed import can simply run again
+        _add_all(db, rows)
+        os.replace(path, path + ".imported")
+    print(f"Imported {len(entries)} notification entries of {username}")
+    return True
+
+
+def import_all_legacy_notifications(db: Session) -> int:
+    """
+    Import every patient's medical_notifications.json. Run once at startup,
+    before the reminder scheduler loads the tables. Returns how many
+    patients' files were imported; a file that fails is tried again at the
+    next startup.
+    """
+    imported = 0
+    for path in glob.glob(os.path.join("static", "*", LEGACY_NOTIFICATIONS_FILE)):
+        username = os.path.basename(os.path.dirname(path))
+        try:
+            imported += import_legacy_notifications(db, username)
+        except Exception as e:
+            print(f"Error importing notifications of {username}: {str(e)}")
+    return imported
+
+
+def active_medications(
+    db: Session, username: str, on: datetime.date = None
+) -> List[Medication]:
+    """
+    Medications the patient is taking on day `on` (today by default). When
+    a medicine was prescribed more than once, only the latest entry counts.
+    """
+    on = on or datetime.date.today()
+    rows = (
+        db.query(Medication)
+        .filter(
+            Medication.username == username,
+            or_(Medication.end_date.is_(None), Medication.end_date >= on),
+            Medication.start_date <= on,
+        )
+        .order_by(Medication.created_at.desc(), Medication.id.desc())
+        .all()
+    )
+    latest = {}
+    for row in rows:
+        latest.setdefault(row.name.lower(), row)
+    return sorted(latest.values(), key=lambda row: row.name.lower())
+
+
+def upcoming_visit(
+    db: Session, username: str, on: datetime.date = None
+) -> Optional[NextVisit]:
+    """
+    The patient's earliest follow-up visit on or after `on` (today by default).
+    """
+    on = on or datetime.date.today()
+    return (
+        db.query(NextVisit)
+        .filter(NextVisit.username == username, NextVisit.visit_date >= on)
+        .order_by(NextVisit.visit_date)
+        .first()
+    )
+
+
+def schedulable_medications(
+    db: Session, on: datetime.date = None
+) -> Iterable[Medication]:
+    """
+    Every patient's medications that have not ended before `on` (today by
+    default), for the reminder scheduler.
+    """
+    on = on or datetime.date.today()
+    return (
+        db.query(Medication)
+        .filter(or_(Medication.end_date.is_(None), Medication.end_date >= on))
+        .yield_per(10000)
+    )
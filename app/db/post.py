@@ -1,11 +1,65 @@
 from datetime import datetime
-from typing import List
+from typing import List, Optional, Tuple
+import re
 import uuid
 from uuid import UUID
+from sqlalchemy import text as sql_text
 from sqlalchemy.orm import Session, joinedload
+from app.db import db_schema
 from app.db.db_schema import Post as PostModel
 from app.schema.post import PostCreate, Post
 
+# Bound on the number of terms sent to FTS5 for one query
+MAX_FTS_TERMS = 32
+_FTS_TERM_RE = re.compile(r"\w+")
+
+# Ids of a thread's posts: the root and its replies at any depth
+THREAD_POSTS_CTE = (
+    "WITH RECURSIVE thread(post_id) AS ("
+    "SELECT :thread_id "
+    "UNION SELECT c.post_id FROM posts c JOIN thread t ON c.parent_id = t.post_id"
+    ") "
+)
+
+
+def _sql_time(value: datetime) -> str:
+    # Same format SQLAlchemy uses to store DateTime columns in SQLite
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def _scope(
+    doctor_only: bool = False,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    thread_id: Optional[str] = None,
+) -> Tuple[str, List[str], dict]:
+    """
+    (WITH clause, conditions on posts aliased "p", parameters) restricting
+    posts the way a SearchFilter restricts the vector search.
+    """
+    conditions, params = [], {}
+    if doctor_only:
+        conditions.append("p.doctor_id IS NOT NULL")
+    if since is not None:
+        conditions.append("p.created_time >= :since")
+        params["since"] = _sql_time(since)
+    if until is not None:
+        conditions.append("p.created_time < :until")
+        params["until"] = _sql_time(until)
+    if not thread_id:
+        return "", conditions, params
+    conditions.append("p.post_id IN (SELECT post_id FROM thread)")
+    params["thread_id"] = thread_id
+    return THREAD_POSTS_CTE, conditions, params
+
+
+def _posts_in_order(db: Session, post_ids: List[str]) -> List[PostModel]:
+    posts = {
+        post.post_id: post
+        for post in db.query(PostModel).filter(PostModel.post_id.in_(post_ids))
+    }
+    return [posts[post_id] for post_id in post_ids if post_id in posts]
+
 
 def post_msg(
     db: Session, post: PostCreate, user_or_doctor_id: UUID, doctor: bool = False
@@ -19,6 +73,16 @@ def post_msg(
         parent_id=str(post.parent_id) if post.parent_id else None,
     )
     db.add(db_post)
+    db.flush()
+    if db_schema.POSTS_FTS_ENABLED and db_post.text:
+        # Mirror the text into the full-text index in the same transaction
+        db.execute(
+            sql_text(
+                "INSERT INTO posts_fts (rowid, text) "
+                "SELECT rowid, :text FROM posts WHERE post_id = :post_id"
+            ),
+            {"text": db_post.text, "post_id": db_post.post_id},
+        )
     db.commit()
     db.refresh(db_post)
     return db_post
@@ -36,6 +100,31 @@ def get_posts(db: Session, skip: int = 0, limit: int = 100) -> List[PostModel]:
     return posts
 
 
+def get_recent_posts(
+    db: Session,
+    limit: int = 50,
+    doctor_only: bool = False,
+    since: datetime = None,
+    until: datetime = None,
+    thread_id: str = None,
+) -> List[PostModel]:
+    """
+    The newest posts with text in the given scope (see search_posts_text),
+    newest first.
+    """
+    with_clause, conditions, params = _scope(doctor_only, since, until, thread_id)
+    conditions.append("p.text IS NOT NULL")
+    rows = db.execute(
+        sql_text(
+            f"{with_clause}SELECT p.post_id FROM posts p "
+            f"WHERE {' AND '.join(conditions)} "
+            "ORDER BY p.created_time DESC LIMIT :limit"
+        ),
+        {**params, "limit": limit},
+    ).all()
+    return _posts_in_order(db, [row.post_id for row in rows])
+
+
 def get_post(db: Session, post_id: str) -> PostModel:
     post = (
         db.query(PostModel)
@@ -49,6 +138,58 @@ def get_post(db: Session, post_id: str) -> PostModel:
 def delete_post(db: Session, post_id: str) -> PostModel:
     post = db.query(PostModel).get(post_id)
     if post:
+        if db_schema.POSTS_FTS_ENABLED:
+            db.execute(
+                sql_text(
+                    "DELETE FROM posts_fts WHERE rowid = "
+                    "(SELECT rowid FROM posts WHERE post_id = :post_id)"
+                ),
+                {"post_id": post_id},
+            )
         db.delete(post)
         db.commit()
     return post
+
+
+def fts_query(query: str) -> str:
+    """
+    Turn free text into an FTS5 query matching any of its terms.
+    Terms are quoted so user input cannot inject FTS5 syntax.
+    """
+    terms = _FTS_TERM_RE.findall(query)[:MAX_FTS_TERMS]
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+def search_posts_text(
+    db: Session,
+    query: str,
+    limit: int = 10,
+    doctor_only: bool = False,
+    since: datetime = None,
+    until: datetime = None,
+    thread_id: str = None,
+) -> List[Tuple[PostModel, float]]:
+    """
+    Full-text search over posts ranked by BM25, best match first.
+    Returns (post, bm25 score) pairs; lower scores are better matches.
+    Scoped like a SearchFilter: doctor posts only, created in [since, until),
+    and within the thread (its root and nested replies).
+    """
+    match = fts_query(query)
+    if not db_schema.POSTS_FTS_ENABLED or not match:
+        return []
+    with_clause, conditions, params = _scope(doctor_only, since, until, thread_id)
+    rows = db.execute(
+        sql_text(
+            f"{with_clause}SELECT p.post_id, bm25(posts_fts) AS score FROM posts_fts "
+            "JOIN posts p ON p.rowid = posts_fts.rowid "
+            f"WHERE {' AND '.join(['posts_fts MATCH :match', *conditions])} "
+            "ORDER BY score LIMIT :limit"
+        ),
+        {**params, "match": match, "limit": limit},
+    ).all()
+    if not rows:
+        return []
+    posts = _posts_in_order(db, [row.post_id for row in rows])
+    scores = {row.post_id: row.score for row in rows}
+    return [(post, scores[post.post_id]) for post in posts]
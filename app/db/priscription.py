@@ -1,6 +1,9 @@
+import datetime
+import json
 from sqlalchemy.orm import Session
-from app.db.db_schema import Priscription
+from app.db.db_schema import Priscription, PriscriptionUpload
 from app.db.base import get_db
+from app.utils.image_hash import hamming
 
 
 def add_priscription(
@@ -52,6 +55,10 @@ def delete_priscription(priscription_id: int, db: Session = None):
     )
     if not priscription:
         return False
+    # Nothing cascades: a deleted prescription must not answer later uploads
+    db.query(PriscriptionUpload).filter(
+        PriscriptionUpload.priscription_id == priscription_id
+    ).delete(synchronize_session=False)
     db.delete(priscription)
     db.commit()
     return True
@@ -73,3 +80,76 @@ def get_user_priscriptions(username: str, db: Session = None):
         db.query(Priscription).filter(Priscription.username == username).all()
     )
     return priscriptions
+
+
+# Form fields that must also agree before a look-alike image counts as the
+# same prescription
+DUPLICATE_FIELDS = ("doctor_name", "visit_date", "visit_time", "hospital_name")
+
+
+def find_duplicate_upload(
+    username: str,
+    sha256: str,
+    phash: str = None,
+    max_distance: int = 0,
+    fields: dict = None,
+    db: Session = None,
+):
+    """
+    An earlier upload of the same prescription by the patient. The same
+    bytes always match. A perceptual hash at most `max_distance` bits away
+    only matches when the earlier prescription also has the same doctor,
+    hospital and visit date and time (`fields`), since different
+    prescriptions on one letterhead hash alike. Uploads of a prescription
+    deleted since never match. Returns (upload, "exact" or "perceptual") or
+    (None, None).
+    """
+    if db is None:
+        db = next(get_db())
+    uploads = db.query(PriscriptionUpload).filter(
+        PriscriptionUpload.username == username
+    )
+    for upload in uploads.filter(PriscriptionUpload.sha256 == sha256):
+        if get_priscription(upload.priscription_id, db) is not None:
+            return upload, "exact"
+    if phash is None or not fields:
+        return None, None
+    candidates = [
+        (hamming(candidate.phash, phash), candidate)
+        for candidate in uploads.filter(PriscriptionUpload.phash.isnot(None))
+    ]
+    for distance, candidate in sorted(candidates, key=lambda pair: pair[0]):
+        if distance > max_distance:
+            break
+        priscription = get_priscription(candidate.priscription_id, db)
+        if priscription is not None and all(
+            getattr(priscription, name) == fields.get(name) for name in DUPLICATE_FIELDS
+        ):
+            return candidate, "perceptual"
+    return None, None
+
+
+def add_priscription_upload(
+    username: str,
+    sha256: str,
+    phash: str,
+    priscription_id: int,
+    file_url: str,
+    record: dict = None,
+    db: Session = None,
+):
+    if db is None:
+        db = next(get_db())
+    upload = PriscriptionUpload(
+        username=username,
+        sha256=sha256,
+        phash=phash,
+        priscription_id=priscription_id,
+        file_url=file_url,
+        record=json.dumps(record) if record is not None else None,
+        created_at=datetime.datetime.now(),
+    )
+    db.add(upload)
+    db.commit()
+    db.refresh(upload)
+    return upload
@@ -2,12 +2,58 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from app.settings import settings
+from app.db.base import SessionLocal
+from app.db.medication import import_all_legacy_notifications
+from app.utils.faiss_utils import indexing_queue
+from app.api.v1.priscription import get_medical_record
+from app.utils.priscription_jobs import job_queue
+from app.utils.reminders import reminder_scheduler
+from app.utils.providers import warm_up
+from contextlib import asynccontextmanager
+import asyncio
 import importlib
 import pkgutil
 import os
+import threading
 import cloudinary
 
-app = FastAPI(debug=settings.DEBUG, title="Backend for CogniMed", version="1.0.0")
+
+def import_legacy_notifications():
+    db = SessionLocal()
+    try:
+        import_all_legacy_notifications(db)
+    finally:
+        db.close()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    indexing_queue.start()
+    # Picks up prescription jobs left queued (or interrupted) by a restart
+    job_queue.start()
+    # Old per-patient JSON files go into the tables before they are loaded
+    await asyncio.to_thread(import_legacy_notifications)
+    # Loads the active medications in the background, then ticks
+    reminder_scheduler.start()
+    # Build LLM clients and the embedding model ahead of the first request:
+    # "blocking" delays readiness until they exist, "background" does not
+    if settings.PROVIDER_WARMUP == "blocking":
+        await asyncio.to_thread(warm_up)
+    elif settings.PROVIDER_WARMUP == "background":
+        threading.Thread(target=warm_up, name="provider-warmup", daemon=True).start()
+    yield
+    reminder_scheduler.stop()
+    job_queue.stop()
+    # Drain queued posts into the FAISS index before the worker exits
+    indexing_queue.stop()
+
+
+app = FastAPI(
+    debug=settings.DEBUG,
+    title="Backend for CogniMed",
+    version="1.0.0",
+    lifespan=lifespan,
+)
 
 api_v1_path = os.path.join(os.path.dirname(__file__), "api", "v1")
 package_name = "app.api.v1"
@@ -25,6 +71,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# The record PDF used to be a static file; it is now rendered on request
+app.add_api_route(
+    "/static/{username}/Medical_Record.pdf",
+    get_medical_record,
+    methods=["GET"],
+    include_in_schema=False,
+)
+
 app.mount(
     "/static",
     StaticFiles(directory=os.path.join(os.path.dirname(__file__), "../static")),
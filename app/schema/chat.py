@@ -1,10 +1,50 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class ChatRequest(BaseModel):
     message: str
     patient_username: str | None = None
+    doctor_only: bool = Field(
+        False, description="Only use posts written by doctors as context"
+    )
+    since_days: int | None = Field(
+        None, ge=0, description="Only use posts from the last N days as context"
+    )
+    thread_id: str | None = Field(
+        None, description="Only use posts from this thread as context"
+    )
+    record_history: bool = Field(
+        False,
+        description="Also use the parts of the patient's full medical record "
+        "relevant to the question, not only their current summary",
+    )
 
 
 class ChatResponse(BaseModel):
     response: str
+
+
+class BatchChatItem(BaseModel):
+    id: str | None = Field(
+        None, description="Echoed back with the answer (defaults to the position)"
+    )
+    message: str
+    patient_username: str | None = None
+    record_history: bool = Field(
+        False,
+        description="Also use the parts of the patient's full medical record "
+        "relevant to the question, not only their current summary",
+    )
+
+
+class BatchChatRequest(BaseModel):
+    items: list[BatchChatItem] = Field(..., min_length=1)
+    doctor_only: bool = Field(
+        False, description="Only use posts written by doctors as context"
+    )
+    since_days: int | None = Field(
+        None, ge=0, description="Only use posts from the last N days as context"
+    )
+    thread_id: str | None = Field(
+        None, description="Only use posts from this thread as context"
+    )
@@ -0,0 +1,36 @@
+from datetime import date
+
+from pydantic import BaseModel, Field
+
+
+class Medication(BaseModel):
+    name: str = Field(..., example="Paracetamol")
+    dosage: str | None = Field(None, example="500mg")
+    morning: bool = False
+    afternoon: bool = False
+    evening: bool = False
+    night: bool = False
+    duration: str | None = Field(None, example="7 days")
+    instructions: str | None = Field(None, example="Take after meals")
+    start_date: date
+    end_date: date | None = Field(
+        None, description="Last day to take it; null when taken indefinitely"
+    )
+
+    class Config:
+        from_attributes = True
+
+
+class NextVisit(BaseModel):
+    visit_date: date = Field(..., example="2025-03-15")
+    reason: str | None = Field(None, example="Follow-up checkup")
+
+    class Config:
+        from_attributes = True
+
+
+class ActiveMedications(BaseModel):
+    username: str
+    on: date = Field(..., description="Day the medications are active on")
+    medications: list[Medication]
+    next_visit: NextVisit | None = None
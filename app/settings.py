@@ -18,6 +18,86 @@ class Settings(BaseSettings):
     CLOUDINARY_API_KEY: str = Field(..., env="CLOUDINARY_API_KEY")
     CLOUDINARY_API_SECRET: str = Field(..., env="CLOUDINARY_API_SECRET")
     GENAI_API_KEY: str = Field(..., env="GENAI_API_KEY")
+    EMBEDDING_BACKEND: str = Field("gemini", env="EMBEDDING_BACKEND")
+    EMBEDDING_MODEL: str | None = Field(None, env="EMBEDDING_MODEL")
+    EMBEDDING_CACHE_ENABLED: bool = Field(True, env="EMBEDDING_CACHE_ENABLED")
+    EMBEDDING_CACHE_PATH: str | None = Field(None, env="EMBEDDING_CACHE_PATH")
+    FAISS_RELOAD_CHECK_SECONDS: float = Field(1.0, env="FAISS_RELOAD_CHECK_SECONDS")
+    FAISS_COMPACTION_RATIO: float = Field(0.2, env="FAISS_COMPACTION_RATIO")
+    FAISS_COMPACTION_MIN_DEAD: int = Field(100, env="FAISS_COMPACTION_MIN_DEAD")
+    FAISS_INDEX_TYPE: str = Field("auto", env="FAISS_INDEX_TYPE")
+    FAISS_IVF_THRESHOLD: int = Field(50000, env="FAISS_IVF_THRESHOLD")
+    FAISS_PQ_THRESHOLD: int = Field(1000000, env="FAISS_PQ_THRESHOLD")
+    FAISS_RETRAIN_GROWTH: float = Field(4.0, env="FAISS_RETRAIN_GROWTH")
+    FAISS_NPROBE: int = Field(16, env="FAISS_NPROBE")
+    FAISS_HNSW_M: int = Field(32, env="FAISS_HNSW_M")
+    FAISS_HNSW_EF_CONSTRUCTION: int = Field(200, env="FAISS_HNSW_EF_CONSTRUCTION")
+    FAISS_HNSW_EF_SEARCH: int = Field(64, env="FAISS_HNSW_EF_SEARCH")
+    QUERY_EMBEDDING_CACHE_SIZE: int = Field(1024, env="QUERY_EMBEDDING_CACHE_SIZE")
+    QUERY_EMBEDDING_CACHE_TTL_SECONDS: float | None = Field(
+        3600.0, env="QUERY_EMBEDDING_CACHE_TTL_SECONDS"
+    )
+    RETRIEVAL_CACHE_SIZE: int = Field(1024, env="RETRIEVAL_CACHE_SIZE")
+    RETRIEVAL_CACHE_TTL_SECONDS: float | None = Field(
+        300.0, env="RETRIEVAL_CACHE_TTL_SECONDS"
+    )
+    FAISS_INDEX_BATCH_SIZE: int = Field(32, env="FAISS_INDEX_BATCH_SIZE")
+    FAISS_INDEX_BATCH_MS: int = Field(200, env="FAISS_INDEX_BATCH_MS")
+    FAISS_PERSIST_EVERY: int = Field(100, env="FAISS_PERSIST_EVERY")
+    FAISS_PERSIST_SECONDS: float = Field(30.0, env="FAISS_PERSIST_SECONDS")
+    FAISS_SHARDED: bool = Field(True, env="FAISS_SHARDED")
+    FAISS_SHARD_SEARCH_WORKERS: int = Field(4, env="FAISS_SHARD_SEARCH_WORKERS")
+    FAISS_MMAP_SEALED_SHARDS: bool = Field(True, env="FAISS_MMAP_SEALED_SHARDS")
+    CHAT_CONTEXT_TOKEN_BUDGET: int = Field(6000, env="CHAT_CONTEXT_TOKEN_BUDGET")
+    CHAT_RECORD_TOKEN_SHARE: float = Field(0.5, env="CHAT_RECORD_TOKEN_SHARE")
+    CHAT_RECENCY_HALF_LIFE_DAYS: float = Field(90.0, env="CHAT_RECENCY_HALF_LIFE_DAYS")
+    CHAT_CANDIDATE_POSTS: int = Field(30, env="CHAT_CANDIDATE_POSTS")
+    CHAT_FALLBACK_POSTS: int = Field(50, env="CHAT_FALLBACK_POSTS")
+    LLM_MAX_CONCURRENCY: int = Field(8, env="LLM_MAX_CONCURRENCY")
+    LLM_MAX_QUEUE: int = Field(32, env="LLM_MAX_QUEUE")
+    LLM_QUEUE_TIMEOUT_SECONDS: float = Field(10.0, env="LLM_QUEUE_TIMEOUT_SECONDS")
+    PROVIDER_WARMUP: str = Field("background", env="PROVIDER_WARMUP")
+    CHAT_RESPONSE_CACHE_SIZE: int = Field(1024, env="CHAT_RESPONSE_CACHE_SIZE")
+    CHAT_RESPONSE_CACHE_TTL_SECONDS: float | None = Field(
+        30.0, env="CHAT_RESPONSE_CACHE_TTL_SECONDS"
+    )
+    CHAT_BATCH_MAX_ITEMS: int = Field(500, env="CHAT_BATCH_MAX_ITEMS")
+    CHAT_BATCH_CONCURRENCY: int = Field(4, env="CHAT_BATCH_CONCURRENCY")
+    JOB_QUEUE_PATH: str | None = Field(None, env="JOB_QUEUE_PATH")
+    JOB_SPOOL_DIR: str = Field("job_spool", env="JOB_SPOOL_DIR")
+    JOB_WORKERS: int = Field(2, env="JOB_WORKERS")
+    JOB_MAX_ATTEMPTS: int = Field(3, env="JOB_MAX_ATTEMPTS")
+    JOB_RETRY_BACKOFF_SECONDS: float = Field(5.0, env="JOB_RETRY_BACKOFF_SECONDS")
+    JOB_LEASE_SECONDS: float = Field(600.0, env="JOB_LEASE_SECONDS")
+    MEDICATION_DEFAULT_DAYS: int = Field(30, env="MEDICATION_DEFAULT_DAYS")
+    REMINDER_SLOTS: str = Field(
+        "morning=08:00,afternoon=13:00,evening=18:00,night=21:00",
+        env="REMINDER_SLOTS",
+    )
+    REMINDER_TICK_SECONDS: float = Field(30.0, env="REMINDER_TICK_SECONDS")
+    REMINDER_OUTBOX_SIZE: int = Field(50, env="REMINDER_OUTBOX_SIZE")
+    UPLOAD_DEDUP_MAX_DISTANCE: int = Field(6, env="UPLOAD_DEDUP_MAX_DISTANCE")
+    RECORD_RENDER_GRACE_SECONDS: float = Field(300.0, env="RECORD_RENDER_GRACE_SECONDS")
+    HYBRID_VECTOR_FAILURE_THRESHOLD: int = Field(
+        3, env="HYBRID_VECTOR_FAILURE_THRESHOLD"
+    )
+    RECORD_CHUNK_CHARS: int = Field(800, env="RECORD_CHUNK_CHARS")
+    RECORD_TOP_CHUNKS: int = Field(4, env="RECORD_TOP_CHUNKS")
+    LLM_BACKEND: str = Field("gemini", env="LLM_BACKEND")
+    UPLOAD_BACKEND: str = Field("cloudinary", env="UPLOAD_BACKEND")
+    FAKE_LLM_LATENCY_SECONDS: float = Field(0.5, env="FAKE_LLM_LATENCY_SECONDS")
+    FAKE_LLM_CHUNK_SECONDS: float = Field(0.02, env="FAKE_LLM_CHUNK_SECONDS")
+    FAKE_LLM_RESPONSE_WORDS: int = Field(80, env="FAKE_LLM_RESPONSE_WORDS")
+    FAKE_EMBEDDING_LATENCY_SECONDS: float = Field(
+        0.05, env="FAKE_EMBEDDING_LATENCY_SECONDS"
+    )
+    HYBRID_VECTOR_TIMEOUT_SECONDS: float = Field(
+        1.5, env="HYBRID_VECTOR_TIMEOUT_SECONDS"
+    )
+    HYBRID_LEXICAL_COOLDOWN_SECONDS: float = Field(
+        30.0, env="HYBRID_LEXICAL_COOLDOWN_SECONDS"
+    )
+    HYBRID_VECTOR_WORKERS: int = Field(4, env="HYBRID_VECTOR_WORKERS")
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
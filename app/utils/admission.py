@@ -0,0 +1,108 @@
+"""
+Admission control for upstream LLM calls.
+
+At most `max_concurrent` calls run at once. Up to `max_queue` further
+requests wait (for at most `queue_timeout` seconds) for a free slot;
+anything beyond that is shed right away. Shed requests get a 429 when the
+queue is full and a 503 when they waited too long, both with Retry-After.
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+from app.utils.metrics import LatencyRecorder
+
+
+class LLMOverloaded(Exception):
+    """Raised when an LLM call is not admitted."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    def to_http(self) -> HTTPException:
+        return HTTPException(
+            status_code=self.status_code,
+            detail=self.detail,
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+
+class LLMAdmission:
+    """
+    Caps concurrent upstream LLM calls. Must be used from the event loop.
+    """
+
+    def __init__(
+        self, max_concurrent: int = 8, max_queue: int = 32, queue_timeout: float = 10.0
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._in_flight = 0
+        self._waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.queue_wait = LatencyRecorder()
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, int(self.queue_timeout))
+
+    async def acquire(self):
+        """
+        Wait for a free slot, or raise LLMOverloaded.
+        """
+        if self._in_flight >= self.max_concurrent and self._waiting >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise LLMOverloaded(
+                429, "Too many chat requests, please retry shortly", self.retry_after
+            )
+        start = time.perf_counter()
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected_timeout += 1
+            raise LLMOverloaded(
+                503, "Chat is at capacity, please retry shortly", self.retry_after
+            )
+        finally:
+            self._waiting -= 1
+        self._in_flight += 1
+        self.admitted += 1
+        self.queue_wait.record(time.perf_counter() - start)
+
+    def release(self):
+        self._in_flight -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Hold a slot for the duration of the block.
+        """
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "queue_wait": self.queue_wait.stats(),
+        }
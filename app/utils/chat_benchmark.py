@@ -0,0 +1,323 @@
+"""
+End-to-end throughput and latency benchmark of the chat and prescription
+endpoints under concurrent clients.
+
+    python -m app.utils.chat_benchmark --concurrency 16 --requests 200
+    python -m app.utils.chat_benchmark --llm-latency 0 --embedding-latency 0
+    python -m app.utils.chat_benchmark --url http://localhost:8000
+
+By default the app runs in-process (through httpx's ASGI transport) in a
+scratch directory with the offline stand-ins for Gemini (LLM_BACKEND=fake,
+EMBEDDING_BACKEND=fake, UPLOAD_BACKEND=local) and --posts synthetic posts.
+Upstream latency is then exactly what --llm-latency / --embedding-latency
+say, so a regression in our own code shows up on its own; with both at 0
+only our own code is measured. With --url the requests go to a running
+server instead, configured and seeded however it was started.
+
+Uploads are timed until their background processing job finishes.
+
+For every endpoint it reports throughput and p50/p95/p99 latency of the
+successful requests, and how many were rejected (429/503) or failed. The
+ASGI transport buffers responses, so time to first token of the streaming
+endpoints is only meaningful with --url.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import httpx
+
+from app.utils.metrics import LatencyRecorder
+
+ENDPOINTS = ("upload", "chat", "chat_stream", "ask_medicine")
+
+# How often an upload's job status is polled
+UPLOAD_POLL_SECONDS = 0.05
+
+QUESTIONS = (
+    "What should I do about a persistent headache",
+    "Can I take paracetamol with my current medicines",
+    "How can I lower my blood pressure",
+    "What are common side effects of metformin",
+    "Is it safe to exercise after a fever",
+    "How long does an amoxicillin course usually last",
+    "What foods help with acid reflux",
+    "When should I see a doctor about chest pain",
+)
+
+
+def configure_offline(args, workdir: str):
+    """
+    Point the app at the offline stand-ins and a scratch directory. Must run
+    before anything imports app.settings.
+    """
+    os.chdir(workdir)
+    defaults = {
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'benchmark.db')}",
+        "SECRET_KEY": "benchmark",
+        "CLOUDINARY_CLOUD_NAME": "unused",
+        "CLOUDINARY_API_KEY": "unused",
+        "CLOUDINARY_API_SECRET": "unused",
+        "GENAI_API_KEY": "unused",
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+    os.environ.update(
+        {
+            "LLM_BACKEND": "fake",
+            "EMBEDDING_BACKEND": "fake",
+            "UPLOAD_BACKEND": "local",
+            "PROVIDER_WARMUP": "blocking",
+            "FAKE_LLM_LATENCY_SECONDS": str(args.llm_latency),
+            "FAKE_LLM_CHUNK_SECONDS": str(args.llm_chunk_latency),
+            "FAKE_EMBEDDING_LATENCY_SECONDS": str(args.embedding_latency),
+        }
+    )
+
+
+def seed_posts(n: int, seed: int):
+    """
+    Insert `n` synthetic posts and build the FAISS index over them.
+    """
+    import uuid
+
+    from app.db.base import SessionLocal
+    from app.db.post import post_msg
+    from app.schema.post import PostCreate
+    from app.utils.fake_llm import fake_completion
+    from app.utils.faiss_utils import build_faiss_index, post_metadata
+
+    rng = random.Random(seed)
+    authors = [(uuid.uuid4(), i % 3 == 0) for i in range(20)]
+    texts, metadatas = [], []
+    db = SessionLocal()
+    try:
+        for i in range(n):
+            author, doctor = rng.choice(authors)
+            text = f"{rng.choice(QUESTIONS)}? {fake_completion(f'post {i}', 30)}"
+            post = post_msg(db, PostCreate(text=text[:500]), author, doctor=doctor)
+            texts.append(post.text)
+            metadatas.append(post_metadata(post))
+    finally:
+        db.close()
+    if texts:
+        build_faiss_index(texts, metadatas)
+
+
+def image_bytes(i: int) -> bytes:
+    # JPEG magic plus bytes unique to this request
+    return b"\xff\xd8\xff\xe0" + random.Random(i).randbytes(2048)
+
+
+def question(i: int, pool: int) -> str:
+    j = i % pool
+    return f"{QUESTIONS[j % len(QUESTIONS)]} (case {j})?"
+
+
+def patient(i: int, patients: int) -> str:
+    return f"benchmark-patient-{i % patients}"
+
+
+async def call_upload(client: httpx.AsyncClient, i: int, args):
+    response = await client.post(
+        "/priscription/upload",
+        data={
+            "doctor_name": "Dr. Benchmark",
+            "visit_date": "2025-01-01",
+            "visit_time": "10:00",
+            "hospital_name": "Benchmark Hospital",
+            "username": patient(i, args.patients),
+        },
+        files={"file": ("prescription.jpg", image_bytes(i), "image/jpeg")},
+    )
+    if response.status_code != 202:
+        return response.status_code, None
+    # Processing runs as a background job; the request is done when it is
+    status_url = response.json()["status_url"]
+    while True:
+        await asyncio.sleep(UPLOAD_POLL_SECONDS)
+        job = (await client.get(status_url)).json()
+        if job["state"] in ("succeeded", "skipped"):
+            return 200, None
+        if job["state"] == "failed":
+            return 500, None
+
+
+async def call_chat(client: httpx.AsyncClient, i: int, args):
+    response = await client.post(
+        "/chat/",
+        json={
+            "message": question(i, args.questions),
+            "patient_username": patient(i, args.patients),
+        },
+    )
+    return response.status_code, None
+
+
+async def call_chat_stream(client: httpx.AsyncClient, i: int, args):
+    started = time.perf_counter()
+    ttft = None
+    body = {
+        "message": question(i, args.questions),
+        "patient_username": patient(i, args.patients),
+    }
+    async with client.stream("POST", "/chat/stream", json=body) as response:
+        if response.status_code != 200:
+            return response.status_code, None
+        async for line in response.aiter_lines():
+            if line.startswith("event: error"):
+                return 500, ttft
+            if ttft is None and line.startswith("data:"):
+                ttft = time.perf_counter() - started
+    return response.status_code, ttft
+
+
+async def call_ask_medicine(client: httpx.AsyncClient, i: int, args):
+    response = await client.post(
+        "/chat/ask-medicine",
+        data={"patient_username": patient(i, args.patients)},
+        files={"file": ("pill.jpg", image_bytes(i), "image/jpeg")},
+    )
+    return response.status_code, None
+
+
+CALLS = {
+    "upload": call_upload,
+    "chat": call_chat,
+    "chat_stream": call_chat_stream,
+    "ask_medicine": call_ask_medicine,
+}
+
+
+async def run_endpoint(client: httpx.AsyncClient, name: str, args) -> dict:
+    """
+    Send args.requests requests to one endpoint from args.concurrency
+    concurrent clients.
+    """
+    call = CALLS[name]
+    latency = LatencyRecorder(window=args.requests)
+    ttft = LatencyRecorder(window=args.requests)
+    counts = {"ok": 0, "rejected": 0, "failed": 0}
+    next_request = iter(range(args.requests))
+
+    async def client_loop():
+        for i in next_request:
+            started = time.perf_counter()
+            try:
+                status, first_token = await call(client, i, args)
+            except httpx.HTTPError:
+                status, first_token = None, None
+            if status == 200:
+                counts["ok"] += 1
+                latency.record(time.perf_counter() - started)
+                if first_token is not None:
+                    ttft.record(first_token)
+            elif status in (429, 503):
+                counts["rejected"] += 1
+            else:
+                counts["failed"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(args.concurrency)))
+    seconds = time.perf_counter() - started
+    return {
+        "endpoint": name,
+        "seconds": seconds,
+        "throughput": counts["ok"] / seconds if seconds else 0.0,
+        **counts,
+        "latency": latency.stats(),
+        "ttft": ttft.stats(),
+    }
+
+
+def print_results(results):
+    print(
+        f"{'endpoint':<14} {'ok':>6} {'rej':>5} {'fail':>5} {'req/s':>8} "
+        f"{'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9} {'ttft_p50':>9}"
+    )
+    for result in results:
+        latency, ttft = result["latency"], result["ttft"]
+        cells = [
+            f"{latency[key]:>9.1f}" if key in latency else f"{'-':>9}"
+            for key in ("p50_ms", "p95_ms", "p99_ms")
+        ]
+        cells.append(f"{ttft['p50_ms']:>9.1f}" if "p50_ms" in ttft else f"{'-':>9}")
+        print(
+            f"{result['endpoint']:<14} {result['ok']:>6} {result['rejected']:>5} "
+            f"{result['failed']:>5} {result['throughput']:>8.1f} " + " ".join(cells)
+        )
+
+
+async def run(args, app=None):
+    endpoints = args.endpoints.split(",")
+    if app is not None:
+        transport = httpx.ASGITransport(app=app)
+        client = httpx.AsyncClient(
+            transport=transport, base_url="http://benchmark", timeout=args.timeout
+        )
+    else:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    results = []
+    async with client:
+        for name in endpoints:
+            result = await run_endpoint(client, name, args)
+            print(
+                f"{name}: {result['ok']}/{args.requests} ok in {result['seconds']:.1f}s"
+            )
+            results.append(result)
+    return results
+
+
+async def run_in_process(args):
+    from app.main import app
+
+    # Run the app's startup and shutdown as a server would
+    async with app.router.lifespan_context(app):
+        return await run(args, app)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", help="Benchmark a running server instead")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument(
+        "--questions",
+        type=int,
+        default=50,
+        help="Distinct chat questions; repeats are coalesced and cached",
+    )
+    parser.add_argument("--patients", type=int, default=20)
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--llm-chunk-latency", type=float, default=0.02)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--workdir", help="Scratch directory (default: a new one)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    for name in args.endpoints.split(","):
+        if name not in CALLS:
+            parser.error(f"unknown endpoint {name!r}, expected one of {ENDPOINTS}")
+
+    if args.url:
+        results = asyncio.run(run(args))
+    else:
+        workdir = args.workdir or tempfile.mkdtemp(prefix="chat-benchmark-")
+        os.makedirs(workdir, exist_ok=True)
+        configure_offline(args, os.path.abspath(workdir))
+        print(f"Working in {workdir}; seeding {args.posts} posts...")
+        seed_posts(args.posts, args.seed)
+        results = asyncio.run(run_in_process(args))
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
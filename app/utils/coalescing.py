@@ -0,0 +1,77 @@
+"""
+Single-flight request coalescing for async handlers.
+
+Concurrent calls with the same key share one in-flight computation, and
+its result is kept for a short time so calls arriving right after it
+finishes are answered from memory as well.
+"""
+
+import asyncio
+import threading
+from typing import Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+from app.utils.cache import TTLCache
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent async computations by key. Must be used from
+    a single event loop.
+    """
+
+    def __init__(self, cache_size: int = 1024, cache_ttl: Optional[float] = 30.0):
+        self.results = TTLCache(cache_size, cache_ttl)
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.leaders = 0
+        self.coalesced = 0
+        self.cached = 0
+
+    async def run(self, key: Hashable, compute: Callable[[], Awaitable[T]]) -> T:
+        """
+        Return the result of `compute()` for this key, sharing it with every
+        concurrent (or recent) caller using the same key. Failures are
+        shared by the callers waiting on them but not cached.
+        """
+        with self._lock:
+            self.requests += 1
+        cached = self.results.get(key)
+        if cached is not None:
+            with self._lock:
+                self.cached += 1
+            return cached
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._lead(key, compute))
+            self._in_flight[key] = task
+            with self._lock:
+                self.leaders += 1
+        else:
+            with self._lock:
+                self.coalesced += 1
+        # Shielded: a caller that goes away does not cancel the shared work
+        return await asyncio.shield(task)
+
+    async def _lead(self, key: Hashable, compute: Callable[[], Awaitable[T]]) -> T:
+        try:
+            result = await compute()
+            self.results.set(key, result)
+            return result
+        finally:
+            self._in_flight.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            served = self.coalesced + self.cached
+            return {
+                "requests": self.requests,
+                "in_flight": len(self._in_flight),
+                "upstream_calls": self.leaders,
+                "coalesced": self.coalesced,
+                "cache_hits": self.cached,
+                "coalescing_rate": served / self.requests if self.requests else 0.0,
+                "cache": self.results.stats(),
+            }
@@ -0,0 +1,277 @@
+"""
+Builds chat prompts that always fit a token budget.
+
+Candidate posts are ranked by retrieval score, recency and doctor
+authorship, near-duplicates are dropped, and posts are added best first
+until the budget is used up. The patient record gets a bounded share of
+the budget and is truncated deterministically: its beginning (patient
+information) and its end (the latest visits) are kept.
+"""
+
+import datetime
+import math
+import re
+import threading
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+# Rough size of a token for Gemini-style tokenizers on English text
+CHARS_PER_TOKEN = 4
+
+# Weights of the ranking signals; each signal is scaled to [0, 1]
+RETRIEVAL_WEIGHT = 1.0
+RECENCY_WEIGHT = 0.3
+DOCTOR_WEIGHT = 0.2
+
+# Posts sharing this much of their word 3-grams are treated as duplicates
+DUPLICATE_SIMILARITY = 0.8
+
+# Share of the truncated record taken from its beginning; the rest is its end
+RECORD_HEAD_SHARE = 0.3
+
+RECORD_OMITTED_MARKER = "\n[... earlier record entries omitted ...]\n"
+TRUNCATED_MARKER = " [...]"
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap, deterministic token estimate; no tokenizer call per request.
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cut text to at most `max_tokens`, at a word boundary where possible.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    max_chars = max(0, max_tokens * CHARS_PER_TOKEN - len(TRUNCATED_MARKER))
+    cut = text[:max_chars]
+    if " " in cut:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut + TRUNCATED_MARKER if cut else ""
+
+
+def truncate_record(text: str, max_tokens: int) -> Tuple[str, bool]:
+    """
+    Fit a medical record into `max_tokens`, keeping its first and last lines
+    (patient information and most recent entries). Returns (text, truncated).
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text, False
+    available = max_tokens * CHARS_PER_TOKEN - len(RECORD_OMITTED_MARKER)
+    if available <= 0:
+        return "", True
+    lines = text.splitlines()
+    head_budget = int(available * RECORD_HEAD_SHARE)
+    head, used = [], 0
+    for line in lines:
+        if used + len(line) + 1 > head_budget:
+            break
+        head.append(line)
+        used += len(line) + 1
+    tail_budget = available - used
+    tail, used = [], 0
+    for line in reversed(lines[len(head) :]):
+        if used + len(line) + 1 > tail_budget:
+            break
+        tail.append(line)
+        used += len(line) + 1
+    tail.reverse()
+    if not tail:
+        # The latest line alone is too long: keep its end
+        tail = [lines[-1][-tail_budget:]] if tail_budget > 0 else []
+    return "\n".join(head) + RECORD_OMITTED_MARKER + "\n".join(tail), True
+
+
+def _shingles(text: str) -> set:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < 3:
+        return {" ".join(words)}
+    return {" ".join(words[i : i + 3]) for i in range(len(words) - 2)}
+
+
+def _similarity(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _parse_time(value) -> Optional[datetime.datetime]:
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    return None
+
+
+def compose_prompt(
+    question: str, record_text: str, posts_text: str, with_record: bool = None
+) -> str:
+    """
+    The chat prompt around the patient's record (if any) and the posts.
+    """
+    if with_record is None:
+        with_record = bool(record_text)
+    if with_record:
+        return (
+            "Here is the patient's medical record (PDF):\n"
+            f"{record_text}\n\n"
+            "Here are the most relevant messages posted by users as context for your answer:\n"
+            f"{posts_text}\n\n"
+            f"User question: {question}\n"
+            "Answer based on the above medical record and messages."
+        )
+    return (
+        "Here are the most relevant messages posted by users as context for your answer:\n"
+        f"{posts_text}\n\n"
+        f"User question: {question}\n"
+        "Answer based on the above messages."
+    )
+
+
+@dataclass
+class AssembledContext:
+    prompt: str
+    tokens: int
+    posts_used: int
+    posts_dropped: int
+    duplicates_dropped: int
+    record_tokens: int
+    record_truncated: bool
+
+
+class ContextAssembler:
+    """
+    Ranks candidate posts and composes the chat prompt within `token_budget`.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 6000,
+        record_share: float = 0.5,
+        recency_half_life_days: float = 90.0,
+    ):
+        self.token_budget = token_budget
+        self.record_share = record_share
+        self.recency_half_life_days = recency_half_life_days
+        self._lock = threading.Lock()
+        self._prompts = 0
+        self._total_tokens = 0
+        self._max_tokens = 0
+        self._records_truncated = 0
+
+    def rank_posts(
+        self, candidates: List[Tuple[str, dict]], now: datetime.datetime = None
+    ) -> List[Tuple[float, str]]:
+        """
+        Score (text, metadata) candidates, best first. The retrieval signal is
+        the metadata "score" when present, otherwise the candidate's rank.
+        """
+        now = now or datetime.datetime.now()
+        scores = [(metadata or {}).get("score") for _, metadata in candidates]
+        top_score = max((score for score in scores if score), default=None)
+        ranked = []
+        for position, (text, metadata) in enumerate(candidates):
+            if not text:
+                continue
+            metadata = metadata or {}
+            if top_score:
+                retrieval = (metadata.get("score") or 0.0) / top_score
+            else:
+                retrieval = 1.0 / (1 + position)
+            recency = 0.0
+            created = _parse_time(metadata.get("created_time"))
+            if created is not None:
+                age_days = max(0.0, (now - created).total_seconds() / 86400)
+                recency = 0.5 ** (age_days / self.recency_half_life_days)
+            doctor = 1.0 if metadata.get("doctor_id") else 0.0
+            score = (
+                RETRIEVAL_WEIGHT * retrieval
+                + RECENCY_WEIGHT * recency
+                + DOCTOR_WEIGHT * doctor
+            )
+            ranked.append((score, position, text))
+        # Position breaks ties so the order is deterministic
+        ranked.sort(key=lambda item: (-item[0], item[1]))
+        return [(score, text) for score, _, text in ranked]
+
+    def assemble(
+        self,
+        question: str,
+        candidates: List[Tuple[str, dict]],
+        record_text: str = "",
+    ) -> AssembledContext:
+        """
+        Compose the prompt for a question from candidate posts and the
+        patient's record, staying within the token budget.
+        """
+        # The question may take at most a quarter of the budget
+        question = truncate_to_tokens(question, self.token_budget // 4)
+        remaining = self.token_budget - estimate_tokens(
+            compose_prompt(question, "", "", with_record=bool(record_text))
+        )
+
+        record_truncated = False
+        if record_text:
+            record_text, record_truncated = truncate_record(
+                record_text, max(0, int(remaining * self.record_share))
+            )
+        remaining -= estimate_tokens(record_text)
+
+        lines, kept_shingles = [], []
+        duplicates = 0
+        ranked = self.rank_posts(candidates)
+        for _, text in ranked:
+            shingles = _shingles(text)
+            if any(
+                _similarity(shingles, kept) >= DUPLICATE_SIMILARITY
+                for kept in kept_shingles
+            ):
+                duplicates += 1
+                continue
+            line = f"- {text}"
+            # +1 for the newline joining it to the previous post
+            cost = estimate_tokens(line) + 1
+            if cost > remaining:
+                continue
+            lines.append(line)
+            kept_shingles.append(shingles)
+            remaining -= cost
+
+        prompt = compose_prompt(
+            question, record_text, "\n".join(lines), with_record=bool(record_text)
+        )
+        context = AssembledContext(
+            prompt=prompt,
+            tokens=estimate_tokens(prompt),
+            posts_used=len(lines),
+            posts_dropped=len(ranked) - len(lines) - duplicates,
+            duplicates_dropped=duplicates,
+            record_tokens=estimate_tokens(record_text),
+            record_truncated=record_truncated,
+        )
+        with self._lock:
+            self._prompts += 1
+            self._total_tokens += context.tokens
+            self._max_tokens = max(self._max_tokens, context.tokens)
+            self._records_truncated += int(record_truncated)
+        return context
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "token_budget": self.token_budget,
+                "prompts": self._prompts,
+                "avg_prompt_tokens": (
+                    self._total_tokens / self._prompts if self._prompts else 0.0
+                ),
+                "max_prompt_tokens": self._max_tokens,
+                "records_truncated": self._records_truncated,
+            }
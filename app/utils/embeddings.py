@@ -0,0 +1,312 @@
+"""
+Pluggable embedding providers with a persistent content-hash cache.
+
+Supported backends (EMBEDDING_BACKEND):
+- "gemini": Google Generative AI embeddings (network call per batch)
+- "local": a sentence-transformers model running in-process
+- "hashing": deterministic feature hashing, for tests and offline use
+- "fake": hashing with FAKE_EMBEDDING_LATENCY_SECONDS added, for benchmarks
+
+Every provider is wrapped in CachedEmbeddings, which stores vectors in SQLite
+keyed by (model, sha256(text)) so the same text is never embedded twice.
+"""
+
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.settings import settings
+
+DEFAULT_MODELS = {
+    "gemini": "models/embedding-001",
+    "local": "sentence-transformers/all-MiniLM-L6-v2",
+    "hashing": "hashing-384",
+    "fake": "hashing-384",
+}
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), "embedding_cache.sqlite3")
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic embeddings built by hashing word unigrams and bigrams into
+    a fixed number of buckets. No model, no network; similar texts still get
+    similar vectors, which is enough for tests and offline development.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        tokens = _TOKEN_RE.findall(text.lower())
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            sign = 1.0 if value & 1 else -1.0
+            vector[(value >> 1) % self.dim] += sign
+        norm = math.sqrt(sum(v * v for v in vector))
+        if norm:
+            vector = [v / norm for v in vector]
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
+
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """Local sentence-transformers model, loaded on first use."""
+
+    def __init__(self, model_name: str, batch_size: int = 64):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+
+                    self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        vectors = self._get_model().encode(
+            texts, batch_size=self.batch_size, normalize_embeddings=True
+        )
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
+
+
+class GeminiEmbeddings(Embeddings):
+    """
+    Google Generative AI embeddings that can also embed many queries in one
+    batched call (embed_query only takes one).
+    """
+
+    def __init__(self, model_name: str):
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+        self.client = GoogleGenerativeAIEmbeddings(
+            model=model_name, google_api_key=settings.GENAI_API_KEY
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.client.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.client.embed_query(text)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self.client.embed_documents(texts, task_type="RETRIEVAL_QUERY")
+
+
+def embed_queries(embedding: Embeddings, texts: List[str]) -> List[List[float]]:
+    """
+    Query embeddings of many texts, in one call if the provider supports it.
+    """
+    batch = getattr(embedding, "embed_queries", None)
+    if batch is not None:
+        return batch(texts)
+    return [embedding.embed_query(text) for text in texts]
+
+
+class EmbeddingCache:
+    """
+    Persistent SQLite cache of embeddings keyed by (model, sha256(text)).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, "
+            "text_hash TEXT NOT NULL, "
+            "vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+
+    def get_many(self, model: str, text_hashes: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(text_hashes), 500):
+            chunk = text_hashes[start : start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *chunk],
+                ).fetchall()
+            for h, blob in rows:
+                found[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, model: str, items: Dict[str, List[float]]):
+        if not items:
+            return
+        rows = [
+            (model, h, np.asarray(vector, dtype=np.float32).tobytes())
+            for h, vector in items.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) "
+                "VALUES (?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding provider with an EmbeddingCache. Only texts missing
+    from the cache are sent to the provider, in a single batched call.
+    """
+
+    def __init__(
+        self, provider: Embeddings, model_name: str, cache: Optional[EmbeddingCache]
+    ):
+        self.provider = provider
+        self.model_name = model_name
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.cache is None:
+            self.misses += len(texts)
+            return self.provider.embed_documents(texts)
+        hashes = [text_hash(text) for text in texts]
+        found = self.cache.get_many(self.model_name, list(set(hashes)))
+        missing: Dict[str, str] = {}
+        for text, h in zip(texts, hashes):
+            if h not in found and h not in missing:
+                missing[h] = text
+        if missing:
+            vectors = self.provider.embed_documents(list(missing.values()))
+            new_items = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model_name, new_items)
+            found.update(new_items)
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        return [found[h] for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        # Some providers embed queries differently from documents
+        model = f"{self.model_name}:query"
+        h = text_hash(text)
+        if self.cache is not None:
+            found = self.cache.get_many(model, [h])
+            if h in found:
+                self.hits += 1
+                return found[h]
+        self.misses += 1
+        vector = self.provider.embed_query(text)
+        if self.cache is not None:
+            self.cache.put_many(model, {h: vector})
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        embed_query() for many texts; the ones not cached are embedded in a
+        single provider call.
+        """
+        model = f"{self.model_name}:query"
+        hashes = [text_hash(text) for text in texts]
+        found = {}
+        if self.cache is not None:
+            found = self.cache.get_many(model, list(set(hashes)))
+        missing: Dict[str, str] = {}
+        for text, h in zip(texts, hashes):
+            if h not in found and h not in missing:
+                missing[h] = text
+        if missing:
+            vectors = embed_queries(self.provider, list(missing.values()))
+            new_items = dict(zip(missing.keys(), vectors))
+            if self.cache is not None:
+                self.cache.put_many(model, new_items)
+            found.update(new_items)
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        return [found[h] for h in hashes]
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model_name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "cached_vectors": self.cache.count() if self.cache is not None else 0,
+        }
+
+
+def create_embedding_provider(backend: str, model_name: str) -> Embeddings:
+    """
+    Create the raw (uncached) embedding provider for the given backend.
+    """
+    if backend == "gemini":
+        return GeminiEmbeddings(model_name)
+    if backend == "local":
+        return SentenceTransformerEmbeddings(model_name)
+    if backend == "hashing":
+        dim = int(model_name.rsplit("-", 1)[-1]) if model_name[-1].isdigit() else 384
+        return HashingEmbeddings(dim=dim)
+    if backend == "fake":
+        from app.utils.fake_llm import FakeEmbeddings
+
+        dim = int(model_name.rsplit("-", 1)[-1]) if model_name[-1].isdigit() else 384
+        return FakeEmbeddings(dim=dim)
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+
+def get_embedding_model() -> CachedEmbeddings:
+    """
+    Build the configured embedding provider wrapped in the persistent cache.
+    """
+    backend = settings.EMBEDDING_BACKEND
+    model_name = settings.EMBEDDING_MODEL or DEFAULT_MODELS.get(backend, "")
+    provider = create_embedding_provider(backend, model_name)
+    cache = None
+    if settings.EMBEDDING_CACHE_ENABLED:
+        cache = EmbeddingCache(settings.EMBEDDING_CACHE_PATH or DEFAULT_CACHE_PATH)
+    return CachedEmbeddings(provider, f"{backend}:{model_name}", cache)
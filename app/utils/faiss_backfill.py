@@ -1,40 +1,229 @@
 """
 Script to backfill the FAISS index with all existing posts from the database.
 Run this script once to initialize the vector index for semantic search.
+
+Posts are streamed with keyset paging on post_id and embedded in fixed-size
+batches that are appended to a staging index, so memory stays flat no matter
+how many posts there are. The staging index and the last indexed post_id
+are checkpointed regularly; a killed run can continue with --resume. The
+finished index is then published to the live index path.
+
+With --retry-failed it only re-indexes the posts the indexing queue gave
+up on (its dead-letter file) in the live index: posts still in the
+database are embedded again, the others are removed from the index.
 """
 
-import sys
+import argparse
+import json
 import os
+import shutil
+import sys
+import time
 from sqlalchemy.orm import Session
 from app.db.base import SessionLocal
 from app.db.db_schema import Post as PostModel
-from app.utils.faiss_utils import build_faiss_index
+from app.utils.faiss_index_manager import FaissIndexManager
+from app.utils.faiss_utils import (
+    FAISS_DEAD_LETTER_PATH,
+    FAISS_INDEX_PATH,
+    embedding_model,
+    index_manager,
+    post_metadata,
+)
+from app.utils.indexing_queue import (
+    finish_dead_letters,
+    return_dead_letters,
+    take_dead_letters,
+)
+
+STAGING_INDEX_PATH = FAISS_INDEX_PATH + ".backfill"
+CHECKPOINT_PATH = os.path.join(STAGING_INDEX_PATH, "checkpoint.json")
+MAX_BATCH_ATTEMPTS = 3
+
+
+def iter_post_batches(db_session: Session, batch_size: int, after_post_id=None):
+    """
+    Yield batches of posts ordered by post_id, starting after `after_post_id`.
+    Only one batch is held in memory at a time.
+    """
+    while True:
+        query = db_session.query(
+            PostModel.post_id,
+            PostModel.user_id,
+            PostModel.doctor_id,
+            PostModel.parent_id,
+            PostModel.text,
+            PostModel.created_time,
+        ).order_by(PostModel.post_id)
+        if after_post_id is not None:
+            query = query.filter(PostModel.post_id > after_post_id)
+        batch = query.limit(batch_size).all()
+        if not batch:
+            return
+        yield batch
+        after_post_id = batch[-1].post_id
+
+
+def load_checkpoint() -> dict | None:
+    if not os.path.exists(CHECKPOINT_PATH):
+        return None
+    with open(CHECKPOINT_PATH, "r") as f:
+        return json.load(f)
+
+
+def save_checkpoint(last_post_id: str, indexed: int):
+    tmp_path = CHECKPOINT_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"last_post_id": last_post_id, "indexed": indexed}, f)
+    os.replace(tmp_path, CHECKPOINT_PATH)
+
+
+def index_batch(staging: FaissIndexManager, batch):
+    posts = [post for post in batch if post.text]
+    if not posts:
+        return 0
+    for attempt in range(1, MAX_BATCH_ATTEMPTS + 1):
+        try:
+            staging.add_texts(
+                [post.text for post in posts],
+                metadatas=[post_metadata(post) for post in posts],
+                save=False,
+            )
+            return len(posts)
+        except Exception as e:
+            print(
+                f"[FAISS Backfill] Batch failed (attempt {attempt}/{MAX_BATCH_ATTEMPTS}): "
+                f"{str(e)}"
+            )
+            if attempt == MAX_BATCH_ATTEMPTS:
+                raise
+            time.sleep(2**attempt)
 
 
-def main():
-    print("[FAISS Backfill] Starting backfill of FAISS index from all posts...")
+def retry_failed(batch_size: int):
+    """
+    Index the posts of the dead-letter file into the live index.
+    """
+    entries = take_dead_letters(FAISS_DEAD_LETTER_PATH)
+    if not entries:
+        print("[FAISS Backfill] No failed posts to retry.")
+        return
+    post_ids = sorted(entries)
+    print(f"[FAISS Backfill] Retrying {len(post_ids)} failed posts...")
     db_session: Session = SessionLocal()
-    posts = db_session.query(PostModel).all()
-    db_session.close()
-    texts = []
-    metadatas = []
-    for post in posts:
-        if post.text:
-            texts.append(post.text)
-            metadatas.append(
-                {
-                    "post_id": post.post_id,
-                    "user_id": post.user_id,
-                    "created_time": (
-                        str(post.created_time) if post.created_time else None
-                    ),
-                }
+    try:
+        indexed, found = 0, set()
+        for start in range(0, len(post_ids), batch_size):
+            chunk = post_ids[start : start + batch_size]
+            posts = (
+                db_session.query(PostModel)
+                .filter(PostModel.post_id.in_(chunk), PostModel.text != None)
+                .all()
             )
-    if not texts:
+            indexed += index_batch(index_manager, posts)
+            found.update(post.post_id for post in posts)
+        # Deleted since (or never had text): must not stay in the index
+        removed = index_manager.remove(
+            [post_id for post_id in post_ids if post_id not in found], save=False
+        )
+        index_manager.save()
+    except Exception as e:
+        return_dead_letters(FAISS_DEAD_LETTER_PATH, list(entries.values()))
+        finish_dead_letters(FAISS_DEAD_LETTER_PATH)
+        print(f"[FAISS Backfill] Retry failed: {str(e)}. The posts stay queued.")
+        sys.exit(1)
+    finally:
+        db_session.close()
+    finish_dead_letters(FAISS_DEAD_LETTER_PATH)
+    print(
+        f"[FAISS Backfill] Re-indexed {indexed} failed posts, "
+        f"removed {removed} deleted ones."
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--batch-size", type=int, default=256, help="Posts embedded per batch"
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=10,
+        help="Persist the staging index and checkpoint every N batches",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue from the last checkpoint instead of starting over",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="Only re-index the posts the indexing queue failed to index",
+    )
+    args = parser.parse_args(argv)
+    if args.retry_failed:
+        retry_failed(args.batch_size)
+        return
+
+    checkpoint = load_checkpoint() if args.resume else None
+    if checkpoint is None:
+        shutil.rmtree(STAGING_INDEX_PATH, ignore_errors=True)
+        os.makedirs(STAGING_INDEX_PATH, exist_ok=True)
+        last_post_id, indexed = None, 0
+        print("[FAISS Backfill] Starting backfill of FAISS index from all posts...")
+    else:
+        last_post_id, indexed = checkpoint["last_post_id"], checkpoint["indexed"]
+        print(
+            f"[FAISS Backfill] Resuming after post {last_post_id} "
+            f"({indexed} posts already indexed)..."
+        )
+
+    # Rebuilds are deferred to publishing so each index is trained once, on everything
+    staging = FaissIndexManager(STAGING_INDEX_PATH, embedding_model, auto_rebuild=False)
+    staging.get_index()
+
+    db_session: Session = SessionLocal()
+    start = time.perf_counter()
+    run_indexed = 0
+    try:
+        for batch_number, batch in enumerate(
+            iter_post_batches(db_session, args.batch_size, last_post_id), start=1
+        ):
+            count = index_batch(staging, batch)
+            indexed += count
+            run_indexed += count
+            last_post_id = batch[-1].post_id
+            if batch_number % args.checkpoint_every == 0:
+                staging.save()
+                save_checkpoint(last_post_id, indexed)
+                elapsed = time.perf_counter() - start
+                print(
+                    f"[FAISS Backfill] {indexed} posts indexed "
+                    f"({run_indexed / elapsed:.1f} posts/s)"
+                )
+    except Exception as e:
+        print(f"[FAISS Backfill] Aborted: {str(e)}. Rerun with --resume to continue.")
+        sys.exit(1)
+    finally:
+        db_session.close()
+
+    vector_index = staging.get_index()
+    if vector_index is None or not vector_index.live_count:
+        shutil.rmtree(STAGING_INDEX_PATH, ignore_errors=True)
         print("[FAISS Backfill] No posts found. Nothing to index.")
         return
-    build_faiss_index(texts, metadatas)
-    print(f"[FAISS Backfill] Indexed {len(texts)} posts into FAISS vector store.")
+    # Publish the finished index (split into monthly shards when sharding is
+    # on), trained for its size; running servers pick up the new generation
+    index_manager.replace(vector_index, rebuild=True)
+    shutil.rmtree(STAGING_INDEX_PATH, ignore_errors=True)
+    elapsed = time.perf_counter() - start
+    rate = run_indexed / elapsed if elapsed else 0.0
+    print(
+        f"[FAISS Backfill] Indexed {indexed} posts into FAISS vector store "
+        f"in {elapsed:.1f}s ({rate:.1f} posts/s)."
+    )
 
 
 if __name__ == "__main__":
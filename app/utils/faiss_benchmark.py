@@ -0,0 +1,107 @@
+"""
+Benchmark the FAISS index types on synthetic corpora.
+
+For every corpus size and index type this reports build time, recall@k
+against exact (flat) search and p50/p99 single-query latency, so the
+FAISS_INDEX_TYPE / threshold settings can be chosen from numbers.
+
+    python -m app.utils.faiss_benchmark --sizes 10000,100000,1000000 --dim 384
+
+Memory needed is roughly sizes * dim * 4 bytes per index type being built.
+"""
+
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from app.utils.faiss_index_types import (
+    INDEX_TYPES,
+    create_faiss_index,
+    train_index,
+)
+
+
+def synthetic_vectors(n: int, dim: int, n_clusters: int, rng) -> np.ndarray:
+    """
+    Normalized vectors drawn around random cluster centers, which is closer
+    to real text embeddings than uniform noise.
+    """
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    assignments = rng.integers(0, n_clusters, size=n)
+    vectors = centers[assignments] + 0.3 * rng.standard_normal((n, dim)).astype(
+        np.float32
+    )
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def percentile_ms(samples, q: float) -> float:
+    return float(np.percentile(samples, q)) * 1000.0
+
+
+def benchmark_index(index_type, corpus, queries, ground_truth, k):
+    start = time.perf_counter()
+    index = create_faiss_index(index_type, corpus.shape[1], len(corpus))
+    train_index(index, corpus)
+    index.add_with_ids(corpus, np.arange(len(corpus), dtype=np.int64))
+    build_seconds = time.perf_counter() - start
+
+    latencies = []
+    found = np.empty((len(queries), k), dtype=np.int64)
+    for i, query in enumerate(queries):
+        query_start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - query_start)
+        found[i] = ids[0]
+
+    hits = sum(
+        len(set(row.tolist()) & set(truth.tolist()))
+        for row, truth in zip(found, ground_truth)
+    )
+    return {
+        "build_s": build_seconds,
+        "recall": hits / (len(queries) * k),
+        "p50_ms": percentile_ms(latencies, 50),
+        "p99_ms": percentile_ms(latencies, 99),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--types", default=",".join(INDEX_TYPES))
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    index_types = args.types.split(",")
+    rng = np.random.default_rng(args.seed)
+
+    print(
+        f"{'size':>9} {'type':>9} {'build_s':>9} {'recall@' + str(args.k):>10} "
+        f"{'p50_ms':>8} {'p99_ms':>8}"
+    )
+    for size in sizes:
+        data = synthetic_vectors(size + args.queries, args.dim, args.clusters, rng)
+        corpus, queries = data[:size], data[size:]
+        exact = faiss.IndexFlatL2(args.dim)
+        exact.add(corpus)
+        _, ground_truth = exact.search(queries, args.k)
+        del exact
+        for index_type in index_types:
+            result = benchmark_index(index_type, corpus, queries, ground_truth, args.k)
+            print(
+                f"{size:>9} {index_type:>9} {result['build_s']:>9.2f} "
+                f"{result['recall']:>10.3f} {result['p50_ms']:>8.3f} "
+                f"{result['p99_ms']:>8.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
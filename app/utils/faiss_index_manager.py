@@ -0,0 +1,636 @@
+"""
+Process-wide manager keeping the FAISS post index resident in memory.
+
+The index is loaded from disk once and served from memory behind a
+reader/writer lock. Every save bumps a generation counter stored next to
+the index files, so other processes (e.g. the backfill script) can publish
+a new index and the server reloads it only when that generation changes.
+If another process published while this one has unsaved changes, save()
+replays those changes onto the published index instead of overwriting it.
+"""
+
+import contextlib
+import fcntl
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from typing import List, Optional, Tuple
+
+from app.utils.cache import TTLCache, normalize_text
+from app.utils.embeddings import embed_queries
+from app.utils.faiss_index_types import PROMOTION_ORDER, choose_index_type
+from app.utils.vector_store import (
+    INDEX_FILE,
+    RECORDS_FILE,
+    PostVectorIndex,
+    SearchFilter,
+)
+
+GENERATION_FILE = "GENERATION"
+# Held while checking the generation and publishing a new one
+PUBLISH_LOCK_FILE = "PUBLISH.lock"
+INDEX_FILES = (INDEX_FILE, RECORDS_FILE)
+
+
+class ReadWriteLock:
+    """A writer-preferring reader/writer lock."""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    def read_locked(self):
+        return _LockContext(self.acquire_read, self.release_read)
+
+    def write_locked(self):
+        return _LockContext(self.acquire_write, self.release_write)
+
+
+class _LockContext:
+    def __init__(self, acquire, release):
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        self._acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self._release()
+        return False
+
+
+class FaissIndexManager:
+    """
+    Keeps a single post vector index in memory for the whole process and
+    reloads it only when the on-disk generation changes.
+
+    Deletions are tombstones; once the share of dead vectors passes
+    `compaction_ratio` a background thread rebuilds the index without them.
+    The same background rebuild promotes the index to an approximate type
+    (see faiss_index_types) as the corpus grows, and retrains IVF indexes
+    once the corpus is `retrain_growth` times the size they were trained on.
+    """
+
+    def __init__(
+        self,
+        index_path: str,
+        embedding,
+        reload_check_interval: float = 1.0,
+        compaction_ratio: float = 0.2,
+        compaction_min_dead: int = 100,
+        retrain_growth: float = 4.0,
+        auto_rebuild: bool = True,
+        query_cache_size: int = 1024,
+        query_cache_ttl: Optional[float] = 3600.0,
+        result_cache_size: int = 1024,
+        result_cache_ttl: Optional[float] = 300.0,
+        io_flags: int = 0,
+    ):
+        self.index_path = index_path
+        self.embedding = embedding
+        self.reload_check_interval = reload_check_interval
+        self.compaction_ratio = compaction_ratio
+        self.compaction_min_dead = compaction_min_dead
+        self.retrain_growth = retrain_growth
+        self.auto_rebuild = auto_rebuild
+        # faiss.read_index flags, e.g. IO_FLAG_MMAP for immutable shards
+        self.io_flags = io_flags
+        # Bumped on every in-memory mutation or reload; keys the result cache
+        self.generation = 0
+        self.query_embedding_cache = TTLCache(query_cache_size, query_cache_ttl)
+        self.result_cache = TTLCache(result_cache_size, result_cache_ttl)
+        self._lock = ReadWriteLock()
+        # Serializes writers, so compaction can rebuild while readers keep going
+        self._mutation_lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._index: Optional[PostVectorIndex] = None
+        self._disk_generation: Optional[int] = None
+        self._last_check: Optional[float] = None
+        self._load_count = 0
+        self._last_load_seconds: Optional[float] = None
+        self._loaded_at: Optional[float] = None
+        self._dirty = False
+        # Mutations since the index was loaded or saved, replayed onto an
+        # index another process published meanwhile; see save()
+        self._pending: List[tuple] = []
+        # Set by replace(): the next save publishes this index as it is
+        self._replaced = False
+        self._merges = 0
+        self._rebuild_thread: Optional[threading.Thread] = None
+        self._rebuild_lock = threading.Lock()
+        # Mutations made while rebuild() builds from a copy, replayed onto
+        # the rebuilt index before it is swapped in; None when not rebuilding
+        self._rebuild_journal: Optional[List[tuple]] = None
+        self._rebuilds = 0
+        self._last_rebuild_seconds: Optional[float] = None
+        self._last_rebuild_reason: Optional[str] = None
+
+    def _generation_path(self) -> str:
+        return os.path.join(self.index_path, GENERATION_FILE)
+
+    def read_disk_generation(self) -> Optional[int]:
+        """
+        Return the generation of the index on disk, or None if there is no index.
+        """
+        if not all(
+            os.path.exists(os.path.join(self.index_path, name)) for name in INDEX_FILES
+        ):
+            return None
+        try:
+            with open(self._generation_path(), "r") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_disk_generation(self, generation: int):
+        fd, tmp_path = tempfile.mkstemp(dir=self.index_path)
+        with os.fdopen(fd, "w") as f:
+            f.write(str(generation))
+        os.replace(tmp_path, self._generation_path())
+
+    def _load_from_disk(self):
+        generation = self.read_disk_generation()
+        if generation is None:
+            return None, None
+        start = time.perf_counter()
+        try:
+            vector_index = PostVectorIndex.load(self.index_path, self.io_flags)
+        except Exception as e:
+            print(f"[FAISS] Failed to load index from {self.index_path}: {str(e)}")
+            return None, generation
+        if vector_index is None:
+            return None, generation
+        self._last_load_seconds = time.perf_counter() - start
+        self._loaded_at = time.time()
+        self._load_count += 1
+        print(
+            f"[FAISS] Loaded index generation {generation} "
+            f"({vector_index.live_count} live vectors) in {self._last_load_seconds:.3f}s"
+        )
+        return vector_index, generation
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if (
+            self._last_check is not None
+            and now - self._last_check < self.reload_check_interval
+        ):
+            return
+        self._last_check = now
+        generation = self.read_disk_generation()
+        if generation is None or generation == self._disk_generation:
+            return
+        with self._mutation_lock:
+            # Another thread may have reloaded while we waited for the lock,
+            # and unsaved in-memory changes must not be thrown away.
+            if generation == self._disk_generation or self._dirty:
+                return
+            vector_index, loaded_generation = self._load_from_disk()
+            if vector_index is not None:
+                with self._lock.write_locked():
+                    self._index = vector_index
+                    self._disk_generation = loaded_generation
+                    self.generation += 1
+
+    @contextlib.contextmanager
+    def _publish_lock(self):
+        os.makedirs(self.index_path, exist_ok=True)
+        with open(os.path.join(self.index_path, PUBLISH_LOCK_FILE), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _merge_published(self):
+        """
+        Load the index another process published and replay this process's
+        unsaved mutations onto it.
+        """
+        with self._mutation_lock:
+            if self._replaced:
+                # replace() is meant to override whatever is on disk
+                return
+            vector_index, loaded_generation = self._load_from_disk()
+            if vector_index is None:
+                return
+            with self._lock.read_locked():
+                pending = list(self._pending)
+            for op, *args in pending:
+                if op == "upsert":
+                    vector_index.upsert(*args)
+                else:
+                    vector_index.remove(*args)
+            with self._lock.write_locked():
+                self._index = vector_index
+                self._disk_generation = loaded_generation
+                self.generation += 1
+            self._merges += 1
+        print(
+            f"[FAISS] Merged {len(pending)} unsaved changes into index "
+            f"generation {loaded_generation} published by another process"
+        )
+
+    def save(self):
+        """
+        Persist the in-memory index and publish a new on-disk generation.
+        """
+        with self._save_lock, self._publish_lock():
+            published = self.read_disk_generation()
+            if published is not None and published != self._disk_generation:
+                self._merge_published()
+            tmp_dir = tempfile.mkdtemp(dir=self.index_path)
+            try:
+                with self._lock.read_locked():
+                    if self._index is None:
+                        return
+                    self._index.save(tmp_dir)
+                    self._dirty = False
+                    self._pending = []
+                    self._replaced = False
+                # Swap the files in only once they are fully written.
+                for name in INDEX_FILES:
+                    os.replace(
+                        os.path.join(tmp_dir, name), os.path.join(self.index_path, name)
+                    )
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            generation = (self.read_disk_generation() or 0) + 1
+            self._write_disk_generation(generation)
+            self._disk_generation = generation
+
+    @property
+    def dirty(self) -> bool:
+        """
+        Whether the resident index has changes that are not saved yet.
+        """
+        return self._dirty
+
+    def get_index(self) -> Optional[PostVectorIndex]:
+        """
+        Return the resident index, loading or reloading it if needed.
+        """
+        self._maybe_reload()
+        return self._index
+
+    def search(
+        self, query: str, k: int = 5, search_filter: Optional[SearchFilter] = None
+    ) -> List[Tuple[str, dict]]:
+        """
+        Search the resident index for the top-k texts most relevant to the query,
+        optionally restricted to the posts matching `search_filter`.
+
+        Results are cached per index generation, so any mutation of the index
+        invalidates them.
+        """
+        if self.get_index() is None:
+            return []
+        normalized = normalize_text(query)
+        cached = self.result_cache.get((self.generation, normalized, k, search_filter))
+        if cached is not None:
+            return cached
+        generation = self.generation
+        hits = self.search_vector(self.embed_query(normalized), k, search_filter)
+        results = [(text, metadata) for text, metadata, _ in hits]
+        self.result_cache.set((generation, normalized, k, search_filter), results)
+        return results
+
+    def search_many(
+        self,
+        queries: List[str],
+        k: int = 5,
+        search_filter: Optional[SearchFilter] = None,
+    ) -> List[List[Tuple[str, dict]]]:
+        """
+        search() for many queries at once: those without cached results are
+        embedded in one call and searched as a single matrix query.
+        """
+        if self.get_index() is None:
+            return [[] for _ in queries]
+        generation = self.generation
+        normalized = [normalize_text(query) for query in queries]
+        results = {
+            query: self.result_cache.get((generation, query, k, search_filter))
+            for query in set(normalized)
+        }
+        missing = [query for query, cached in results.items() if cached is None]
+        if missing:
+            hits = self.search_vectors(self.embed_queries(missing), k, search_filter)
+            for query, query_hits in zip(missing, hits):
+                results[query] = [(text, metadata) for text, metadata, _ in query_hits]
+                self.result_cache.set(
+                    (generation, query, k, search_filter), results[query]
+                )
+        return [results[query] for query in normalized]
+
+    def search_vector(
+        self,
+        query_embedding: List[float],
+        k: int = 5,
+        search_filter: Optional[SearchFilter] = None,
+    ) -> List[Tuple[str, dict, float]]:
+        """
+        Search the resident index with an already embedded query.
+        Returns (text, metadata, distance) tuples, nearest first.
+        """
+        return self.search_vectors([query_embedding], k, search_filter)[0]
+
+    def search_vectors(
+        self,
+        query_embeddings,
+        k: int = 5,
+        search_filter: Optional[SearchFilter] = None,
+    ) -> List[List[Tuple[str, dict, float]]]:
+        """
+        Search the resident index with already embedded queries as one
+        matrix query. Returns a list of (text, metadata, distance) tuples,
+        nearest first, per query.
+        """
+        empty = [[] for _ in range(len(query_embeddings))]
+        if self.get_index() is None:
+            return empty
+        with self._lock.read_locked():
+            if self._index is None:
+                return empty
+            rows = self._index.search(
+                query_embeddings, k=k, search_filter=search_filter
+            )
+        return [
+            [
+                (record["text"], record["metadata"], distance)
+                for record, distance in hits
+            ]
+            for hits in rows
+        ]
+
+    def embed_query(self, query: str) -> List[float]:
+        """
+        Embed a query, reusing the embedding of an identical normalized query.
+        """
+        normalized = normalize_text(query)
+        vector = self.query_embedding_cache.get(normalized)
+        if vector is None:
+            vector = self.embedding.embed_query(normalized)
+            self.query_embedding_cache.set(normalized, vector)
+        return vector
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        embed_query() for many queries; the ones not cached are embedded in
+        a single batched call.
+        """
+        normalized = [normalize_text(query) for query in queries]
+        vectors = {query: self.query_embedding_cache.get(query) for query in normalized}
+        missing = [query for query, vector in vectors.items() if vector is None]
+        if missing:
+            for query, vector in zip(missing, embed_queries(self.embedding, missing)):
+                vectors[query] = vector
+                self.query_embedding_cache.set(query, vector)
+        return [vectors[query] for query in normalized]
+
+    def add_texts(self, texts: List[str], metadatas: List[dict] = None, save=True):
+        """
+        Embed texts and upsert them into the resident index, keyed by the
+        "post_id" of their metadata, then persist it.
+        """
+        if not texts:
+            return
+        metadatas = metadatas or [{} for _ in texts]
+        post_ids = [
+            str(metadata.get("post_id") or uuid.uuid4()) for metadata in metadatas
+        ]
+        self.get_index()
+        embeddings = self.embedding.embed_documents(texts)
+        self.add_vectors(post_ids, texts, embeddings, metadatas, save=save)
+
+    def add_vectors(
+        self,
+        post_ids: List[str],
+        texts: List[str],
+        embeddings,
+        metadatas: List[dict] = None,
+        save=True,
+    ):
+        """
+        Upsert already embedded texts into the resident index, then persist it.
+        """
+        if not post_ids:
+            return
+        self.get_index()
+        with self._mutation_lock:
+            with self._lock.write_locked():
+                if self._index is None:
+                    self._index = PostVectorIndex(len(embeddings[0]))
+                self._index.upsert(post_ids, texts, embeddings, metadatas)
+                op = ("upsert", post_ids, texts, embeddings, metadatas)
+                self._pending.append(op)
+                if self._rebuild_journal is not None:
+                    self._rebuild_journal.append(op)
+                self._dirty = True
+                self.generation += 1
+        if save:
+            self.save()
+        self.maybe_rebuild()
+
+    def remove(self, post_ids: List[str], save=True) -> int:
+        """
+        Tombstone the vectors of the given posts so they are no longer
+        returned, and schedule a compaction if too many vectors are dead.
+        """
+        self.get_index()
+        with self._mutation_lock:
+            with self._lock.write_locked():
+                if self._index is None:
+                    return 0
+                removed = self._index.remove(post_ids)
+                if removed:
+                    op = ("remove", list(post_ids))
+                    self._pending.append(op)
+                    if self._rebuild_journal is not None:
+                        self._rebuild_journal.append(op)
+                    self._dirty = True
+                    self.generation += 1
+        if removed and save:
+            self.save()
+        self.maybe_rebuild()
+        return removed
+
+    def replace(self, vector_index: PostVectorIndex, save=True, rebuild=False):
+        """
+        Swap in a freshly built index. With `rebuild`, it is first rebuilt
+        as the index type that fits its size (training it if needed).
+        """
+        if rebuild:
+            vector_index = vector_index.rebuilt(
+                choose_index_type(vector_index.live_count),
+                embed=self.embedding.embed_documents,
+            )
+        with self._mutation_lock:
+            with self._lock.write_locked():
+                self._index = vector_index
+                self._pending = []
+                self._replaced = True
+                self._dirty = True
+                self.generation += 1
+        if save:
+            self.save()
+
+    def rebuild_reason(self) -> Optional[str]:
+        """
+        Return why the index should be rebuilt now, or None if it should not.
+        """
+        vector_index = self._index
+        if vector_index is None:
+            return None
+        if (
+            vector_index.dead_count >= self.compaction_min_dead
+            and vector_index.tombstone_ratio >= self.compaction_ratio
+        ):
+            return "compaction"
+        current = vector_index.index_type
+        target = choose_index_type(vector_index.live_count)
+        if PROMOTION_ORDER[target] > PROMOTION_ORDER[current]:
+            return "promotion"
+        if (
+            current.startswith("ivf")
+            and vector_index.trained_size
+            and vector_index.live_count
+            >= self.retrain_growth * vector_index.trained_size
+        ):
+            return "retrain"
+        return None
+
+    def maybe_rebuild(self):
+        """
+        Start a background rebuild if the index needs compaction, promotion
+        to another index type or retraining.
+        """
+        if not self.auto_rebuild:
+            return
+        reason = self.rebuild_reason()
+        if reason is None:
+            return
+        if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+            return
+        self._rebuild_thread = threading.Thread(
+            target=self.rebuild,
+            args=(reason,),
+            name="faiss-rebuild",
+            daemon=True,
+        )
+        self._rebuild_thread.start()
+
+    def rebuild(self, reason: str = "manual"):
+        """
+        Rebuild the index from its live vectors, using the index type that
+        fits the current corpus size, and persist it. The index is built from
+        a copy, so searches and writes keep running on the old index; writes
+        made meanwhile are replayed onto the new one before it is swapped in.
+        """
+        with self._rebuild_lock:
+            start = time.perf_counter()
+            with self._mutation_lock:
+                with self._lock.read_locked():
+                    if self._index is None:
+                        return
+                    source = self._index
+                    snapshot = source.copy()
+                self._rebuild_journal = []
+            try:
+                dead = snapshot.dead_count
+                previous_type = snapshot.index_type
+                # A PQ index is rebuilt from re-embedded texts, not its decodes
+                rebuilt = snapshot.rebuilt(
+                    choose_index_type(snapshot.live_count),
+                    embed=self.embedding.embed_documents,
+                )
+            except BaseException:
+                with self._mutation_lock:
+                    self._rebuild_journal = None
+                raise
+            with self._mutation_lock:
+                journal, self._rebuild_journal = self._rebuild_journal, None
+                if self._index is not source:
+                    # Reloaded, merged or replaced meanwhile
+                    print("[FAISS] Index changed during the rebuild; discarding it")
+                    return
+                for op, *args in journal:
+                    if op == "upsert":
+                        rebuilt.upsert(*args)
+                    else:
+                        rebuilt.remove(*args)
+                with self._lock.write_locked():
+                    self._index = rebuilt
+                    self._dirty = True
+                    self.generation += 1
+            self.save()
+        self._rebuilds += 1
+        self._last_rebuild_seconds = time.perf_counter() - start
+        self._last_rebuild_reason = reason
+        print(
+            f"[FAISS] Rebuilt index ({reason}): {previous_type} -> {rebuilt.index_type}, "
+            f"dropped {dead} dead vectors, replayed {len(journal)} writes "
+            f"in {self._last_rebuild_seconds:.3f}s"
+        )
+
+    def compact(self):
+        """
+        Rebuild the index without its tombstoned vectors.
+        """
+        self.rebuild("compaction")
+
+    def stats(self) -> dict:
+        vector_index = self._index
+        size_bytes = 0
+        for name in INDEX_FILES:
+            path = os.path.join(self.index_path, name)
+            if os.path.exists(path):
+                size_bytes += os.path.getsize(path)
+        return {
+            "loaded": vector_index is not None,
+            "memory_generation": self.generation,
+            "dirty": self._dirty,
+            "generation": self._disk_generation,
+            "live_vectors": vector_index.live_count if vector_index else 0,
+            "dead_vectors": vector_index.dead_count if vector_index else 0,
+            "size_bytes": size_bytes,
+            "load_count": self._load_count,
+            "last_load_seconds": self._last_load_seconds,
+            "loaded_at": self._loaded_at,
+            "index_type": vector_index.index_type if vector_index else None,
+            "rebuilds": self._rebuilds,
+            "last_rebuild_reason": self._last_rebuild_reason,
+            "last_rebuild_seconds": self._last_rebuild_seconds,
+            "merges": self._merges,
+        }
@@ -0,0 +1,150 @@
+"""
+FAISS index strategies for the post vector index.
+
+Supported types: "flat" (exact), "ivf_flat", "ivf_pq" and "hnsw". With
+FAISS_INDEX_TYPE=auto the type is picked from the corpus size, so the index
+is promoted to an approximate one as the forum grows.
+"""
+
+import math
+
+import faiss
+import numpy as np
+
+from app.settings import settings
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# Order in which automatic promotion moves through the index types
+PROMOTION_ORDER = {"flat": 0, "hnsw": 1, "ivf_flat": 1, "ivf_pq": 2}
+
+# FAISS recommends at least ~39 training points per IVF list
+MIN_POINTS_PER_LIST = 39
+
+# Types that store compressed codes: reconstruct() only returns approximations
+LOSSY_INDEX_TYPES = ("ivf_pq",)
+
+# Below these corpus sizes an index type cannot be trained meaningfully
+MIN_TRAINING_VECTORS = {"flat": 0, "hnsw": 0, "ivf_flat": 1000, "ivf_pq": 10000}
+
+
+def choose_index_type(n_vectors: int, configured: str = None) -> str:
+    """
+    Return the index type to use for a corpus of `n_vectors` vectors.
+    """
+    configured = configured or settings.FAISS_INDEX_TYPE
+    if configured == "auto":
+        if n_vectors >= settings.FAISS_PQ_THRESHOLD:
+            index_type = "ivf_pq"
+        elif n_vectors >= settings.FAISS_IVF_THRESHOLD:
+            index_type = "ivf_flat"
+        else:
+            index_type = "flat"
+    elif configured in INDEX_TYPES:
+        index_type = configured
+    else:
+        raise ValueError(f"Unknown FAISS index type: {configured}")
+    if n_vectors < MIN_TRAINING_VECTORS[index_type]:
+        # Too few vectors to train on yet: stay exact until the corpus grows
+        return "flat"
+    return index_type
+
+
+def ivf_nlist(n_vectors: int) -> int:
+    """
+    Number of IVF lists for a corpus size: ~4*sqrt(n), bounded so every list
+    still gets enough training points.
+    """
+    nlist = int(4 * math.sqrt(max(n_vectors, 1)))
+    nlist = min(nlist, max(1, n_vectors // MIN_POINTS_PER_LIST))
+    return max(1, min(nlist, 65536))
+
+
+def pq_subquantizers(dim: int) -> int:
+    """
+    Largest number of PQ sub-quantizers <= 64 dividing the dimension.
+    """
+    for m in range(min(64, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def create_faiss_index(index_type: str, dim: int, n_vectors: int) -> faiss.Index:
+    """
+    Create an empty (possibly untrained) ID-mapped index of the given type,
+    sized for `n_vectors` vectors.
+    """
+    if index_type == "flat":
+        inner = faiss.IndexFlatL2(dim)
+    elif index_type == "ivf_flat":
+        quantizer = faiss.IndexFlatL2(dim)
+        inner = faiss.IndexIVFFlat(quantizer, dim, ivf_nlist(n_vectors))
+    elif index_type == "ivf_pq":
+        quantizer = faiss.IndexFlatL2(dim)
+        nlist = ivf_nlist(n_vectors)
+        inner = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_subquantizers(dim), 8)
+    elif index_type == "hnsw":
+        inner = faiss.IndexHNSWFlat(dim, settings.FAISS_HNSW_M)
+        inner.hnsw.efConstruction = settings.FAISS_HNSW_EF_CONSTRUCTION
+    else:
+        raise ValueError(f"Unknown FAISS index type: {index_type}")
+    index = faiss.IndexIDMap2(inner)
+    configure_index(index)
+    return index
+
+
+def configure_index(index: faiss.Index):
+    """
+    Apply search-time parameters and make the index able to reconstruct
+    vectors by id (needed for compaction and migration).
+    """
+    inner = faiss.downcast_index(index.index) if hasattr(index, "index") else index
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        ivf.nprobe = min(settings.FAISS_NPROBE, ivf.nlist)
+        ivf.make_direct_map()
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = settings.FAISS_HNSW_EF_SEARCH
+
+
+def search_parameters(index: faiss.Index, selector) -> faiss.SearchParameters:
+    """
+    Build search parameters restricting results to `selector`, carrying over
+    the index's own nprobe / efSearch (parameter objects default to 1 / 16).
+    """
+    inner = faiss.downcast_index(index.index) if hasattr(index, "index") else index
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=inner.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def train_index(index: faiss.Index, vectors: np.ndarray, seed: int = 1234):
+    """
+    Train the index on (a sample of) the given vectors if it needs training.
+    """
+    if index.is_trained:
+        return
+    max_samples = 256 * ivf_nlist(len(vectors))
+    if len(vectors) > max_samples:
+        rng = np.random.default_rng(seed)
+        vectors = vectors[rng.choice(len(vectors), max_samples, replace=False)]
+    index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+    configure_index(index)
+
+
+def index_type_of(index: faiss.Index) -> str:
+    """
+    Return which of INDEX_TYPES a (possibly ID-mapped) index is.
+    """
+    inner = faiss.downcast_index(index.index) if hasattr(index, "index") else index
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(inner, faiss.IndexIVFFlat):
+        return "ivf_flat"
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
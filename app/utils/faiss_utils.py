@@ -2,64 +2,205 @@
 FAISS vector store and embedding utilities for chatbot context retrieval.
 """
 
-from typing import List, Tuple
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+import asyncio
+from typing import List, Optional, Tuple
 from app.settings import settings
+from app.utils.embeddings import get_embedding_model
+from app.utils.faiss_index_manager import FaissIndexManager
+from app.utils.hybrid_search import HybridRetriever
+from app.utils.sharded_index import ShardedIndexManager
+from app.utils.indexing_queue import IndexingQueue
+from app.utils.vector_store import PostVectorIndex, SearchFilter
+from app.utils.metrics import register_stats
+from app.utils.providers import lazy
 import os
 
 # Path to persist the FAISS index (can be changed as needed)
 FAISS_INDEX_PATH = os.path.join(os.path.dirname(__file__), "faiss_post_index")
+# Root of the monthly shard directories used when FAISS_SHARDED is on
+FAISS_SHARDS_PATH = os.path.join(os.path.dirname(__file__), "faiss_post_shards")
+# Posts the indexing queue gave up on; see faiss_backfill --retry-failed
+FAISS_DEAD_LETTER_PATH = os.path.join(
+    os.path.dirname(__file__), "faiss_dead_letter.jsonl"
+)
+
+# Configured embedding backend (Gemini, local or hashing) behind a persistent
+# cache, built on first use (or at warm-up) rather than at import
+embedding_model = lazy("embeddings", get_embedding_model)
+register_stats(
+    "embeddings",
+    lambda: (
+        embedding_model.stats()
+        if embedding_model.initialized
+        else {"initialized": False}
+    ),
+)
+
+# Process-wide resident index, reloaded only when the on-disk generation changes.
+# Sharded by month unless disabled; an existing single index is migrated.
+index_options = dict(
+    reload_check_interval=settings.FAISS_RELOAD_CHECK_SECONDS,
+    compaction_ratio=settings.FAISS_COMPACTION_RATIO,
+    compaction_min_dead=settings.FAISS_COMPACTION_MIN_DEAD,
+    retrain_growth=settings.FAISS_RETRAIN_GROWTH,
+    query_cache_size=settings.QUERY_EMBEDDING_CACHE_SIZE,
+    query_cache_ttl=settings.QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+    result_cache_size=settings.RETRIEVAL_CACHE_SIZE,
+    result_cache_ttl=settings.RETRIEVAL_CACHE_TTL_SECONDS,
+)
+if settings.FAISS_SHARDED:
+    index_manager = ShardedIndexManager(
+        FAISS_SHARDS_PATH,
+        embedding_model,
+        legacy_index_path=FAISS_INDEX_PATH,
+        search_workers=settings.FAISS_SHARD_SEARCH_WORKERS,
+        mmap_sealed=settings.FAISS_MMAP_SEALED_SHARDS,
+        **index_options,
+    )
+else:
+    index_manager = FaissIndexManager(
+        FAISS_INDEX_PATH, embedding_model, **index_options
+    )
+register_stats("faiss_index", index_manager.stats)
+register_stats("query_embedding_cache", index_manager.query_embedding_cache.stats)
+register_stats("retrieval_cache", index_manager.result_cache.stats)
+
+# Write-behind queue so new posts are embedded and persisted in batches
+indexing_queue = IndexingQueue(
+    index_manager,
+    batch_size=settings.FAISS_INDEX_BATCH_SIZE,
+    batch_interval_ms=settings.FAISS_INDEX_BATCH_MS,
+    persist_every=settings.FAISS_PERSIST_EVERY,
+    persist_interval_seconds=settings.FAISS_PERSIST_SECONDS,
+    dead_letter_path=FAISS_DEAD_LETTER_PATH,
+)
+register_stats("faiss_indexing_queue", indexing_queue.stats)
+
+
+def post_metadata(post) -> dict:
+    """
+    Metadata stored next to a post's vector.
+    """
+    return {
+        "post_id": str(post.post_id),
+        "user_id": str(post.user_id) if post.user_id else None,
+        "doctor_id": str(post.doctor_id) if post.doctor_id else None,
+        "parent_id": str(post.parent_id) if post.parent_id else None,
+        "created_time": post.created_time.isoformat() if post.created_time else None,
+    }
+
 
-# Use Gemini embeddings via LangChain
-embedding_model = GoogleGenerativeAIEmbeddings(
-    model="models/embedding-001", google_api_key=settings.GENAI_API_KEY
+# BM25 + vector retrieval, degrading to lexical-only when embeddings are slow
+hybrid_retriever = HybridRetriever(
+    index_manager,
+    vector_timeout=settings.HYBRID_VECTOR_TIMEOUT_SECONDS,
+    cooldown_seconds=settings.HYBRID_LEXICAL_COOLDOWN_SECONDS,
+    failure_threshold=settings.HYBRID_VECTOR_FAILURE_THRESHOLD,
+    max_vector_workers=settings.HYBRID_VECTOR_WORKERS,
+    post_metadata=post_metadata,
 )
+register_stats("hybrid_search", hybrid_retriever.stats)
 
 
 def build_faiss_index(texts: List[str], metadatas: List[dict] = None):
     """
     Build a FAISS index from a list of texts and optional metadata.
     """
-    vectorstore = FAISS.from_texts(texts, embedding_model, metadatas=metadatas)
-    vectorstore.save_local(FAISS_INDEX_PATH)
-    return vectorstore
+    metadatas = metadatas or [{} for _ in texts]
+    embeddings = embedding_model.embed_documents(texts)
+    vector_index = PostVectorIndex(len(embeddings[0]))
+    vector_index.upsert(
+        [str(metadata.get("post_id")) for metadata in metadatas],
+        texts,
+        embeddings,
+        metadatas,
+    )
+    index_manager.replace(vector_index, rebuild=True)
+    return vector_index
 
 
 def load_faiss_index():
     """
-    Load the FAISS index from disk, or return None if not found.
+    Return the resident FAISS index (a dict of monthly shard indexes when
+    sharded), loading it from disk on first use, or None if not found.
     """
-    if not os.path.exists(FAISS_INDEX_PATH):
-        return None
-    try:
-        return FAISS.load_local(FAISS_INDEX_PATH, embedding_model)
-    except Exception:
-        return None
+    return index_manager.get_index()
 
 
 def update_faiss_index(new_text: str, metadata: dict = None):
     """
-    Add a new text (post) to the FAISS index and persist it.
+    Add or replace a text (post) in the FAISS index, keyed by its post_id,
+    and persist it.
+    """
+    index_manager.add_texts([new_text], metadatas=[metadata] if metadata else None)
+    return index_manager.get_index()
+
+
+def remove_from_faiss_index(post_id: str) -> bool:
+    """
+    Tombstone a post in the FAISS index and persist it.
+    """
+    return index_manager.remove([post_id]) > 0
+
+
+def enqueue_faiss_update(new_text: str, metadata: dict = None):
+    """
+    Queue a new text (post) for batched indexing without blocking the caller.
     """
-    vectorstore = load_faiss_index()
-    if vectorstore is None:
-        vectorstore = FAISS.from_texts(
-            [new_text], embedding_model, metadatas=[metadata] if metadata else None
-        )
-    else:
-        vectorstore.add_texts([new_text], metadatas=[metadata] if metadata else None)
-    vectorstore.save_local(FAISS_INDEX_PATH)
-    return vectorstore
+    indexing_queue.submit(new_text, metadata=metadata)
 
 
-def search_faiss_index(query: str, k: int = 5) -> List[Tuple[str, dict]]:
+def enqueue_faiss_delete(post_id: str):
     """
-    Search the FAISS index for the top-k most relevant texts to the query.
+    Queue the removal of a deleted post from the FAISS index.
+    """
+    indexing_queue.submit_delete(post_id)
+
+
+def flush_faiss_updates(timeout: float = None) -> bool:
+    """
+    Wait until every queued text is indexed and the index is persisted.
+    """
+    return indexing_queue.flush(timeout)
+
+
+def search_faiss_index(
+    query: str, k: int = 5, search_filter: Optional[SearchFilter] = None
+) -> List[Tuple[str, dict]]:
+    """
+    Search the FAISS index for the top-k most relevant texts to the query,
+    optionally restricted by a SearchFilter (doctor posts, time window, thread).
     Returns a list of (text, metadata) tuples.
     """
-    vectorstore = load_faiss_index()
-    if vectorstore is None:
-        return []
-    docs_and_scores = vectorstore.similarity_search_with_score(query, k=k)
-    return [(doc.page_content, doc.metadata) for doc, _ in docs_and_scores]
+    return index_manager.search(query, k=k, search_filter=search_filter)
+
+
+def search_posts(
+    query: str, k: int = 10, search_filter: Optional[SearchFilter] = None
+) -> List[Tuple[str, dict]]:
+    """
+    Hybrid (BM25 + vector) search for the top-k posts relevant to the query.
+    Returns a list of (text, metadata) tuples; metadata carries the fused score.
+    """
+    return hybrid_retriever.search(query, k=k, search_filter=search_filter)
+
+
+async def asearch_posts(
+    query: str, k: int = 10, search_filter: Optional[SearchFilter] = None
+) -> List[Tuple[str, dict]]:
+    """
+    search_posts() for async callers; does not block the event loop.
+    """
+    return await hybrid_retriever.asearch(query, k=k, search_filter=search_filter)
+
+
+async def asearch_posts_many(
+    queries: List[str], k: int = 10, search_filter: Optional[SearchFilter] = None
+) -> List[List[Tuple[str, dict]]]:
+    """
+    search_posts() for a batch of queries, with one batched embedding call and
+    one matrix FAISS search. Runs in a worker thread.
+    """
+    return await asyncio.to_thread(
+        hybrid_retriever.search_many, queries, k, search_filter
+    )
@@ -0,0 +1,230 @@
+"""
+Offline stand-ins for the Gemini clients, for benchmarks and development
+without network access or API keys.
+
+- FakeGenerativeModel replaces genai.GenerativeModel (LLM_BACKEND=fake)
+- FakeChatModel replaces ChatGoogleGenerativeAI (LLM_BACKEND=fake)
+- FakeEmbeddings replaces the embedding model (EMBEDDING_BACKEND=fake)
+
+They only implement what the app calls. Outputs depend only on the input,
+so runs are repeatable, and latencies come from the FAKE_* settings, so
+time spent in our own code can be told apart from upstream latency.
+"""
+
+import asyncio
+import datetime
+import hashlib
+import json
+import random
+import time
+from typing import List, Optional
+
+from app.settings import settings
+from app.utils.embeddings import HashingEmbeddings
+
+# Words per streamed chunk
+CHUNK_WORDS = 8
+
+_WORDS = (
+    "the patient should continue the prescribed medication and monitor "
+    "symptoms daily rest well drink water avoid heavy meals consult doctor "
+    "if pain fever or dizziness persists blood pressure sugar levels remain "
+    "stable follow up in two weeks with recent lab results"
+).split()
+
+_MEDICINES = (
+    "Paracetamol",
+    "Amoxicillin",
+    "Metformin",
+    "Amlodipine",
+    "Atorvastatin",
+    "Omeprazole",
+    "Cetirizine",
+    "Ibuprofen",
+)
+
+
+def _prompt_text(contents) -> str:
+    """
+    Text of a prompt given as a string, message list or content parts;
+    binary parts (images) are represented by their hash.
+    """
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, dict):
+        data = contents.get("data", b"")
+        if isinstance(data, (bytes, bytearray)):
+            return hashlib.sha256(data).hexdigest()
+        return str(data)
+    if isinstance(contents, (list, tuple)):
+        return "\n".join(_prompt_text(part) for part in contents)
+    return str(getattr(contents, "content", contents))
+
+
+def _rng(prompt: str) -> random.Random:
+    seed = int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:8], "big")
+    return random.Random(seed)
+
+
+def _extraction(rng: random.Random) -> str:
+    """
+    A medical record extraction in the two-part format
+    process_medical_image asks for.
+    """
+    medicines = rng.sample(_MEDICINES, rng.randint(1, 3))
+    visit = datetime.date.today() + datetime.timedelta(days=rng.randint(7, 60))
+    medications = [
+        {
+            "name": name,
+            "dosage": f"{rng.choice((250, 500, 650))}mg",
+            "morning": "yes",
+            "afternoon": rng.choice(("yes", "no")),
+            "evening": "no",
+            "night": rng.choice(("yes", "no")),
+            "duration": f"{rng.randint(3, 30)} days",
+            "instructions": "Take after meals",
+        }
+        for name in medicines
+    ]
+    data = {
+        "patient_info": {"name": "Test Patient", "age": rng.randint(18, 90)},
+        "medications": medications,
+        "next_visit": {"date": visit.isoformat(), "reason": "Follow-up checkup"},
+    }
+    text = (
+        "1. Patient Information: Test Patient\n"
+        f"2. Medical History: Medications: {', '.join(medicines)}\n"
+        f"3. Vitals: Blood Pressure {rng.randint(100, 150)}/{rng.randint(60, 95)}\n"
+        "7. Doctor's Notes: Continue treatment and review at the next visit\n"
+    )
+    return f"{text}\n```json\n{json.dumps(data, indent=2)}\n```"
+
+
+def fake_completion(contents, words: int = None) -> str:
+    """
+    Deterministic answer to a prompt.
+    """
+    prompt = _prompt_text(contents)
+    rng = _rng(prompt)
+    if "```json" in prompt and "PART 2" in prompt:
+        return _extraction(rng)
+    words = settings.FAKE_LLM_RESPONSE_WORDS if words is None else words
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def _chunks(text: str) -> List[str]:
+    words = text.split(" ")
+    return [
+        " ".join(words[i : i + CHUNK_WORDS]) + " "
+        for i in range(0, len(words), CHUNK_WORDS)
+    ]
+
+
+class FakeResponse:
+    """The part of a genai response (or stream chunk) the app reads."""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeMessage:
+    """The part of a LangChain AIMessage (or chunk) the app reads."""
+
+    def __init__(self, content: str):
+        self.content = content
+
+
+class _FakeLLM:
+    def __init__(
+        self,
+        latency: Optional[float] = None,
+        chunk_seconds: Optional[float] = None,
+        words: Optional[int] = None,
+    ):
+        self.latency = settings.FAKE_LLM_LATENCY_SECONDS if latency is None else latency
+        self.chunk_seconds = (
+            settings.FAKE_LLM_CHUNK_SECONDS if chunk_seconds is None else chunk_seconds
+        )
+        self.words = words
+
+    def _complete(self, contents):
+        chunks = _chunks(fake_completion(contents, self.words))
+        # Full answers take as long as streaming every chunk would
+        return chunks, self.latency + self.chunk_seconds * len(chunks)
+
+    async def _astream(self, chunks: List[str], wrap):
+        for i, chunk in enumerate(chunks):
+            if i:
+                await asyncio.sleep(self.chunk_seconds)
+            yield wrap(chunk)
+
+
+class FakeGenerativeModel(_FakeLLM):
+    """Stand-in for genai.GenerativeModel."""
+
+    def __init__(self, model_name: str = "fake", **kwargs):
+        super().__init__(**kwargs)
+        self.model_name = model_name
+
+    def generate_content(self, contents, generation_config=None, stream=False):
+        chunks, seconds = self._complete(contents)
+        if stream:
+            return self._stream(chunks)
+        time.sleep(seconds)
+        return FakeResponse("".join(chunks).strip())
+
+    def _stream(self, chunks: List[str]):
+        time.sleep(self.latency)
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep(self.chunk_seconds)
+            yield FakeResponse(chunk)
+
+    async def generate_content_async(
+        self, contents, generation_config=None, stream=False
+    ):
+        chunks, seconds = self._complete(contents)
+        if stream:
+            # The first chunk arrives after `latency`, like a real stream
+            await asyncio.sleep(self.latency)
+            return self._astream(chunks, FakeResponse)
+        await asyncio.sleep(seconds)
+        return FakeResponse("".join(chunks).strip())
+
+
+class FakeChatModel(_FakeLLM):
+    """Stand-in for ChatGoogleGenerativeAI."""
+
+    def invoke(self, prompt) -> FakeMessage:
+        chunks, seconds = self._complete(prompt)
+        time.sleep(seconds)
+        return FakeMessage("".join(chunks).strip())
+
+    async def ainvoke(self, prompt) -> FakeMessage:
+        chunks, seconds = self._complete(prompt)
+        await asyncio.sleep(seconds)
+        return FakeMessage("".join(chunks).strip())
+
+    async def astream(self, prompt):
+        chunks, _ = self._complete(prompt)
+        await asyncio.sleep(self.latency)
+        async for message in self._astream(chunks, FakeMessage):
+            yield message
+
+
+class FakeEmbeddings(HashingEmbeddings):
+    """Hashing embeddings that take FAKE_EMBEDDING_LATENCY_SECONDS per call."""
+
+    def __init__(self, dim: int = 384, latency: Optional[float] = None):
+        super().__init__(dim=dim)
+        self.latency = (
+            settings.FAKE_EMBEDDING_LATENCY_SECONDS if latency is None else latency
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return super().embed_query(text)
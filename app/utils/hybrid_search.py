@@ -0,0 +1,288 @@
+"""
+Hybrid retrieval over posts: BM25 hits from the SQLite FTS5 index fused with
+FAISS hits through reciprocal-rank fusion (RRF).
+
+Lexical search catches exact drug names and dosage strings that embeddings
+blur, and needs no embedding call. The vector side runs with a time budget;
+a search that misses it (or fails) is answered lexical-only. After
+`failure_threshold` such searches in a row the retriever stays lexical-only
+for a cooldown period before trying the embedding backend again, so one
+slow embedding call does not switch vector search off.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from app.db.base import SessionLocal
+from app.db.post import search_posts_text
+from app.utils.faiss_index_manager import FaissIndexManager
+from app.utils.sharded_index import ShardedIndexManager
+from app.utils.vector_store import SearchFilter
+
+# Standard RRF damping constant: score = sum(1 / (RRF_K + rank))
+RRF_K = 60
+
+# Each side retrieves this many times k candidates before fusion
+CANDIDATE_MULTIPLIER = 3
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[Tuple[str, dict]]], k: int, rrf_k: int = RRF_K
+) -> List[Tuple[str, dict]]:
+    """
+    Fuse ranked (text, metadata) lists into one list of the top-k results.
+    Results are identified by metadata post_id (falling back to the text);
+    the returned metadata is a copy carrying the fused "score".
+    """
+    scores: Dict[str, float] = {}
+    results: Dict[str, Tuple[str, dict]] = {}
+    for ranking in rankings:
+        for rank, (text, metadata) in enumerate(ranking, start=1):
+            key = (metadata or {}).get("post_id") or text
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            results.setdefault(key, (text, metadata))
+    fused = []
+    for key in sorted(scores, key=scores.get, reverse=True)[:k]:
+        text, metadata = results[key]
+        fused.append((text, {**(metadata or {}), "score": scores[key]}))
+    return fused
+
+
+class HybridRetriever:
+    """
+    Combines lexical (FTS5) and vector (FAISS) retrieval for the chat endpoint.
+    """
+
+    def __init__(
+        self,
+        index_manager: Union[FaissIndexManager, ShardedIndexManager],
+        vector_timeout: float = 1.0,
+        cooldown_seconds: float = 30.0,
+        failure_threshold: int = 3,
+        max_vector_workers: int = 4,
+        post_metadata: Callable[[object], dict] = None,
+    ):
+        self.index_manager = index_manager
+        self.vector_timeout = vector_timeout
+        self.cooldown_seconds = cooldown_seconds
+        self.failure_threshold = failure_threshold
+        self.max_vector_workers = max_vector_workers
+        # Maps a Post row to the same metadata the vector index stores
+        self.post_metadata = post_metadata or (lambda post: {"post_id": post.post_id})
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_vector_workers, thread_name_prefix="hybrid-vector"
+        )
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        # Until this monotonic time the vector side is skipped
+        self._lexical_only_until = 0.0
+        # Vector searches that timed out or failed since the last success
+        self._consecutive_failures = 0
+        self.modes = {"hybrid": 0, "lexical_only": 0, "vector_only": 0, "empty": 0}
+        self.vector_timeouts = 0
+        self.vector_errors = 0
+
+    def search(
+        self, query: str, k: int = 10, search_filter: Optional[SearchFilter] = None
+    ) -> List[Tuple[str, dict]]:
+        """
+        Return the top-k (text, metadata) results for the query, best first.
+        """
+        candidates = k * CANDIDATE_MULTIPLIER
+        future = self._submit_vector_search(query, candidates, search_filter)
+        lexical = self._lexical_search(query, candidates, search_filter)
+        vector = self._vector_results(future)
+        return self._fuse(lexical, vector, k)
+
+    async def asearch(
+        self, query: str, k: int = 10, search_filter: Optional[SearchFilter] = None
+    ) -> List[Tuple[str, dict]]:
+        """
+        search() for the event loop: the lexical query runs in a worker thread
+        and the vector search is awaited, so no thread blocks on either.
+        """
+        candidates = k * CANDIDATE_MULTIPLIER
+        future = self._submit_vector_search(query, candidates, search_filter)
+        lexical = await asyncio.to_thread(
+            self._lexical_search, query, candidates, search_filter
+        )
+        vector = await self._avector_results(future)
+        return self._fuse(lexical, vector, k)
+
+    def search_many(
+        self,
+        queries: List[str],
+        k: int = 10,
+        search_filter: Optional[SearchFilter] = None,
+    ) -> List[List[Tuple[str, dict]]]:
+        """
+        search() for a batch of queries sharing one filter. The vector side
+        embeds them in one call and runs one matrix search; the lexical
+        queries share a database session meanwhile. There is no time budget,
+        since batches are not interactive, but lexical-only mode applies.
+        """
+        candidates = k * CANDIDATE_MULTIPLIER
+        future = None
+        with self._lock:
+            if time.monotonic() >= self._lexical_only_until:
+                self._in_flight += 1
+                future = self._executor.submit(
+                    self.index_manager.search_many, queries, candidates, search_filter
+                )
+        if future is not None:
+            future.add_done_callback(self._vector_done)
+        lexical = self._lexical_search_many(queries, candidates, search_filter)
+        vector = [[] for _ in queries]
+        if future is not None:
+            try:
+                vector = future.result()
+                self._vector_succeeded()
+            except Exception as e:
+                self._vector_failed(str(e))
+        return [
+            self._fuse(lexical_hits, vector_hits, k)
+            for lexical_hits, vector_hits in zip(lexical, vector)
+        ]
+
+    def _fuse(self, lexical, vector, k: int) -> List[Tuple[str, dict]]:
+        if lexical and vector:
+            mode = "hybrid"
+        elif lexical:
+            mode = "lexical_only"
+        elif vector:
+            mode = "vector_only"
+        else:
+            mode = "empty"
+        with self._lock:
+            self.modes[mode] += 1
+        return reciprocal_rank_fusion([r for r in (lexical, vector) if r], k)
+
+    def _lexical_search(
+        self, query: str, limit: int, search_filter: Optional[SearchFilter]
+    ) -> List[Tuple[str, dict]]:
+        return self._lexical_search_many([query], limit, search_filter)[0]
+
+    def _lexical_search_many(
+        self, queries: List[str], limit: int, search_filter: Optional[SearchFilter]
+    ) -> List[List[Tuple[str, dict]]]:
+        search_filter = search_filter or SearchFilter()
+        results = []
+        db_session = SessionLocal()
+        try:
+            for query in queries:
+                try:
+                    hits = search_posts_text(
+                        db_session,
+                        query,
+                        limit=limit,
+                        doctor_only=search_filter.doctor_only,
+                        since=search_filter.since,
+                        until=search_filter.until,
+                        thread_id=search_filter.thread_id,
+                    )
+                    results.append(
+                        [(post.text, self.post_metadata(post)) for post, _ in hits]
+                    )
+                except Exception as e:
+                    print(f"[Hybrid Search] Lexical search failed: {str(e)}")
+                    db_session.rollback()
+                    results.append([])
+        finally:
+            db_session.close()
+        return results
+
+    def _submit_vector_search(
+        self, query: str, limit: int, search_filter: Optional[SearchFilter]
+    ):
+        """
+        Start the vector search in the background, or return None while in
+        lexical-only mode or when every worker is still busy with slow calls.
+        """
+        with self._lock:
+            if time.monotonic() < self._lexical_only_until:
+                return None
+            if self._in_flight >= self.max_vector_workers:
+                return None
+            self._in_flight += 1
+        future = self._executor.submit(
+            self.index_manager.search, query, limit, search_filter
+        )
+        future.add_done_callback(self._vector_done)
+        return future
+
+    def _vector_done(self, _future):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _vector_results(self, future) -> List[Tuple[str, dict]]:
+        if future is None:
+            return []
+        try:
+            results = future.result(timeout=self.vector_timeout)
+        except FutureTimeoutError:
+            # Left running: its embedding still lands in the query cache
+            self._vector_failed("vector search timed out", timed_out=True)
+        except Exception as e:
+            self._vector_failed(str(e))
+        else:
+            self._vector_succeeded()
+            return results
+        return []
+
+    async def _avector_results(self, future) -> List[Tuple[str, dict]]:
+        if future is None:
+            return []
+        try:
+            # Shielded so a timeout leaves the search running, as in search()
+            results = await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(future)), self.vector_timeout
+            )
+        except asyncio.TimeoutError:
+            self._vector_failed("vector search timed out", timed_out=True)
+        except Exception as e:
+            self._vector_failed(str(e))
+        else:
+            self._vector_succeeded()
+            return results
+        return []
+
+    def _vector_succeeded(self):
+        with self._lock:
+            self._consecutive_failures = 0
+
+    def _vector_failed(self, reason: str, timed_out: bool = False):
+        """
+        Count a timed out or failed vector search, switching to lexical-only
+        once `failure_threshold` of them happened in a row.
+        """
+        with self._lock:
+            if timed_out:
+                self.vector_timeouts += 1
+            else:
+                self.vector_errors += 1
+            self._consecutive_failures += 1
+            if self._consecutive_failures < self.failure_threshold:
+                return
+            failures, self._consecutive_failures = self._consecutive_failures, 0
+            self._lexical_only_until = time.monotonic() + self.cooldown_seconds
+        print(
+            f"[Hybrid Search] Lexical-only for {self.cooldown_seconds:.0f}s after "
+            f"{failures} failed vector searches: {reason}"
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            remaining = max(0.0, self._lexical_only_until - time.monotonic())
+            return {
+                "modes": dict(self.modes),
+                "vector_timeouts": self.vector_timeouts,
+                "vector_errors": self.vector_errors,
+                "vector_in_flight": self._in_flight,
+                "vector_consecutive_failures": self._consecutive_failures,
+                "lexical_only": remaining > 0,
+                "lexical_only_remaining_seconds": remaining,
+            }
@@ -0,0 +1,48 @@
+"""
+Fingerprints of uploaded images: the SHA-256 of the bytes, for exact
+copies, and a 64-bit difference hash (dHash) of the pixels, which stays
+within a few bits for the same photo re-encoded, resized or recompressed.
+"""
+
+import hashlib
+import io
+from typing import Optional
+
+# dHash compares each pixel of a 9x8 grayscale thumbnail with its neighbour
+_DHASH_SIZE = 8
+
+
+def sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def dhash(data: bytes) -> Optional[str]:
+    """
+    The image's difference hash as 16 hex digits, or None if the bytes are
+    not an image Pillow can decode.
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            pixels = list(
+                image.convert("L")
+                .resize((_DHASH_SIZE + 1, _DHASH_SIZE), Image.Resampling.LANCZOS)
+                .getdata()
+            )
+    except Exception:
+        return None
+    bits = 0
+    for row in range(_DHASH_SIZE):
+        for col in range(_DHASH_SIZE):
+            left = pixels[row * (_DHASH_SIZE + 1) + col]
+            right = pixels[row * (_DHASH_SIZE + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:016x}"
+
+
+def hamming(a: str, b: str) -> int:
+    """
+    Number of differing bits between two hex hashes.
+    """
+    return (int(a, 16) ^ int(b, 16)).bit_count()
@@ -0,0 +1,312 @@
+"""
+Write-behind indexing pipeline for new and deleted posts.
+
+Posts are queued without blocking the request, embedded in batches of up to
+`batch_size` posts or `batch_interval_ms` milliseconds (whichever comes first)
+and the index is persisted only after `persist_every` changes or every
+`persist_interval_seconds`, instead of after every single post.
+
+Posts whose batch still fails after MAX_BATCH_ATTEMPTS are appended to a
+dead-letter file (one JSON line per post) so that
+`python -m app.utils.faiss_backfill --retry-failed` can index them later.
+"""
+
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+MAX_BATCH_ATTEMPTS = 3
+
+
+class _FlushMarker:
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class IndexingQueue:
+    """Background worker batching post embeddings into the resident index."""
+
+    def __init__(
+        self,
+        index_manager,
+        batch_size: int = 32,
+        batch_interval_ms: int = 200,
+        persist_every: int = 100,
+        persist_interval_seconds: float = 30.0,
+        dead_letter_path: Optional[str] = None,
+    ):
+        self.index_manager = index_manager
+        self.dead_letter_path = dead_letter_path
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval_ms / 1000.0
+        self.persist_every = persist_every
+        self.persist_interval = persist_interval_seconds
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stopping = False
+        self._unsaved_changes = 0
+        self._last_persist = time.monotonic()
+        self._submitted = 0
+        self._indexed = 0
+        self._deleted = 0
+        self._failed = 0
+        self._dead_lettered = 0
+        self._batches = 0
+        self._persists = 0
+
+    def start(self):
+        """
+        Start the background worker if it is not running yet.
+        """
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(
+                target=self._run, name="faiss-indexing-queue", daemon=True
+            )
+            self._thread.start()
+
+    def submit(self, text: str, metadata: dict = None):
+        """
+        Queue a post for indexing and return immediately.
+        """
+        if not text:
+            return
+        self.start()
+        self._submitted += 1
+        self._queue.put(("upsert", text, metadata))
+
+    def submit_delete(self, post_id: str):
+        """
+        Queue the removal of a post from the index and return immediately.
+        """
+        self.start()
+        self._submitted += 1
+        self._queue.put(("delete", post_id, None))
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Block until every post submitted so far is indexed and persisted.
+        Returns False if the timeout expired first.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._drain_inline()
+            return True
+        marker = _FlushMarker()
+        self._queue.put(marker)
+        return marker.done.wait(timeout)
+
+    def stop(self, timeout: float = None):
+        """
+        Drain the queue, persist the index and stop the worker.
+        Used on application shutdown.
+        """
+        self.flush(timeout)
+        if self._thread is not None and self._thread.is_alive():
+            self._stopping = True
+            self._queue.put(None)
+            self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._queue.qsize(),
+            "submitted": self._submitted,
+            "indexed": self._indexed,
+            "deleted": self._deleted,
+            "failed": self._failed,
+            "dead_lettered": self._dead_lettered,
+            "batches": self._batches,
+            "persists": self._persists,
+            "unsaved_changes": self._unsaved_changes,
+        }
+
+    def _drain_inline(self):
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, _FlushMarker):
+                item.done.set()
+            elif item is not None:
+                batch.append(item)
+        self._index_batch(batch)
+        self._persist()
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                item = self._queue.get(timeout=self._time_until_persist())
+            except queue.Empty:
+                self._maybe_persist()
+                continue
+            if item is None:
+                break
+            if isinstance(item, _FlushMarker):
+                self._persist()
+                item.done.set()
+                continue
+
+            batch = [item]
+            markers: List[_FlushMarker] = []
+            deadline = time.monotonic() + self.batch_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    next_item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if next_item is None:
+                    self._stopping = True
+                    break
+                if isinstance(next_item, _FlushMarker):
+                    markers.append(next_item)
+                    break
+                batch.append(next_item)
+
+            self._index_batch(batch)
+            if markers:
+                self._persist()
+                for marker in markers:
+                    marker.done.set()
+            else:
+                self._maybe_persist()
+        self._persist()
+
+    def _index_batch(self, batch):
+        upserts = [(text, metadata) for op, text, metadata in batch if op == "upsert"]
+        deletes = [post_id for op, post_id, _ in batch if op == "delete"]
+        self._upsert_batch(upserts)
+        if deletes:
+            try:
+                removed = self.index_manager.remove(deletes, save=False)
+            except Exception as e:
+                print(f"[FAISS Queue] Failed to remove {len(deletes)} posts: {str(e)}")
+                self._failed += len(deletes)
+                self._dead_letter("delete", deletes, e)
+            else:
+                self._deleted += removed
+                self._unsaved_changes += removed
+
+    def _upsert_batch(self, batch):
+        if not batch:
+            return
+        texts = [text for text, _ in batch]
+        metadatas = [metadata or {} for _, metadata in batch]
+        for attempt in range(1, MAX_BATCH_ATTEMPTS + 1):
+            try:
+                self.index_manager.add_texts(texts, metadatas=metadatas, save=False)
+                break
+            except Exception as e:
+                print(
+                    f"[FAISS Queue] Failed to index batch of {len(texts)} posts "
+                    f"(attempt {attempt}/{MAX_BATCH_ATTEMPTS}): {str(e)}"
+                )
+                if attempt == MAX_BATCH_ATTEMPTS:
+                    self._failed += len(texts)
+                    self._dead_letter(
+                        "upsert",
+                        [str(m["post_id"]) for m in metadatas if m.get("post_id")],
+                        e,
+                    )
+                    return
+                time.sleep(0.5 * attempt)
+        self._batches += 1
+        self._indexed += len(texts)
+        self._unsaved_changes += len(texts)
+
+    def _dead_letter(self, op: str, post_ids: List[str], error: Exception):
+        """
+        Record posts the queue gave up on, for faiss_backfill --retry-failed.
+        """
+        if not post_ids:
+            return
+        print(f"[FAISS Queue] Gave up on {op} of posts: {', '.join(post_ids)}")
+        if not self.dead_letter_path:
+            return
+        failed_at = datetime.datetime.now().isoformat()
+        try:
+            with open(self.dead_letter_path, "a") as f:
+                for post_id in post_ids:
+                    entry = {
+                        "op": op,
+                        "post_id": post_id,
+                        "error": str(error),
+                        "failed_at": failed_at,
+                    }
+                    f.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            print(f"[FAISS Queue] Failed to write dead letters: {str(e)}")
+            return
+        self._dead_lettered += len(post_ids)
+
+    def _time_until_persist(self) -> Optional[float]:
+        if not self._unsaved_changes:
+            return None
+        return max(0.0, self._last_persist + self.persist_interval - time.monotonic())
+
+    def _maybe_persist(self):
+        if self._unsaved_changes >= self.persist_every or (
+            self._unsaved_changes
+            and time.monotonic() - self._last_persist >= self.persist_interval
+        ):
+            self._persist()
+
+    def _persist(self):
+        if not self._unsaved_changes:
+            return
+        try:
+            self.index_manager.save()
+        except Exception as e:
+            print(f"[FAISS Queue] Failed to persist index: {str(e)}")
+            return
+        self._unsaved_changes = 0
+        self._last_persist = time.monotonic()
+        self._persists += 1
+
+
+def take_dead_letters(path: str) -> Dict[str, dict]:
+    """
+    Claim the entries of a dead-letter file, latest entry per post_id. The
+    file is moved aside first, so posts failing meanwhile start a new one;
+    hand back the entries that fail again with return_dead_letters().
+    """
+    claimed_path = path + ".retrying"
+    if not os.path.exists(claimed_path):
+        try:
+            os.replace(path, claimed_path)
+        except FileNotFoundError:
+            return {}
+    entries = {}
+    with open(claimed_path, "r") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                entries[entry["post_id"]] = entry
+    return entries
+
+
+def return_dead_letters(path: str, entries: List[dict]):
+    with open(path, "a") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+
+
+def finish_dead_letters(path: str):
+    """
+    Drop the entries claimed by take_dead_letters() once they are handled.
+    """
+    try:
+        os.remove(path + ".retrying")
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,430 @@
+"""
+Durable background job queue stored in SQLite, with a pool of worker threads.
+
+Jobs survive restarts: a job is claimed by setting a lease, and a job whose
+worker died is picked up again once its lease expires. Failed jobs are
+retried with exponential backoff up to their attempt limit. Jobs sharing a
+key (e.g. one patient's uploads) run one at a time, in submission order.
+Each job records how long every stage of its handler took, for the status
+endpoint.
+"""
+
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from app.utils.metrics import LatencyRecorder
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+SKIPPED = "skipped"
+STATES = (QUEUED, RUNNING, SUCCEEDED, FAILED, SKIPPED)
+
+# Longest time a worker sleeps before looking for due jobs again
+POLL_INTERVAL_SECONDS = 1.0
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler for failures that retrying cannot fix."""
+
+
+class JobSkipped(Exception):
+    """
+    Raised by a handler that found its work needless (e.g. already done by
+    another job). The job ends as "skipped" with `result` and the reason.
+    """
+
+    def __init__(self, reason: str, result=None):
+        super().__init__(reason)
+        self.result = result
+
+
+class JobContext:
+    """
+    Handed to a job handler: the job's payload, stage() for timing its steps
+    and checkpoint() for keeping results of steps a retry must not repeat.
+    Both are saved right away and renew the lease.
+    """
+
+    def __init__(self, queue: "JobQueue", job: dict):
+        self.queue = queue
+        self.id = job["id"]
+        self.kind = job["kind"]
+        self.payload = job["payload"]
+        self.attempt = job["attempts"]
+        self.stages: List[dict] = job["stages"]
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.stages.append(
+                {
+                    "name": name,
+                    "attempt": self.attempt,
+                    "seconds": round(time.perf_counter() - started, 4),
+                    "ok": ok,
+                }
+            )
+            self.queue._save_progress(self.id, self.stages, self.payload)
+
+    def completed(self, name: str) -> bool:
+        """
+        Whether stage `name` succeeded during the current attempt.
+        """
+        return any(
+            stage["name"] == name and stage["attempt"] == self.attempt and stage["ok"]
+            for stage in self.stages
+        )
+
+    def checkpoint(self, key: str, value):
+        """
+        Store `value` in the payload, so retries see it.
+        """
+        self.payload[key] = value
+        self.queue._save_progress(self.id, self.stages, self.payload)
+
+
+class JobQueue:
+    """
+    SQLite-backed job queue. Handlers are registered per job kind and called
+    as handler(JobContext); what they return (JSON-serializable) is stored
+    as the job's result.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        workers: int = 2,
+        max_attempts: int = 3,
+        retry_backoff_seconds: float = 5.0,
+        lease_seconds: float = 600.0,
+    ):
+        self.path = path
+        self.workers = max(1, workers)
+        self.max_attempts = max_attempts
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.lease_seconds = lease_seconds
+        self._handlers: Dict[str, Callable[[JobContext], object]] = {}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Autocommit mode so claims can use explicit BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30.0
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, "
+            "kind TEXT NOT NULL, "
+            "key TEXT, "
+            "payload TEXT NOT NULL, "
+            "state TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "max_attempts INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "run_after REAL NOT NULL, "
+            "started_at REAL, "
+            "finished_at REAL, "
+            "lease_until REAL, "
+            "stages TEXT NOT NULL DEFAULT '[]', "
+            "result TEXT, "
+            "error TEXT)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_due ON jobs (state, run_after)"
+        )
+        self._threads: List[threading.Thread] = []
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._wakeup = threading.Event()
+        self._durations: Dict[str, LatencyRecorder] = {}
+        self._retries = 0
+
+    def register(self, kind: str, handler: Callable[[JobContext], object]):
+        self._handlers[kind] = handler
+
+    def enqueue(
+        self,
+        kind: str,
+        payload: dict,
+        key: Optional[str] = None,
+        max_attempts: Optional[int] = None,
+    ) -> str:
+        """
+        Store a new job and return its id. Jobs with the same `key` never
+        run concurrently.
+        """
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, key, payload, state, max_attempts, "
+                "created_at, run_after) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    kind,
+                    key,
+                    json.dumps(payload),
+                    QUEUED,
+                    max_attempts or self.max_attempts,
+                    now,
+                    now,
+                ),
+            )
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """
+        The job's state, timings, stages and result, or None if unknown.
+        """
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            columns = [column[0] for column in cursor.description]
+        if row is None:
+            return None
+        return self._decode(dict(zip(columns, row)))
+
+    def status(self, job_id: str) -> Optional[dict]:
+        """
+        What clients may see of a job: state, attempts, timestamps, time spent
+        queued and running, stages, result and last error.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+
+        def iso(timestamp):
+            if timestamp is None:
+                return None
+            return datetime.datetime.fromtimestamp(timestamp).isoformat()
+
+        started, finished = job["started_at"], job["finished_at"]
+        return {
+            "id": job["id"],
+            "kind": job["kind"],
+            "state": job["state"],
+            "attempts": job["attempts"],
+            "max_attempts": job["max_attempts"],
+            "created_at": iso(job["created_at"]),
+            "started_at": iso(started),
+            "finished_at": iso(finished),
+            "queued_seconds": started - job["created_at"] if started else None,
+            "run_seconds": finished - started if started and finished else None,
+            "stages": job["stages"],
+            "result": job["result"],
+            "error": job["error"],
+        }
+
+    @staticmethod
+    def _decode(row: dict) -> dict:
+        row["payload"] = json.loads(row["payload"])
+        row["stages"] = json.loads(row["stages"])
+        row["result"] = json.loads(row["result"]) if row["result"] else None
+        return row
+
+    def start(self):
+        """
+        Start the worker threads if they are not running yet.
+        """
+        with self._start_lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            if self._threads:
+                return
+            self._stopping.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._run, name=f"job-worker-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: float = None):
+        """
+        Let running jobs finish and stop the workers. Queued jobs stay in the
+        database for the next start.
+        """
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _claim(self) -> Optional[dict]:
+        """
+        Atomically take the oldest due job whose key is free, or a running
+        job whose lease expired (its worker died).
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Same-key jobs wait for a running one and for older ones,
+                # including those waiting for a retry
+                cursor = self._conn.execute(
+                    "SELECT * FROM jobs WHERE "
+                    "((state = ? AND run_after <= ?) "
+                    "OR (state = ? AND lease_until < ?)) "
+                    "AND (key IS NULL OR NOT EXISTS ("
+                    "SELECT 1 FROM jobs AS other WHERE other.key = jobs.key "
+                    "AND other.id != jobs.id AND ("
+                    "(other.state = ? AND other.lease_until >= ?) "
+                    "OR (other.state = ? AND other.created_at < jobs.created_at)"
+                    "))) "
+                    "ORDER BY created_at LIMIT 1",
+                    (QUEUED, now, RUNNING, now, RUNNING, now, QUEUED),
+                )
+                row = cursor.fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                job = dict(zip([column[0] for column in cursor.description], row))
+                job["attempts"] += 1
+                job["started_at"] = job["started_at"] or now
+                self._conn.execute(
+                    "UPDATE jobs SET state = ?, attempts = ?, started_at = ?, "
+                    "lease_until = ? WHERE id = ?",
+                    (
+                        RUNNING,
+                        job["attempts"],
+                        job["started_at"],
+                        now + self.lease_seconds,
+                        job["id"],
+                    ),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self._decode(job)
+
+    def _save_progress(self, job_id: str, stages: List[dict], payload: dict):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET stages = ?, payload = ?, lease_until = ? "
+                "WHERE id = ?",
+                (
+                    json.dumps(stages),
+                    json.dumps(payload),
+                    time.time() + self.lease_seconds,
+                    job_id,
+                ),
+            )
+
+    def _finish(self, job_id: str, state: str, result=None, error: str = None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, finished_at = ?, lease_until = NULL, "
+                "result = ?, error = ? WHERE id = ?",
+                (
+                    state,
+                    time.time(),
+                    json.dumps(result) if result is not None else None,
+                    error,
+                    job_id,
+                ),
+            )
+        # A job of the same key may be runnable now
+        self._wakeup.set()
+
+    def _retry(self, job: dict, error: str):
+        delay = self.retry_backoff_seconds * 2 ** (job["attempts"] - 1)
+        with self._lock:
+            self._retries += 1
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, run_after = ?, lease_until = NULL, "
+                "error = ? WHERE id = ?",
+                (QUEUED, time.time() + delay, error, job["id"]),
+            )
+        self._wakeup.set()
+        print(
+            f"[Jobs] {job['kind']} job {job['id']} failed "
+            f"(attempt {job['attempts']}/{job['max_attempts']}), "
+            f"retrying in {delay:.0f}s: {error}"
+        )
+
+    def _execute(self, job: dict):
+        handler = self._handlers.get(job["kind"])
+        if handler is None:
+            self._finish(job["id"], FAILED, error=f"No handler for {job['kind']}")
+            return
+        if job["attempts"] > job["max_attempts"]:
+            # Claimed again after its worker died on the last attempt
+            self._finish(job["id"], FAILED, error=job["error"] or "Worker lost")
+            return
+        started = time.perf_counter()
+        try:
+            result = handler(JobContext(self, job))
+        except JobSkipped as e:
+            self._finish(job["id"], SKIPPED, result=e.result, error=str(e))
+            print(f"[Jobs] {job['kind']} job {job['id']} skipped: {e}")
+            return
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if (
+                isinstance(e, PermanentJobError)
+                or job["attempts"] >= job["max_attempts"]
+            ):
+                self._finish(job["id"], FAILED, error=error)
+                print(f"[Jobs] {job['kind']} job {job['id']} failed: {error}")
+            else:
+                self._retry(job, error)
+            return
+        self._finish(job["id"], SUCCEEDED, result=result)
+        with self._lock:
+            recorder = self._durations.setdefault(job["kind"], LatencyRecorder())
+        recorder.record(time.perf_counter() - started)
+
+    def _next_due_in(self) -> float:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(run_after) FROM jobs WHERE state = ?", (QUEUED,)
+            ).fetchone()
+        if row[0] is None:
+            return POLL_INTERVAL_SECONDS
+        return min(POLL_INTERVAL_SECONDS, max(0.0, row[0] - time.time()))
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                print(f"[Jobs] Failed to claim a job: {str(e)}")
+                job = None
+            if job is not None:
+                self._execute(job)
+                continue
+            self._wakeup.wait(self._next_due_in())
+            self._wakeup.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+            ).fetchall()
+            durations = {kind: r.stats() for kind, r in self._durations.items()}
+            retries = self._retries
+        counts = {state: 0 for state in STATES}
+        counts.update(dict(rows))
+        return {
+            **counts,
+            "retries": retries,
+            "workers": len([t for t in self._threads if t.is_alive()]),
+            "run_time": durations,
+        }
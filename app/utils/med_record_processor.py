@@ -1,47 +1,43 @@
 import google.generativeai as genai
 from app.settings import settings
-import sys
-import os
 import json
 import re
 import datetime
-from fpdf import FPDF
-import PyPDF2
+import contextlib
 import requests
-from app.utils.pdf_utils import extract_text_from_pdf
+from app.db.base import SessionLocal
+from app.db.db_schema import Medication
+from app.db.medication import active_medications, add_prescription_data, upcoming_visit
+from app.utils.patient_summary import format_summary, load_summary, update_summary
+from app.utils.record_index import index_record_section, record_context
+from app.utils.record_store import append_section
+from app.utils.reminders import reminder_scheduler
 
 genai.configure(api_key=settings.GENAI_API_KEY)
 
+# Query for the parts of a medical record about medication
+MEDICINE_RECORD_QUERY = (
+    "prescribed medicines, dosage, frequency, duration, diagnosis and "
+    "the condition each medicine treats"
+)
 
-class PDFGenerator:
-    """Generates a structured PDF from text data."""
 
-    def __init__(self, output_path):
-        self.pdf = FPDF()
-        self.pdf.add_page()
-        self.pdf.set_font("Arial", size=12)
-        self.output_path = output_path
-
-    def add_section(self, title, content):
-        """Adds a section to the PDF with a title and content."""
-        self.pdf.set_font("Arial", "B", 14)
-        self.pdf.cell(200, 10, title, ln=True, align="L")
-        self.pdf.ln(4)
-        self.pdf.set_font("Arial", size=12)
-        self.pdf.multi_cell(0, 10, content)
-        self.pdf.ln(5)
+def generative_model(model_name: str):
+    """
+    A Gemini model, or its offline stand-in when LLM_BACKEND is "fake".
+    """
+    if settings.LLM_BACKEND == "fake":
+        from app.utils.fake_llm import FakeGenerativeModel
 
-    def save_pdf(self):
-        """Saves the PDF to the specified path."""
-        self.pdf.output(self.output_path)
-        print(f"PDF saved to {self.output_path}")
+        return FakeGenerativeModel(model_name)
+    return genai.GenerativeModel(model_name)
 
 
 def process_medical_image(image_bytes):
     """Extract structured text and notification data from medical image using Gemini."""
     if not image_bytes or len(image_bytes) == 0:
         raise ValueError("Image data is empty. Please provide a valid image.")
-    model = genai.GenerativeModel("gemini-1.5-flash")
+    model = generative_model("gemini-1.5-flash")
     try:
         response = model.generate_content(
             [
@@ -141,89 +137,212 @@ def extract_notification_json(text):
         return None
 
 
-def save_notification_data(json_data, output_dir):
-    """Save or update notification data in JSON file with timestamp."""
-    try:
-        output_path = os.path.join(output_dir, "medical_notifications.json")
-        current_time = datetime.datetime.now().isoformat()
-
-        # Create notification entry
-        notification_entry = {
-            "processing_time": current_time,
-            "patient_info": json_data.get("patient_info", {}),
-            "medications": json_data.get("medications", []),
-            "next_visit": json_data.get("next_visit", {}),
-        }
-
-        # Read existing data or initialize new list
-        if os.path.exists(output_path):
-            with open(output_path, "r") as f:
-                existing_data = json.load(f)
-        else:
-            existing_data = []
+def summarize_record_update(previous_summary, structured_text, json_data):
+    """
+    Next version of a patient's clinical summary from the previous version and
+    one newly extracted record, using Gemini.
+    """
+    model = generative_model("gemini-1.5-flash")
+    prescription = json.dumps(json_data, indent=2) if json_data else "None"
+    response = model.generate_content(
+        "You maintain a compact summary of a patient's current medical state.\n"
+        "Update the current summary with the new medical record below and return "
+        "only the updated summary, using exactly these headings:\n"
+        "Active Medications: name, dosage, timing and until when, one per line\n"
+        "Conditions: current diagnoses and ongoing conditions\n"
+        "Allergies:\n"
+        "Next Visit: date and reason\n"
+        "Rules:\n"
+        "- Keep everything from the current summary that the new record does not "
+        "change.\n"
+        "- Add new medications, and remove medications the new record stops or "
+        "replaces, or whose duration has ended.\n"
+        "- Write 'None known' under a heading with no information.\n"
+        "- Do not include anything else, and keep it short.\n"
+        "\n---\n"
+        f"Today's date: {datetime.date.today().isoformat()}\n\n"
+        f"Current summary:\n{previous_summary or 'None yet'}\n\n"
+        f"New medical record:\n{structured_text}\n\n"
+        f"New prescription data (JSON):\n{prescription}\n",
+        generation_config={
+            "temperature": 0.1,
+            "max_output_tokens": 1024,
+        },
+    )
+    return response.text
 
-        # Append new entry
-        existing_data.append(notification_entry)
 
-        # Save updated data
-        with open(output_path, "w") as f:
-            json.dump(existing_data, f, indent=2)
+def update_patient_summary(username, section_title, structured_text, json_data):
+    """
+    Fold a newly extracted record into the patient's rolling summary.
+    """
 
-        print(f"Notification data updated at {output_path}")
+    def compute(previous):
+        if previous is not None:
+            return summarize_record_update(
+                previous["summary"], structured_text, json_data
+            )
+        # No summary yet: seed it with the medication-related parts of any
+        # earlier record instead of reading the whole history
+        return summarize_record_update(
+            record_context(username, MEDICINE_RECORD_QUERY),
+            structured_text,
+            json_data,
+        )
 
-    except Exception as e:
-        print(f"Error saving notification data: {str(e)}")
+    return update_summary(username, section_title, compute)
 
 
-def extract_med_info_save(image_bytes, username):
+def save_notification_data(json_data, username, source=None):
+    """
+    Store the prescription's medications and next visit in one transaction.
+    Raises if they cannot be stored.
+    """
+    db = SessionLocal()
     try:
-        print("Processing medical record...")
+        rows = add_prescription_data(db, username, json_data, source)
+        print(f"Saved {len(rows)} medication and visit entries of {username}")
+        try:
+            # While the session is open, so the rows can load their ids
+            reminder_scheduler.add_medications(
+                row for row in rows if isinstance(row, Medication)
+            )
+        except Exception as e:
+            # The rows are stored; the scheduler picks them up when it reloads
+            print(f"Error scheduling reminders: {str(e)}")
+    finally:
+        db.close()
+
+
+def format_medications(username) -> str:
+    """
+    The patient's active medications and next visit as prompt text.
+    """
+    db = SessionLocal()
+    try:
+        medications = active_medications(db, username)
+        visit = upcoming_visit(db, username)
+    finally:
+        db.close()
+    lines = []
+    for m in medications:
+        times = [
+            time
+            for time in ("morning", "afternoon", "evening", "night")
+            if getattr(m, time)
+        ]
+        until = f"until {m.end_date.isoformat()}" if m.end_date else "ongoing"
+        line = f"- {m.name} {m.dosage or ''}".rstrip()
+        line += f": {', '.join(times) or 'as directed'}; {until}"
+        if m.instructions:
+            line += f"; {m.instructions}"
+        lines.append(line)
+    text = "Active medications:\n" + ("\n".join(lines) if lines else "None")
+    if visit is not None:
+        text += f"\nNext visit: {visit.visit_date.isoformat()}"
+        if visit.reason:
+            text += f" ({visit.reason})"
+    return text
+
+
+def _untimed_stage(name):
+    return contextlib.nullcontext()
+
+
+def extract_med_info(image_bytes, stage=None) -> dict:
+    """
+    Extract a medical record from an image with Gemini. Returns the section
+    to add to the record ("section_title", "recorded_at", "structured_text")
+    and the prescription data ("json_data", None if there is none).
+    """
+    stage = stage or _untimed_stage
+    print("Processing medical record...")
 
+    with stage("extract"):
         response_text = process_medical_image(image_bytes)
-        output_dir = os.getcwd()  # Use current working directory for output
-        output_dir = os.path.join(output_dir, "static", username)
-        os.makedirs(output_dir, exist_ok=True)
-
-        # Split response into structured text and JSON data
-        structured_text = response_text.split("```json")[0].strip()
-        json_data = extract_notification_json(response_text)
-
-        # Handle PDF generation
-        output_pdf_path = os.path.join(output_dir, "Medical_Record.pdf")
-        current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        section_title = f"Extracted Medical Record ({current_time})"
-
-        if os.path.exists(output_pdf_path):
-            # Create temporary PDF with new content
-            temp_pdf_path = os.path.join(output_dir, "TEMP_MEDICAL_RECORD.pdf")
-            pdf_gen = PDFGenerator(temp_pdf_path)
-            pdf_gen.add_section(section_title, structured_text)
-            pdf_gen.save_pdf()
-
-            # Merge with existing PDF
-            merger = PyPDF2.PdfMerger()
-            merger.append(output_pdf_path)
-            merger.append(temp_pdf_path)
-            merger.write(output_pdf_path)
-            merger.close()
-
-            # Cleanup temporary file
-            os.remove(temp_pdf_path)
-            print(f"Updated existing PDF at {output_pdf_path}")
-        else:
-            # Create new PDF
-            pdf_gen = PDFGenerator(output_pdf_path)
-            pdf_gen.add_section(section_title, structured_text)
-            pdf_gen.save_pdf()
-
-        # Handle JSON notifications
-        if json_data:
-            save_notification_data(json_data, output_dir)
+    # Split response into structured text and JSON data
+    structured_text = response_text.split("```json")[0].strip()
+    json_data = extract_notification_json(response_text)
+
+    current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return {
+        "section_title": f"Extracted Medical Record ({current_time})",
+        "recorded_at": current_time,
+        "structured_text": structured_text,
+        "json_data": json_data,
+    }
+
+
+def save_record_section(
+    extraction: dict, username, stage=None, section_id=None
+) -> dict:
+    """
+    Add an extracted section to the patient's record, record index and
+    summary. Raises if adding the section fails. Saving the same
+    `section_id` again (a retried job) adds nothing twice.
+    """
+    stage = stage or _untimed_stage
+    section_title = extraction["section_title"]
+    structured_text = extraction["structured_text"]
+    json_data = extraction["json_data"]
+    recorded_at = datetime.datetime.strptime(
+        extraction["recorded_at"], "%Y-%m-%d %H:%M:%S"
+    )
+
+    with stage("record"):
+        append_section(
+            username, section_title, structured_text, recorded_at, section_id
+        )
+
+    with stage("record_index"):
+        try:
+            index_record_section(
+                username, section_title, structured_text, recorded_at, section_id
+            )
+        except Exception as e:
+            # The record itself is saved; the index is rebuilt from it on demand
+            print(f"Error indexing medical record: {str(e)}")
+    with stage("summary"):
+        try:
+            update_patient_summary(username, section_title, structured_text, json_data)
+        except Exception as e:
+            # The previous summary stays current; chat still has the record
+            print(f"Error updating patient summary: {str(e)}")
+
+    return {
+        "section_title": section_title,
+        "medications": len((json_data or {}).get("medications") or []),
+        "next_visit": (json_data or {}).get("next_visit"),
+    }
+
+
+def save_extracted_notifications(extraction: dict, username, stage=None):
+    """
+    Store the medications and next visit of an extraction. Raises if they
+    cannot be stored.
+    """
+    stage = stage or _untimed_stage
+    with stage("notifications"):
+        if extraction["json_data"]:
+            save_notification_data(
+                extraction["json_data"], username, extraction["section_title"]
+            )
             print("Successfully saved medication tracking data")
         else:
             print("No medication or follow-up data found in document")
-    except Exception as e:
-        print(f"Error: {str(e)}")
+
+
+def extract_med_info_save(image_bytes, username, stage=None):
+    """
+    Extract a medical record from an image with Gemini and add it to the
+    patient's record (sections, index, summary and notifications).
+    Raises if the extraction or adding the section fails. `stage(name)` returns a
+    context manager timing each step (see JobContext.stage).
+    """
+    extraction = extract_med_info(image_bytes, stage)
+    record = save_record_section(extraction, username, stage)
+    save_extracted_notifications(extraction, username, stage)
+    return record
 
 
 def get_image(url: str) -> bytes | None:
@@ -237,27 +356,24 @@ def get_image(url: str) -> bytes | None:
         return None
 
 
-def ask_gemini_about_medicine(image_bytes: bytes, patient_username: str) -> str:
+def medicine_prompt(patient_username: str) -> str:
     """
-    Passes an image of a pill/tablet, patient's Medical_Record.pdf, and medical_notifications.json to Gemini,
-    and asks about the name, purpose, and reason for use of the medicine in the image.
+    Builds the ask-medicine prompt from the patient's current summary (or,
+    before they have one, the parts of their medical record about medication)
+    and their active medications.
     """
-    # Paths to patient files
-    static_dir = os.path.join("static", patient_username)
-    pdf_path = os.path.join(static_dir, "Medical_Record.pdf")
-    json_path = os.path.join(static_dir, "medical_notifications.json")
-
-    # Extract text from PDF
-    pdf_text = extract_text_from_pdf(pdf_path)
+    # Current summary, or the latest visit plus earlier entries about medication
+    summary = load_summary(patient_username)
+    if summary is not None:
+        pdf_text = format_summary(summary)
+    else:
+        pdf_text = record_context(patient_username, MEDICINE_RECORD_QUERY)
 
-    # Load JSON data
-    json_text = ""
-    if os.path.exists(json_path):
-        with open(json_path, "r") as f:
-            json_text = f.read()
+    # Only what the patient takes now, not every prescription ever extracted
+    medications_text = format_medications(patient_username)
 
     # Compose prompt
-    prompt = (
+    return (
         "You are a medical assistant. Given the following documents and an image of a pill or tablet, "
         "answer these questions:\n"
         "1. What is the name of the medicine shown in the image?\n"
@@ -267,12 +383,43 @@ def ask_gemini_about_medicine(image_bytes: bytes, patient_username: str) -> str:
         "5. Which time of the day should I take it?\n"
         "\n---\n"
         f"Patient's Medical Record (PDF):\n{pdf_text}\n\n"
-        f"Patient's Medical Notifications (JSON):\n{json_text}\n\n"
+        f"Patient's Current Medications:\n{medications_text}\n\n"
         "Please answer using only the information from the provided documents and the image."
     )
 
-    model = genai.GenerativeModel("gemini-1.5-flash")
+
+def ask_gemini_about_medicine(image_bytes: bytes, patient_username: str) -> str:
+    """
+    Passes an image of a pill/tablet, patient's medical record, and active medications to Gemini,
+    and asks about the name, purpose, and reason for use of the medicine in the image.
+    """
+    prompt = medicine_prompt(patient_username)
+    model = generative_model("gemini-1.5-flash")
     response = model.generate_content(
         [prompt, {"mime_type": "image/jpeg", "data": image_bytes}]
     )
     return response.text
+
+
+async def ask_gemini_about_medicine_async(image_bytes: bytes, prompt: str) -> str:
+    """
+    Async ask_gemini_about_medicine for a prompt built with medicine_prompt().
+    """
+    model = generative_model("gemini-1.5-flash")
+    response = await model.generate_content_async(
+        [prompt, {"mime_type": "image/jpeg", "data": image_bytes}]
+    )
+    return response.text
+
+
+async def stream_gemini_about_medicine(image_bytes: bytes, prompt: str):
+    """
+    Same question as ask_gemini_about_medicine, for a prompt built with
+    medicine_prompt(), yielding the answer text as Gemini generates it.
+    """
+    model = generative_model("gemini-1.5-flash")
+    response = await model.generate_content_async(
+        [prompt, {"mime_type": "image/jpeg", "data": image_bytes}], stream=True
+    )
+    async for chunk in response:
+        yield chunk.text
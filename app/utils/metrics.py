@@ -0,0 +1,72 @@
+"""
+Lightweight in-process metrics registry exposed through the /metrics endpoint.
+"""
+
+import threading
+from collections import deque
+from typing import Callable, Dict, Optional
+
+_providers: Dict[str, Callable[[], dict]] = {}
+_lock = threading.Lock()
+
+
+def register_stats(name: str, provider: Callable[[], dict]):
+    """
+    Register a callable returning a dict of stats under the given name.
+    Registering the same name again replaces the previous provider.
+    """
+    with _lock:
+        _providers[name] = provider
+
+
+def collect_stats() -> dict:
+    """
+    Collect the current stats of every registered provider.
+    """
+    with _lock:
+        providers = dict(_providers)
+    stats = {}
+    for name, provider in providers.items():
+        try:
+            stats[name] = provider()
+        except Exception as e:
+            stats[name] = {"error": str(e)}
+    return stats
+
+
+class LatencyRecorder:
+    """
+    Keeps the last `window` latency samples (in seconds) and reports
+    count, mean and p50/p95/p99 over them in milliseconds.
+    """
+
+    def __init__(self, window: int = 1000):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(q / 100 * (len(samples) - 1))))
+        return samples[index] * 1000.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            samples = list(self._samples)
+        if not samples:
+            return {"count": self.count}
+        return {
+            "count": self.count,
+            "mean_ms": sum(samples) / len(samples) * 1000.0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+        }
@@ -0,0 +1,105 @@
+"""
+Rolling "current state" summary of each patient's medical record.
+
+Every prescription upload produces a new version of the summary (active
+medications, conditions, allergies, next visit) from the previous version
+plus the new extraction only, so updating it costs the same however long
+the record gets. The current version lives in Patient_Summary.json next to
+the record; every version is also appended to Patient_Summary_History.jsonl.
+"""
+
+import datetime
+import json
+import os
+import threading
+from typing import Callable, Dict, Optional
+
+from app.utils.cache import TTLCache
+from app.utils.record_store import record_dir
+
+SUMMARY_FILE = "Patient_Summary.json"
+SUMMARY_HISTORY_FILE = "Patient_Summary_History.jsonl"
+
+_cache = TTLCache(maxsize=256)
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def _lock_for(username: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(username, threading.Lock())
+
+
+def _summary_path(username: str) -> str:
+    return os.path.join(record_dir(username), SUMMARY_FILE)
+
+
+def load_summary(username: str) -> Optional[dict]:
+    """
+    The patient's current summary ({"version", "updated_at", "source",
+    "summary"}), or None if none was made yet.
+    """
+    path = _summary_path(username)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _cache.get(username)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with open(path, "r", encoding="utf-8") as f:
+        summary = json.load(f)
+    _cache.set(username, (version, summary))
+    return summary
+
+
+def summary_version(username: str) -> Optional[int]:
+    summary = load_summary(username)
+    return summary["version"] if summary else None
+
+
+def update_summary(
+    username: str, source: str, compute: Callable[[Optional[dict]], str]
+) -> dict:
+    """
+    Store `compute(previous_summary)` as the patient's next summary version.
+    Updates of one patient run one at a time, so none is computed from a
+    stale previous version. If the current version already came from
+    `source` (a retried upload), it is returned unchanged.
+    """
+    with _lock_for(username):
+        previous = load_summary(username)
+        if previous is not None and previous["source"] == source:
+            return previous
+        summary = {
+            "version": (previous["version"] if previous else 0) + 1,
+            "updated_at": datetime.datetime.now().isoformat(),
+            "source": source,
+            "summary": compute(previous).strip(),
+        }
+        os.makedirs(record_dir(username), exist_ok=True)
+        history_path = os.path.join(record_dir(username), SUMMARY_HISTORY_FILE)
+        with open(history_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(summary) + "\n")
+        path = _summary_path(username)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        os.replace(tmp_path, path)
+    print(f"Updated summary of {username} to version {summary['version']}")
+    return summary
+
+
+def format_summary(summary: dict) -> str:
+    """
+    A summary as prompt text.
+    """
+    return (
+        f"Current clinical summary (version {summary['version']}, "
+        f"updated {summary['updated_at'][:10]}):\n{summary['summary']}"
+    )
+
+
+def cache_stats() -> dict:
+    return _cache.stats()
@@ -8,9 +8,6 @@ def extract_text_from_pdf(pdf_path: str) -> str:
     """
     if not os.path.exists(pdf_path):
         return ""
-    text = ""
     with open(pdf_path, "rb") as f:
         reader = PyPDF2.PdfReader(f)
-        for page in reader.pages:
-            text += page.extract_text() or ""
-    return text
+        return "".join(page.extract_text() or "" for page in reader.pages)
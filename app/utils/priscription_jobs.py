@@ -0,0 +1,225 @@
+"""
+Prescription ingestion as background jobs.
+
+The upload endpoint only spools the image to local disk and enqueues a job;
+a worker then uploads it, stores the prescription row, extracts the record
+with Gemini, adds it to the patient's record and stores the medications.
+Steps that must not run twice (the upload, the database insert, the
+extraction, the record update, the medications) are checkpointed, so a
+retry after a failure resumes at the step that failed, from the stored
+extraction.
+
+An image the patient already uploaded (the same bytes, or a look-alike
+image, see image_hash, submitted with the same doctor, hospital and visit)
+is not processed again: the job ends as "skipped", with duplicate_of set to
+the earlier prescription's id.
+"""
+
+import json
+import os
+import threading
+import uuid
+
+from app.db.base import SessionLocal
+from app.db.priscription import (
+    DUPLICATE_FIELDS,
+    add_priscription,
+    add_priscription_upload,
+    find_duplicate_upload,
+)
+from app.settings import settings
+from app.utils.image_hash import dhash, sha256_hex
+from app.utils.job_queue import JobContext, JobQueue, JobSkipped, PermanentJobError
+from app.utils.med_record_processor import (
+    extract_med_info,
+    save_extracted_notifications,
+    save_record_section,
+)
+from app.utils.metrics import register_stats
+from app.utils.uploads import upload_image
+
+PRISCRIPTION_JOB = "priscription_upload"
+
+DEFAULT_JOB_QUEUE_PATH = os.path.join(os.path.dirname(__file__), "job_queue.sqlite3")
+
+job_queue = JobQueue(
+    settings.JOB_QUEUE_PATH or DEFAULT_JOB_QUEUE_PATH,
+    workers=settings.JOB_WORKERS,
+    max_attempts=settings.JOB_MAX_ATTEMPTS,
+    retry_backoff_seconds=settings.JOB_RETRY_BACKOFF_SECONDS,
+    lease_seconds=settings.JOB_LEASE_SECONDS,
+)
+register_stats("jobs", job_queue.stats)
+
+_dedup_lock = threading.Lock()
+_dedup_stats = {"checked": 0, "exact_hits": 0, "perceptual_hits": 0}
+
+
+def dedup_stats() -> dict:
+    with _dedup_lock:
+        stats = dict(_dedup_stats)
+    hits = stats["exact_hits"] + stats["perceptual_hits"]
+    stats["hit_rate"] = hits / stats["checked"] if stats["checked"] else 0.0
+    return stats
+
+
+register_stats("upload_dedup", dedup_stats)
+
+
+def spool_upload(file, username: str) -> str:
+    """
+    Persist an uploaded file under JOB_SPOOL_DIR and return its path.
+    """
+    directory = os.path.join(settings.JOB_SPOOL_DIR, username)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{uuid.uuid4()}.upload")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        while chunk := file.read(1024 * 1024):
+            f.write(chunk)
+    os.replace(tmp_path, path)
+    return path
+
+
+def enqueue_priscription(image_path: str, **fields) -> str:
+    """
+    Queue the ingestion of a spooled prescription image. Uploads of the same
+    patient are processed one at a time, in order.
+    """
+    payload = {"image_path": image_path, **fields}
+    return job_queue.enqueue(PRISCRIPTION_JOB, payload, key=fields["username"])
+
+
+def _find_duplicate(payload: dict, sha256: str, phash: str):
+    """
+    What the patient's earlier upload of the same prescription produced,
+    or None.
+    """
+    db = SessionLocal()
+    try:
+        upload, match = find_duplicate_upload(
+            payload["username"],
+            sha256,
+            phash,
+            settings.UPLOAD_DEDUP_MAX_DISTANCE,
+            fields={name: payload.get(name) for name in DUPLICATE_FIELDS},
+            db=db,
+        )
+        result = None
+        if upload is not None:
+            result = {
+                "duplicate_of": upload.priscription_id,
+                "match": match,
+                "file_url": upload.file_url,
+                "record": json.loads(upload.record) if upload.record else None,
+            }
+    finally:
+        db.close()
+    with _dedup_lock:
+        _dedup_stats["checked"] += 1
+        if match:
+            _dedup_stats[f"{match}_hits"] += 1
+    return result
+
+
+def _save_fingerprint(payload: dict):
+    db = SessionLocal()
+    try:
+        add_priscription_upload(
+            username=payload["username"],
+            sha256=payload["fingerprint"]["sha256"],
+            phash=payload["fingerprint"]["phash"],
+            priscription_id=payload["priscription_id"],
+            file_url=payload["file_url"],
+            record=payload["record"],
+            db=db,
+        )
+    finally:
+        db.close()
+
+
+def process_priscription(job: JobContext) -> dict:
+    payload = job.payload
+    if "extraction" not in payload and not os.path.exists(payload["image_path"]):
+        raise PermanentJobError(f"Spooled image {payload['image_path']} is gone")
+
+    if "fingerprint" not in payload:
+        with job.stage("dedup"):
+            with open(payload["image_path"], "rb") as f:
+                data = f.read()
+            fingerprint = {"sha256": sha256_hex(data), "phash": dhash(data)}
+            duplicate = _find_duplicate(payload, **fingerprint)
+        if duplicate is not None:
+            os.remove(payload["image_path"])
+            raise JobSkipped(
+                f"duplicate_of={duplicate['duplicate_of']} "
+                f"({duplicate['match']} match)",
+                duplicate,
+            )
+        job.checkpoint("fingerprint", fingerprint)
+
+    if "file_url" not in payload:
+        with job.stage("upload"):
+            with open(payload["image_path"], "rb") as f:
+                file_url = upload_image(f)
+            if not file_url:
+                raise RuntimeError("Failed to upload image")
+        job.checkpoint("file_url", file_url)
+
+    if "priscription_id" not in payload:
+        with job.stage("db_insert"):
+            db = SessionLocal()
+            try:
+                priscription = add_priscription(
+                    db=db,
+                    doctor_name=payload["doctor_name"],
+                    visit_date=payload["visit_date"],
+                    visit_time=payload["visit_time"],
+                    hospital_name=payload["hospital_name"],
+                    username=payload["username"],
+                    file_url=payload["file_url"],
+                )
+                priscription_id = priscription.id
+            finally:
+                db.close()
+        job.checkpoint("priscription_id", priscription_id)
+
+    if "extraction" not in payload:
+        with open(payload["image_path"], "rb") as f:
+            image_bytes = f.read()
+        job.checkpoint("extraction", extract_med_info(image_bytes, job.stage))
+
+    if "record" not in payload:
+        # Keyed by prescription, so a retry after a crash adds the section once
+        record = save_record_section(
+            payload["extraction"],
+            payload["username"],
+            job.stage,
+            section_id=f"priscription-{payload['priscription_id']}",
+        )
+        job.checkpoint("record", record)
+
+    if "notifications_saved" not in payload:
+        # A failed insert (e.g. a locked database) is retried from the extraction
+        save_extracted_notifications(
+            payload["extraction"], payload["username"], job.stage
+        )
+        job.checkpoint("notifications_saved", True)
+
+    with job.stage("fingerprint"):
+        try:
+            _save_fingerprint(payload)
+        except Exception as e:
+            # Only later copies of this image get processed again
+            print(f"Error saving upload fingerprint: {str(e)}")
+
+    if os.path.exists(payload["image_path"]):
+        os.remove(payload["image_path"])
+    return {
+        "file_url": payload["file_url"],
+        "id": payload["priscription_id"],
+        "record": payload["record"],
+    }
+
+
+job_queue.register(PRISCRIPTION_JOB, process_priscription)
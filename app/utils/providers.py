@@ -0,0 +1,113 @@
+"""
+Lazily constructed process-wide objects (LLM clients, embedding models, ...).
+
+Importing a module that declares a provider costs nothing; the object is
+built on first use, or ahead of traffic by warm_up(). Every provider is
+listed in the registry so /metrics can show what has been built and how
+long it took.
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Generic, Iterable, Optional, TypeVar
+
+from app.utils.metrics import register_stats
+
+T = TypeVar("T")
+
+_registry: Dict[str, "LazyProvider"] = {}
+_registry_lock = threading.Lock()
+
+
+class LazyProvider(Generic[T]):
+    """
+    Builds its value with `factory` the first time get() is called; later
+    calls return the same object. Concurrent first calls build it once.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], T], warm: bool = True):
+        self.name = name
+        # Whether warm_up() builds it by default
+        self.warm = warm
+        self._factory = factory
+        self._value: Optional[T] = None
+        self._initialized = False
+        self._lock = threading.Lock()
+        self.init_seconds: Optional[float] = None
+
+    @property
+    def initialized(self) -> bool:
+        return self._initialized
+
+    def get(self) -> T:
+        if self._initialized:
+            return self._value
+        with self._lock:
+            if not self._initialized:
+                start = time.perf_counter()
+                self._value = self._factory()
+                self.init_seconds = time.perf_counter() - start
+                self._initialized = True
+                print(
+                    f"[Providers] Initialized {self.name} in {self.init_seconds:.3f}s"
+                )
+        return self._value
+
+    def __getattr__(self, attr: str):
+        # Lets a provider stand in for the object it builds
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        return getattr(self.get(), attr)
+
+
+def lazy(name: str, factory: Callable[[], T], warm: bool = True) -> LazyProvider[T]:
+    """
+    Declare a provider and add it to the registry. Providers with
+    `warm=False` are only built on first use.
+    """
+    provider = LazyProvider(name, factory, warm=warm)
+    with _registry_lock:
+        _registry[name] = provider
+    return provider
+
+
+def registered() -> Dict[str, LazyProvider]:
+    """
+    All declared providers by name.
+    """
+    with _registry_lock:
+        return dict(_registry)
+
+
+def warm_up(names: Iterable[str] = None) -> Dict[str, Optional[float]]:
+    """
+    Build the given providers (default: every one declared with warm=True)
+    now instead of on first use. Returns the init time of each; failures are
+    logged, not raised, so a provider that cannot start yet is retried on
+    first use.
+    """
+    providers = registered()
+    timings = {}
+    if names is None:
+        names = [name for name, provider in providers.items() if provider.warm]
+    for name in names:
+        provider = providers.get(name)
+        if provider is None:
+            continue
+        try:
+            provider.get()
+        except Exception as e:
+            print(f"[Providers] Warm-up of {name} failed: {str(e)}")
+        timings[name] = provider.init_seconds
+    return timings
+
+
+def stats() -> dict:
+    providers = registered()
+    return {
+        name: {"initialized": p.initialized, "init_seconds": p.init_seconds}
+        for name, p in providers.items()
+    }
+
+
+register_stats("providers", stats)
@@ -0,0 +1,223 @@
+"""
+Per-patient semantic index over the sections of their medical record.
+
+Every section extract_med_info_save adds to a record is split into chunks,
+embedded and stored in a small vector index under static/<user>/record_index.
+Prompts then carry the latest section (the most recent visit) plus only the
+chunks of older sections most relevant to the question, so their size stays
+about the same however long the patient's history grows.
+"""
+
+import datetime
+import os
+import re
+import threading
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from app.settings import settings
+from app.utils.cache import TTLCache
+from app.utils.faiss_index_manager import FaissIndexManager
+from app.utils.faiss_utils import embedding_model, index_manager
+from app.utils.record_store import record_dir
+from app.utils.record_text import read_record_text
+
+RECORD_INDEX_DIR = "record_index"
+
+# Title extract_med_info_save gives every section it appends
+SECTION_TITLE_RE = re.compile(
+    r"^Extracted Medical Record \((\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\)\s*$",
+    re.MULTILINE,
+)
+SECTION_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_managers = TTLCache(maxsize=128)
+_managers_lock = threading.Lock()
+# Per-patient locks serializing writes to (and the first build of) an index
+_locks: Dict[str, threading.Lock] = {}
+
+
+def chunk_text(text: str, max_chars: int = 800) -> List[str]:
+    """
+    Split text into chunks of at most `max_chars`, on line boundaries where
+    possible.
+    """
+    chunks, current = [], ""
+    for line in text.splitlines():
+        while len(line) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:max_chars])
+            line = line[max_chars:]
+        if current and len(current) + len(line) + 1 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current.strip():
+        chunks.append(current)
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def split_sections(text: str) -> List[Tuple[str, Optional[datetime.datetime], str]]:
+    """
+    Split a whole record into (title, time, content) sections by their titles.
+    Text before the first title (or a record without titles) is one section.
+    """
+    matches = list(SECTION_TITLE_RE.finditer(text))
+    sections = []
+    if not matches or matches[0].start() > 0:
+        head = text[: matches[0].start()] if matches else text
+        if head.strip():
+            sections.append(("Medical Record", None, head.strip()))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        section_time = datetime.datetime.strptime(match.group(1), SECTION_TIME_FORMAT)
+        sections.append(
+            (match.group(0).strip(), section_time, text[match.end() : end].strip())
+        )
+    return sections
+
+
+def _lock_for(username: str) -> threading.Lock:
+    with _managers_lock:
+        return _locks.setdefault(username, threading.Lock())
+
+
+def _manager(username: str) -> FaissIndexManager:
+    with _managers_lock:
+        manager = _managers.get(username)
+        if manager is None:
+            manager = FaissIndexManager(
+                os.path.join(record_dir(username), RECORD_INDEX_DIR),
+                embedding_model,
+                auto_rebuild=False,
+                query_cache_size=0,
+                result_cache_size=0,
+            )
+            _managers.set(username, manager)
+        return manager
+
+
+def _add_sections(manager: FaissIndexManager, sections, save=True, section_id=None):
+    texts, metadatas = [], []
+    for position, (title, section_time, content) in enumerate(sections):
+        # A known id replaces the chunks indexed under it before
+        chunk_prefix = section_id or str(uuid.uuid4())
+        # Sections without a time keep their order, before any dated one
+        order = (
+            section_time.strftime(SECTION_TIME_FORMAT)
+            if section_time
+            else f"0000-{position:05d}"
+        )
+        for number, chunk in enumerate(
+            chunk_text(content, settings.RECORD_CHUNK_CHARS)
+        ):
+            texts.append(chunk)
+            metadatas.append(
+                {
+                    "post_id": f"{chunk_prefix}:{number}",
+                    "section_id": chunk_prefix,
+                    "title": title,
+                    "order": order,
+                    "chunk": number,
+                }
+            )
+    if texts:
+        manager.add_texts(texts, metadatas=metadatas, save=save)
+
+
+def _ensure_index(username: str) -> Optional[FaissIndexManager]:
+    """
+    The patient's record index, built from their whole record the first time.
+    """
+    manager = _manager(username)
+    if manager.get_index() is not None:
+        return manager
+    with _lock_for(username):
+        if manager.get_index() is not None:
+            return manager
+        text = read_record_text(username)
+        if not text:
+            return None
+        print(f"Indexing medical record of {username}...")
+        _add_sections(manager, split_sections(text))
+    return manager
+
+
+def index_record_section(
+    username: str,
+    title: str,
+    content: str,
+    section_time: datetime.datetime,
+    section_id: Optional[str] = None,
+):
+    """
+    Chunk, embed and store a section just appended to the patient's record.
+    Indexing a `section_id` again replaces its chunks.
+    """
+    manager = _manager(username)
+    if manager.get_index() is None:
+        # First section, or a record from before the index existed: the
+        # record text already holds this section, so index all of it
+        _ensure_index(username)
+        return
+    with _lock_for(username):
+        _add_sections(manager, [(title, section_time, content)], section_id=section_id)
+
+
+def _section_chunks(manager: FaissIndexManager) -> List[dict]:
+    """
+    Metadata (plus "text") of every live chunk in the index.
+    """
+    vector_index = manager.get_index()
+    if vector_index is None:
+        return []
+    chunks = []
+    for vid in vector_index.live_ids():
+        record = vector_index.records[vid]
+        chunks.append({**record["metadata"], "text": record["text"]})
+    return chunks
+
+
+def record_context(username: str, query: str, k: int = None) -> str:
+    """
+    The latest section of the patient's record plus the `k` chunks of
+    earlier sections most relevant to `query`, as prompt text.
+    """
+    k = settings.RECORD_TOP_CHUNKS if k is None else k
+    manager = _ensure_index(username)
+    if manager is None:
+        return ""
+    chunks = _section_chunks(manager)
+    if not chunks:
+        return ""
+    latest_order = max(chunk["order"] for chunk in chunks)
+    latest = sorted(
+        (chunk for chunk in chunks if chunk["order"] == latest_order),
+        key=lambda chunk: chunk["chunk"],
+    )
+    parts = [
+        f"Latest visit - {latest[0]['title']}:\n"
+        + "\n".join(chunk["text"] for chunk in latest)
+    ]
+    if k > 0 and len(chunks) > len(latest):
+        # Same cached query embedding the post retrieval uses
+        hits = manager.search_vector(
+            index_manager.embed_query(query), k=k + len(latest)
+        )
+        earlier = [
+            (metadata, text)
+            for text, metadata, _ in hits
+            if metadata.get("order") != latest_order
+        ][:k]
+        # Chronological order reads better than relevance order
+        earlier.sort(key=lambda hit: (hit[0]["order"], hit[0]["chunk"]))
+        if earlier:
+            parts.append(
+                "Relevant entries from earlier visits:\n"
+                + "\n".join(
+                    f"- ({metadata['title']}) {text}" for metadata, text in earlier
+                )
+            )
+    return "\n\n".join(parts)
@@ -0,0 +1,253 @@
+"""
+Append-only store of each patient's medical record sections, with the PDF
+rendered from it on demand.
+
+Every extracted section is appended as one JSON line to
+static/<user>/Medical_Record.sections.jsonl, so adding a section costs the
+same however long the record is, and concurrent uploads of one patient
+cannot corrupt it. The PDF is only built when someone asks for it, and is
+kept as Medical_Record.v<version>.pdf where the version is the size of the
+sections file: it changes with every append, so a cached PDF is reused
+until the record grows. Reads stop at the last complete line, so they
+never see a section that is still being appended. Superseded renders are
+deleted once they have not been served for RECORD_RENDER_GRACE_SECONDS,
+so a request still sending one is not cut off.
+
+A section may carry the id of what produced it (the prescription); adding
+a section with the id of the last one does nothing, so a retried upload
+job does not add its section twice.
+
+Records created before this store have a Medical_Record.pdf written by the
+old pipeline; it is left untouched and its pages come first in the
+rendered PDF.
+"""
+
+import datetime
+import glob
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import PyPDF2
+from fpdf import FPDF
+
+from app.settings import settings
+from app.utils.metrics import LatencyRecorder
+
+STATIC_DIR = "static"
+# Written by the pipeline before this store existed
+RECORD_PDF = "Medical_Record.pdf"
+SECTIONS_FILE = "Medical_Record.sections.jsonl"
+RENDERED_PREFIX = "Medical_Record.v"
+
+_locks: Dict[str, threading.Lock] = {}
+_render_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+_render_time = LatencyRecorder()
+_stats_lock = threading.Lock()
+_stats = {"appends": 0, "hits": 0, "renders": 0}
+
+
+def _lock_for(username: str, locks: Dict[str, threading.Lock] = _locks):
+    with _locks_guard:
+        return locks.setdefault(username, threading.Lock())
+
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+class PDFGenerator:
+    """Generates a structured PDF from text data."""
+
+    def __init__(self, output_path):
+        self.pdf = FPDF()
+        self.pdf.add_page()
+        self.pdf.set_font("Arial", size=12)
+        self.output_path = output_path
+
+    def add_section(self, title, content):
+        """Adds a section to the PDF with a title and content."""
+        self.pdf.set_font("Arial", "B", 14)
+        self.pdf.cell(200, 10, title, ln=True, align="L")
+        self.pdf.ln(4)
+        self.pdf.set_font("Arial", size=12)
+        self.pdf.multi_cell(0, 10, content)
+        self.pdf.ln(5)
+
+    def save_pdf(self):
+        """Saves the PDF to the specified path."""
+        self.pdf.output(self.output_path)
+        print(f"PDF saved to {self.output_path}")
+
+
+def record_dir(username: str) -> str:
+    return os.path.join(STATIC_DIR, username)
+
+
+def _sections_path(username: str) -> str:
+    return os.path.join(record_dir(username), SECTIONS_FILE)
+
+
+def _last_section(username: str) -> Optional[dict]:
+    """
+    The patient's last complete section, reading only the end of the file.
+    """
+    try:
+        f = open(_sections_path(username), "rb")
+    except OSError:
+        return None
+    with f:
+        end = f.seek(0, os.SEEK_END)
+        size = 4096
+        while True:
+            start = max(0, end - size)
+            f.seek(start)
+            data = f.read(end - start)
+            lines = data[: data.rfind(b"\n") + 1].splitlines()
+            # Unless it starts the file, the first line read may be partial
+            if start == 0 or len(lines) > 1:
+                return json.loads(lines[-1]) if lines else None
+            size *= 2
+
+
+def append_section(
+    username: str,
+    title: str,
+    content: str,
+    created_at: datetime.datetime = None,
+    section_id: Optional[str] = None,
+) -> bool:
+    """
+    Add a section to the patient's record. Returns False, adding nothing, if
+    the last section already has this `section_id`.
+    """
+    created_at = created_at or datetime.datetime.now()
+    section = {"title": title, "content": content, "created_at": created_at.isoformat()}
+    if section_id is not None:
+        section["section_id"] = section_id
+    with _lock_for(username):
+        if section_id is not None:
+            last = _last_section(username)
+            if last is not None and last.get("section_id") == section_id:
+                return False
+        os.makedirs(record_dir(username), exist_ok=True)
+        with open(_sections_path(username), "a", encoding="utf-8") as f:
+            f.write(json.dumps(section) + "\n")
+    _count("appends")
+    return True
+
+
+def sections_version(username: str) -> int:
+    """
+    Size of the patient's sections file; 0 if there are none.
+    """
+    try:
+        return os.path.getsize(_sections_path(username))
+    except OSError:
+        return 0
+
+
+def read_sections(username: str, version: Optional[int] = None) -> List[dict]:
+    """
+    The patient's sections in the order they were added, as of `version`
+    (all of them by default).
+    """
+    try:
+        with open(_sections_path(username), "rb") as f:
+            data = f.read() if version is None else f.read(version)
+    except OSError:
+        return []
+    # A concurrent append may have written only part of its line so far
+    data = data[: data.rfind(b"\n") + 1]
+    return [json.loads(line) for line in data.decode("utf-8").splitlines() if line]
+
+
+def _render(username: str, version: int, path: str):
+    started = time.perf_counter()
+    tmp_path = path + ".tmp"
+    pdf_gen = PDFGenerator(tmp_path)
+    for section in read_sections(username, version):
+        pdf_gen.add_section(section["title"], section["content"])
+    pdf_gen.save_pdf()
+
+    legacy_path = os.path.join(record_dir(username), RECORD_PDF)
+    if os.path.exists(legacy_path):
+        merger = PyPDF2.PdfMerger()
+        merger.append(legacy_path)
+        merger.append(tmp_path)
+        merged_path = tmp_path + ".merged"
+        merger.write(merged_path)
+        merger.close()
+        os.replace(merged_path, tmp_path)
+    os.replace(tmp_path, path)
+
+    _remove_stale_renders(username, path)
+    _count("renders")
+    _render_time.record(time.perf_counter() - started)
+    print(f"[Record] Rendered record of {username} at version {version}")
+
+
+def _remove_stale_renders(username: str, current_path: str):
+    """
+    Delete older renders that have not been served for the grace period;
+    record_pdf() touches a render each time it hands it out.
+    """
+    cutoff = time.time() - settings.RECORD_RENDER_GRACE_SECONDS
+    for old_path in glob.glob(
+        os.path.join(record_dir(username), RENDERED_PREFIX + "*.pdf")
+    ):
+        if old_path == current_path:
+            continue
+        try:
+            if os.path.getmtime(old_path) < cutoff:
+                os.remove(old_path)
+        except OSError:
+            pass
+
+
+def _reuse(path: str) -> bool:
+    """
+    Whether the render exists, marking it as in use if so; see
+    _remove_stale_renders().
+    """
+    try:
+        os.utime(path)
+    except OSError:
+        return False
+    _count("hits")
+    return True
+
+
+def record_pdf(username: str) -> Optional[str]:
+    """
+    Path of the patient's record as a PDF, rendering it if the record
+    changed since the last render. None if the patient has no record.
+    """
+    version = sections_version(username)
+    legacy_path = os.path.join(record_dir(username), RECORD_PDF)
+    if not version:
+        return legacy_path if os.path.exists(legacy_path) else None
+
+    path = os.path.join(record_dir(username), f"{RENDERED_PREFIX}{version}.pdf")
+    if _reuse(path):
+        return path
+    # Appends only take the other lock, so they never wait for a render
+    with _lock_for(username, _render_locks):
+        # Render the latest version, so a newer render is never replaced by
+        # an older one; a concurrent request may have rendered it already
+        version = sections_version(username)
+        path = os.path.join(record_dir(username), f"{RENDERED_PREFIX}{version}.pdf")
+        if _reuse(path):
+            return path
+        _render(username, version, path)
+    return path
+
+
+def stats() -> dict:
+    with _stats_lock:
+        counts = dict(_stats)
+    return {**counts, "render_time": _render_time.stats()}
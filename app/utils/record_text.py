@@ -0,0 +1,93 @@
+"""
+Plain-text view of each patient's medical record, for chat and the record
+index.
+
+The record's sections (see record_store) are the only place sections are
+written; the text is derived from them. Records made before the sections
+store existed start with the text of their old Medical_Record.pdf, which is
+extracted once into Medical_Record.legacy.txt. The joined text is cached in
+memory per record version, so an unchanged record is never read twice.
+"""
+
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from app.utils.cache import TTLCache
+from app.utils.pdf_utils import extract_text_from_pdf
+from app.utils.record_store import (
+    RECORD_PDF,
+    read_sections,
+    record_dir,
+    sections_version,
+)
+
+LEGACY_TEXT = "Medical_Record.legacy.txt"
+
+_cache = TTLCache(maxsize=256)
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def _lock_for(username: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(username, threading.Lock())
+
+
+def _legacy_pdf_size(username: str) -> int:
+    try:
+        return os.path.getsize(os.path.join(record_dir(username), RECORD_PDF))
+    except OSError:
+        return 0
+
+
+def record_version(username: str) -> Optional[Tuple[int, int]]:
+    """
+    (size of the old PDF, size of the sections file) of the patient's
+    record, or None if there is none.
+    """
+    version = (_legacy_pdf_size(username), sections_version(username))
+    return version if any(version) else None
+
+
+def _legacy_text(username: str) -> str:
+    """
+    Text of the record's old PDF, extracted the first time it is needed.
+    """
+    path = os.path.join(record_dir(username), LEGACY_TEXT)
+    with _lock_for(username):
+        if not os.path.exists(path):
+            text = extract_text_from_pdf(os.path.join(record_dir(username), RECORD_PDF))
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+            print(f"Built record text for {username} from {RECORD_PDF}")
+            return text
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def read_record_text(username: str) -> str:
+    """
+    The patient's medical record as text, or "" if there is none.
+    """
+    version = record_version(username)
+    if version is None:
+        return ""
+    cached = _cache.get(username)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    legacy_size, sections_size = version
+    parts = [_legacy_text(username)] if legacy_size else []
+    parts += [
+        f"{section['title']}\n{section['content']}\n\n"
+        for section in read_sections(username, sections_size)
+    ]
+    text = "".join(parts)
+    _cache.set(username, (version, text))
+    return text
+
+
+def cache_stats() -> dict:
+    return _cache.stats()
@@ -0,0 +1,194 @@
+"""
+Benchmark of the dose reminder wheel over synthetic medication schedules.
+
+    python -m app.utils.reminder_benchmark --schedules 1000000
+    python -m app.utils.reminder_benchmark --days 7 --tick-minutes 1
+
+Builds a DoseWheel from --schedules random schedules of --patients patients
+(no database involved), then simulates --days days of ticks every
+--tick-minutes minutes. It reports the build time and memory, the latency
+of every tick and of the ticks that had doses due, and, for comparison, how
+long a tick takes that scans every schedule instead.
+"""
+
+import argparse
+import datetime
+import random
+import resource
+import time
+
+from app.utils.metrics import LatencyRecorder
+from app.utils.reminders import SLOTS, Dose, DoseWheel, Schedule, parse_slots
+
+DEFAULT_SLOTS = "morning=08:00,afternoon=13:00,evening=18:00,night=21:00"
+
+MEDICINES = (
+    "Paracetamol",
+    "Amoxicillin",
+    "Metformin",
+    "Amlodipine",
+    "Atorvastatin",
+    "Omeprazole",
+    "Cetirizine",
+    "Ibuprofen",
+)
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def synthetic_schedules(n: int, patients: int, today: datetime.date, seed: int):
+    """
+    `n` schedules started in the last 30 days, lasting 3 to 30 days, one in
+    ten taken indefinitely, with one to three doses a day. Every schedule
+    is a different medicine, so none replaces another in the wheel.
+    """
+    rng = random.Random(seed)
+    usernames = [f"patient-{i}" for i in range(patients)]
+    for i in range(n):
+        start = today - datetime.timedelta(days=rng.randint(0, 30))
+        end = (
+            None
+            if rng.random() < 0.1
+            else start + datetime.timedelta(days=rng.randint(3, 30) - 1)
+        )
+        yield Schedule(
+            medication_id=i,
+            username=usernames[rng.randrange(patients)],
+            name=f"{rng.choice(MEDICINES)} {i}",
+            dosage="500mg",
+            instructions=None,
+            slots=tuple(rng.sample(SLOTS, rng.randint(1, 3))),
+            start_date=start,
+            end_date=end,
+            created_at=datetime.datetime.combine(start, datetime.time()),
+        )
+
+
+def scan_due(schedules, slots, moment: datetime.datetime) -> list:
+    """
+    Doses due at `moment` found by checking every schedule.
+    """
+    minute = moment.hour * 60 + moment.minute
+    day = moment.date()
+    due = []
+    for schedule in schedules:
+        if schedule.start_date > day:
+            continue
+        if schedule.end_date is not None and schedule.end_date < day:
+            continue
+        for slot in schedule.slots:
+            if slots.get(slot) == minute:
+                due.append(Dose(schedule, slot, moment))
+    return due
+
+
+def run(args) -> dict:
+    slots = parse_slots(args.slots)
+    today = datetime.date.today()
+
+    rss_before = max_rss_mb()
+    started = time.perf_counter()
+    schedules = list(
+        synthetic_schedules(args.schedules, args.patients, today, args.seed)
+    )
+    wheel = DoseWheel(slots)
+    for schedule in schedules:
+        wheel.add(schedule)
+    build_seconds = time.perf_counter() - started
+    print(
+        f"Built wheel of {len(wheel)} schedules in {build_seconds:.1f}s "
+        f"(max RSS +{max_rss_mb() - rss_before:.0f} MB)"
+    )
+
+    ticks = int(args.days * 24 * 60 / args.tick_minutes)
+    all_ticks = LatencyRecorder(window=ticks)
+    due_ticks = LatencyRecorder(window=ticks)
+    step = datetime.timedelta(minutes=args.tick_minutes)
+    now = datetime.datetime.combine(today, datetime.time())
+    total_due, max_due = 0, 0
+    for _ in range(ticks):
+        tick_started = time.perf_counter()
+        due = wheel.due(now, now + step)
+        seconds = time.perf_counter() - tick_started
+        now += step
+        all_ticks.record(seconds)
+        if due:
+            due_ticks.record(seconds)
+        total_due += len(due)
+        max_due = max(max_due, len(due))
+
+    # Scanning every schedule costs the same whether or not anything is due
+    scan = LatencyRecorder(window=args.scan_ticks)
+    moment = datetime.datetime.combine(today, datetime.time()) + datetime.timedelta(
+        minutes=min(slots.values())
+    )
+    for _ in range(args.scan_ticks):
+        scan_started = time.perf_counter()
+        scan_due(schedules, slots, moment)
+        scan.record(time.perf_counter() - scan_started)
+
+    return {
+        "schedules": args.schedules,
+        "build_seconds": build_seconds,
+        "ticks": ticks,
+        "days": args.days,
+        "doses": total_due,
+        "max_due": max_due,
+        "dropped": wheel.dropped,
+        "tick": all_ticks.stats(),
+        "due_tick": due_ticks.stats(),
+        "scan_tick": scan.stats(),
+    }
+
+
+def print_results(result: dict):
+    print(
+        f"{result['ticks']} ticks, {result['doses']} doses due "
+        f"(at most {result['max_due']} in one tick), "
+        f"{result['dropped']} ended schedules dropped"
+    )
+    # A scanning scheduler pays the scan on every tick
+    scan_total = result["scan_tick"]["mean_ms"] * result["ticks"] / 1000.0
+    wheel_total = result["tick"]["mean_ms"] * result["ticks"] / 1000.0
+    print(
+        f"Tick time over {result['days']:g} days: wheel {wheel_total:.1f}s, "
+        f"full scan {scan_total:.1f}s (estimated)"
+    )
+    print(f"{'':<22} {'count':>7} {'p50_ms':>9} {'p99_ms':>9} {'mean_ms':>9}")
+    for label, key in (
+        ("wheel, every tick", "tick"),
+        ("wheel, ticks with due", "due_tick"),
+        ("full scan per tick", "scan_tick"),
+    ):
+        stats = result[key]
+        if not stats.get("count"):
+            continue
+        print(
+            f"{label:<22} {stats['count']:>7} {stats['p50_ms']:>9.2f} "
+            f"{stats['p99_ms']:>9.2f} {stats['mean_ms']:>9.2f}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--schedules", type=int, default=1_000_000)
+    parser.add_argument("--patients", type=int, default=200_000)
+    parser.add_argument("--days", type=float, default=2.0)
+    parser.add_argument("--tick-minutes", type=int, default=1)
+    parser.add_argument(
+        "--scan-ticks",
+        type=int,
+        default=5,
+        help="Ticks timed with a full scan of every schedule, for comparison",
+    )
+    parser.add_argument("--slots", default=DEFAULT_SLOTS)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    print_results(run(args))
+
+
+if __name__ == "__main__":
+    main()
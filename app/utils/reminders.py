@@ -0,0 +1,332 @@
+"""
+Due-dose reminders for every patient's active medications.
+
+Each medication's morning/afternoon/evening/night flags become daily dose
+times (REMINDER_SLOTS), compiled into a timing wheel with one bucket per
+minute of the day. A tick only visits the buckets of the minutes that
+passed since the previous tick, so its cost is the number of doses due,
+not the number of patients. Medications that ended are dropped from their
+buckets the first time they come up after their last day. Like
+active_medications(), a medicine prescribed to a patient more than once
+only has the schedule of its latest prescription.
+
+Due doses go to the subscribed callbacks and to a small per-patient outbox
+that GET /priscription/reminders/{username} reads. The wheel lives in the
+process: with several server processes each one delivers every reminder.
+"""
+
+import datetime
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from app.settings import settings
+from app.utils.metrics import LatencyRecorder, register_stats
+
+MINUTES_PER_DAY = 24 * 60
+SLOTS = ("morning", "afternoon", "evening", "night")
+
+
+def parse_slots(spec: str) -> Dict[str, int]:
+    """
+    {"morning": 480, ...} (minute of the day) from "morning=08:00,...".
+    """
+    slots = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, _, clock = item.partition("=")
+        hours, _, minutes = clock.strip().partition(":")
+        minute = int(hours) * 60 + int(minutes or 0)
+        if name.strip() not in SLOTS or not 0 <= minute < MINUTES_PER_DAY:
+            raise ValueError(f"Invalid reminder slot {item!r}")
+        slots[name.strip()] = minute
+    return slots
+
+
+@dataclass(slots=True)
+class Schedule:
+    """A medication's daily doses, from start_date to end_date (inclusive)."""
+
+    medication_id: int
+    username: str
+    name: str
+    dosage: Optional[str]
+    instructions: Optional[str]
+    slots: tuple
+    start_date: datetime.date
+    end_date: Optional[datetime.date]
+    created_at: Optional[datetime.datetime] = None
+    removed: bool = False
+
+    @property
+    def key(self) -> tuple:
+        # One schedule per medicine of a patient
+        return self.username, self.name.lower()
+
+    @property
+    def order(self) -> tuple:
+        # Which of two prescriptions of a medicine is the latest
+        return self.created_at or datetime.datetime.min, self.medication_id
+
+    @classmethod
+    def from_medication(cls, medication) -> "Schedule":
+        return cls(
+            medication_id=medication.id,
+            username=medication.username,
+            name=medication.name,
+            dosage=medication.dosage,
+            instructions=medication.instructions,
+            slots=tuple(slot for slot in SLOTS if getattr(medication, slot)),
+            start_date=medication.start_date,
+            end_date=medication.end_date,
+            created_at=medication.created_at,
+        )
+
+
+class Dose(NamedTuple):
+    # A tuple: a busy slot minute makes hundreds of thousands of these
+    schedule: Schedule
+    slot: str
+    due_at: datetime.datetime
+
+    def to_dict(self) -> dict:
+        return {
+            "medication_id": self.schedule.medication_id,
+            "username": self.schedule.username,
+            "name": self.schedule.name,
+            "dosage": self.schedule.dosage,
+            "instructions": self.schedule.instructions,
+            "slot": self.slot,
+            "due_at": self.due_at.isoformat(),
+        }
+
+
+class DoseWheel:
+    """
+    Timing wheel of daily dose times with one bucket per minute of the day.
+    """
+
+    def __init__(self, slots: Dict[str, int]):
+        self.slots = slots
+        self._buckets: List[List[Schedule]] = [[] for _ in range(MINUTES_PER_DAY)]
+        self._slot_at: Dict[int, str] = {}
+        for name, minute in slots.items():
+            self._slot_at.setdefault(minute, name)
+        # Schedule.key -> the latest schedule of that medicine
+        self._schedules: Dict[tuple, Schedule] = {}
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._schedules)
+
+    def add(self, schedule: Schedule):
+        """
+        Schedule a medication's doses, replacing the schedule of an earlier
+        prescription of the same medicine. A schedule older than the one in
+        place is ignored.
+        """
+        minutes = {self.slots[slot] for slot in schedule.slots if slot in self.slots}
+        with self._lock:
+            previous = self._schedules.get(schedule.key)
+            if previous is not None:
+                if previous.order > schedule.order:
+                    return
+                previous.removed = True
+            # Kept even without dose times, so it still replaces older ones
+            self._schedules[schedule.key] = schedule
+            for minute in minutes:
+                self._buckets[minute].append(schedule)
+
+    def remove(self, username: str, name: str):
+        """
+        Stop a medicine's reminders; its bucket entries go on their next pass.
+        """
+        with self._lock:
+            schedule = self._schedules.pop((username, name.lower()), None)
+            if schedule is not None:
+                schedule.removed = True
+
+    def _fire(self, minute: int, day: datetime.date, due: List[Dose]):
+        bucket = self._buckets[minute]
+        if not bucket:
+            return
+        due_at = datetime.datetime.combine(
+            day, datetime.time(minute // 60, minute % 60)
+        )
+        slot = self._slot_at.get(minute, "")
+        kept = []
+        for schedule in bucket:
+            if schedule.removed:
+                continue
+            if schedule.end_date is not None and schedule.end_date < day:
+                # Past its last day: never due again
+                if self._schedules.get(schedule.key) is schedule:
+                    del self._schedules[schedule.key]
+                    self.dropped += 1
+                continue
+            kept.append(schedule)
+            if schedule.start_date <= day:
+                due.append(Dose(schedule, slot, due_at))
+        self._buckets[minute] = kept
+
+    def due(self, after: datetime.datetime, until: datetime.datetime) -> List[Dose]:
+        """
+        Doses due in the minutes (after, until]; at most one day is covered.
+        """
+        after = after.replace(second=0, microsecond=0)
+        until = until.replace(second=0, microsecond=0)
+        if until - after > datetime.timedelta(days=1):
+            after = until - datetime.timedelta(days=1)
+        due: List[Dose] = []
+        with self._lock:
+            moment = after + datetime.timedelta(minutes=1)
+            while moment <= until:
+                # Jump straight to the next minute with a bucket: only the
+                # few slot minutes ever hold schedules
+                minute = moment.hour * 60 + moment.minute
+                self._fire(minute, moment.date(), due)
+                moment = self._next_slot(moment)
+        return due
+
+    def _next_slot(self, moment: datetime.datetime) -> datetime.datetime:
+        minute = moment.hour * 60 + moment.minute
+        later = [m for m in self._slot_at if m > minute]
+        if later:
+            return moment + datetime.timedelta(minutes=min(later) - minute)
+        first = min(self._slot_at, default=0)
+        return moment + datetime.timedelta(minutes=MINUTES_PER_DAY - minute + first)
+
+
+class ReminderScheduler:
+    """
+    Loads the active medications into a DoseWheel and, every tick, delivers
+    the doses that became due to the subscribers and patient outboxes.
+    """
+
+    def __init__(
+        self,
+        slots: Dict[str, int],
+        tick_seconds: float = 30.0,
+        outbox_size: int = 50,
+    ):
+        self.wheel = DoseWheel(slots)
+        self.tick_seconds = tick_seconds
+        self.outbox_size = outbox_size
+        self._outboxes: Dict[str, deque] = {}
+        self._subscribers: List[Callable[[List[Dose]], None]] = []
+        self._last_tick: Optional[datetime.datetime] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._tick_time = LatencyRecorder()
+        self._delivered = 0
+
+    def subscribe(self, callback: Callable[[List[Dose]], None]):
+        """
+        Call `callback(doses)` with the doses that became due at each tick.
+        """
+        self._subscribers.append(callback)
+
+    def add_medications(self, medications: Iterable):
+        for medication in medications:
+            self.wheel.add(Schedule.from_medication(medication))
+
+    def load(self):
+        """
+        Schedule every medication that is active today or starts later.
+        """
+        from app.db.base import SessionLocal
+        from app.db.medication import schedulable_medications
+
+        db = SessionLocal()
+        try:
+            self.add_medications(schedulable_medications(db))
+        finally:
+            db.close()
+        print(f"[Reminders] Scheduled {len(self.wheel)} medications")
+
+    def tick(self, now: datetime.datetime = None) -> List[Dose]:
+        """
+        Deliver the doses due since the previous tick.
+        """
+        now = now or datetime.datetime.now()
+        started = time.perf_counter()
+        with self._lock:
+            last, self._last_tick = self._last_tick or now, now
+        doses = self.wheel.due(last, now)
+        if doses:
+            with self._lock:
+                for dose in doses:
+                    outbox = self._outboxes.get(dose.schedule.username)
+                    if outbox is None:
+                        outbox = deque(maxlen=self.outbox_size)
+                        self._outboxes[dose.schedule.username] = outbox
+                    outbox.append(dose)
+                self._delivered += len(doses)
+            for callback in self._subscribers:
+                try:
+                    callback(doses)
+                except Exception as e:
+                    print(f"[Reminders] Subscriber failed: {str(e)}")
+        self._tick_time.record(time.perf_counter() - started)
+        return doses
+
+    def reminders(self, username: str, since: datetime.datetime = None) -> List[dict]:
+        """
+        The patient's latest due doses, only those due after `since` if given.
+        """
+        with self._lock:
+            doses = list(self._outboxes.get(username, ()))
+        return [
+            dose.to_dict() for dose in doses if since is None or dose.due_at > since
+        ]
+
+    def _run(self):
+        try:
+            self.load()
+        except Exception as e:
+            print(f"[Reminders] Failed to load medications: {str(e)}")
+        self.tick()
+        while not self._stopping.wait(self.tick_seconds):
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"[Reminders] Tick failed: {str(e)}")
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="dose-reminders", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            delivered, patients = self._delivered, len(self._outboxes)
+        return {
+            "schedules": len(self.wheel),
+            "dropped": self.wheel.dropped,
+            "delivered": delivered,
+            "patients_with_reminders": patients,
+            "tick": self._tick_time.stats(),
+        }
+
+
+reminder_scheduler = ReminderScheduler(
+    parse_slots(settings.REMINDER_SLOTS),
+    tick_seconds=settings.REMINDER_TICK_SECONDS,
+    outbox_size=settings.REMINDER_OUTBOX_SIZE,
+)
+register_stats("reminders", reminder_scheduler.stats)
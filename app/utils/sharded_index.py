@@ -0,0 +1,742 @@
+"""
+Post vector index partitioned into monthly shards by created_time.
+
+Each shard is a directory named YYYY-MM under the shard root, managed by
+its own FaissIndexManager. Writes only ever go to the current (hot) month,
+so a save rewrites just that shard. Shards of past months are sealed: they
+receive no new vectors and are memory-mapped on load, so the OS pages them
+in on demand instead of copying them into the heap. Posts created in an
+earlier month (re-indexed or backfilled late) are written to the hot shard
+too; late_posts.json records which months each shard holds late posts of,
+so time-filtered searches still visit it, and compact() moves them into
+their own month's shard. Removals go only to the shard holding each post;
+removals from a sealed shard are kept in sealed_deletes.json and filtered
+out of its results until compact() rewrites it without them. Processes
+update both files under a lock, merging their changes into what is on
+disk.
+
+A search embeds the query once, fans out to the shards on a thread pool
+and merges their top-k by distance. Shards entirely outside a filter's
+time window are skipped without being searched.
+"""
+
+import contextlib
+import datetime
+import fcntl
+import heapq
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import faiss
+
+from app.utils.cache import TTLCache, normalize_text
+from app.utils.embeddings import embed_queries
+from app.utils.faiss_index_manager import FaissIndexManager
+from app.utils.vector_store import PostVectorIndex, SearchFilter
+
+SHARD_KEY_FORMAT = "%Y-%m"
+SHARD_KEY_RE = re.compile(r"^\d{4}-\d{2}$")
+SEALED_DELETES_FILE = "sealed_deletes.json"
+LATE_POSTS_FILE = "late_posts.json"
+# Held while reading, changing and writing a journal file
+JOURNAL_LOCK_FILE = "JOURNAL.lock"
+
+
+def shard_key(created_time=None) -> str:
+    """
+    Return the shard (month) a post belongs to. Posts without a usable
+    creation time go to the current month.
+    """
+    if isinstance(created_time, str):
+        try:
+            created_time = datetime.datetime.fromisoformat(created_time)
+        except ValueError:
+            created_time = None
+    if created_time is None:
+        created_time = datetime.datetime.now()
+    return created_time.strftime(SHARD_KEY_FORMAT)
+
+
+def record_shard_key(record: dict) -> str:
+    """
+    Return the shard (month) an index record belongs to.
+    """
+    return shard_key((record["metadata"] or {}).get("created_time"))
+
+
+def shard_bounds(key: str) -> Tuple[datetime.datetime, datetime.datetime]:
+    """
+    Return the [start, end) time range covered by a shard.
+    """
+    start = datetime.datetime.strptime(key, SHARD_KEY_FORMAT)
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return start, end
+
+
+class _ShardJournal:
+    """
+    Shard key -> set of post ids or months, kept in a JSON file of the
+    shard root.
+    Updates take a file lock and apply to what is on disk, so concurrent
+    processes never overwrite each other's entries.
+    """
+
+    def __init__(self, root_path: str, name: str):
+        self.root_path = root_path
+        self.name = name
+        self.entries: Dict[str, Set[str]] = {}
+        self._mtime: Optional[float] = None
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.root_path, self.name)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        os.makedirs(self.root_path, exist_ok=True)
+        with open(os.path.join(self.root_path, JOURNAL_LOCK_FILE), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read(self) -> Tuple[Dict[str, Set[str]], Optional[float]]:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return {}, None
+        with open(self.path, "r") as f:
+            return {key: set(ids) for key, ids in json.load(f).items()}, mtime
+
+    def refresh(self) -> bool:
+        """
+        Pick up changes written by other processes. Returns whether the
+        entries changed.
+        """
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+        try:
+            entries, mtime = self._read()
+        except (OSError, ValueError) as e:
+            print(f"[FAISS] Failed to read {self.name}: {str(e)}")
+            return False
+        changed = entries != self.entries
+        self.entries, self._mtime = entries, mtime
+        return changed
+
+    def update(self, change: Callable[[Dict[str, Set[str]]], None]):
+        """
+        Apply `change` to the entries on disk and write them back.
+        """
+        with self._locked():
+            try:
+                entries, _ = self._read()
+            except (OSError, ValueError) as e:
+                print(f"[FAISS] Failed to read {self.name}: {str(e)}")
+                entries = {key: set(ids) for key, ids in self.entries.items()}
+            change(entries)
+            entries = {key: ids for key, ids in entries.items() if ids}
+            fd, tmp_path = tempfile.mkstemp(dir=self.root_path)
+            with os.fdopen(fd, "w") as f:
+                json.dump({key: sorted(ids) for key, ids in entries.items()}, f)
+            os.replace(tmp_path, self.path)
+            self.entries, self._mtime = entries, os.path.getmtime(self.path)
+
+
+class ShardedIndexManager:
+    """
+    Drop-in replacement for FaissIndexManager holding one index per month.
+    """
+
+    def __init__(
+        self,
+        root_path: str,
+        embedding,
+        legacy_index_path: Optional[str] = None,
+        search_workers: int = 4,
+        mmap_sealed: bool = True,
+        reload_check_interval: float = 1.0,
+        compaction_ratio: float = 0.2,
+        compaction_min_dead: int = 100,
+        retrain_growth: float = 4.0,
+        auto_rebuild: bool = True,
+        query_cache_size: int = 1024,
+        query_cache_ttl: Optional[float] = 3600.0,
+        result_cache_size: int = 1024,
+        result_cache_ttl: Optional[float] = 300.0,
+    ):
+        self.root_path = root_path
+        self.embedding = embedding
+        # Single-index layout migrated into shards on first use
+        self.legacy_index_path = legacy_index_path
+        self.mmap_sealed = mmap_sealed
+        self.reload_check_interval = reload_check_interval
+        self.shard_options = {
+            "reload_check_interval": reload_check_interval,
+            "compaction_ratio": compaction_ratio,
+            "compaction_min_dead": compaction_min_dead,
+            "retrain_growth": retrain_growth,
+            "auto_rebuild": auto_rebuild,
+            # Caching happens once here, not per shard
+            "query_cache_size": 0,
+            "result_cache_size": 0,
+        }
+        self.query_embedding_cache = TTLCache(query_cache_size, query_cache_ttl)
+        self.result_cache = TTLCache(result_cache_size, result_cache_ttl)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, search_workers), thread_name_prefix="faiss-shard"
+        )
+        self._shards: Dict[str, FaissIndexManager] = {}
+        # Shards seen on disk; only those can be dropped when they disappear
+        self._persisted: Set[str] = set()
+        self._shards_lock = threading.Lock()
+        # Only ever increases: bumped when shards are added, dropped or
+        # reopened and whenever a shard's own generation moves
+        self._generation = 0
+        self._shard_generations: Dict[str, int] = {}
+        self._last_scan: Optional[float] = None
+        # Shard key -> post_ids removed from that sealed shard but still in
+        # its files
+        self._sealed_deletes = _ShardJournal(root_path, SEALED_DELETES_FILE)
+        # Shard key -> months of the posts created before it that it holds
+        self._late_posts = _ShardJournal(root_path, LATE_POSTS_FILE)
+        self._migrated = False
+        self._searches = 0
+        self._shards_searched = 0
+        self._shards_skipped = 0
+
+    @property
+    def generation(self) -> int:
+        """
+        Increases whenever any shard changes, so it can key the result cache.
+        """
+        with self._shards_lock:
+            # Shards also change on their own (reloads, automatic rebuilds)
+            current = {key: shard.generation for key, shard in self._shards.items()}
+            if current != self._shard_generations:
+                self._shard_generations = current
+                self._generation += 1
+            return self._generation
+
+    def _bump(self):
+        with self._shards_lock:
+            self._generation += 1
+
+    @property
+    def dirty(self) -> bool:
+        with self._shards_lock:
+            return any(shard.dirty for shard in self._shards.values())
+
+    def _open_shard(self, key: str) -> FaissIndexManager:
+        sealed = key < shard_key()
+        return FaissIndexManager(
+            os.path.join(self.root_path, key),
+            self.embedding,
+            io_flags=faiss.IO_FLAG_MMAP if sealed and self.mmap_sealed else 0,
+            **self.shard_options,
+        )
+
+    def _reseal(self, key: str):
+        # Reopen a rewritten sealed shard memory-mapped from its new files
+        with self._shards_lock:
+            if key in self._shards and key < shard_key() and self.mmap_sealed:
+                self._shards[key] = self._open_shard(key)
+                self._generation += 1
+
+    def _shard(self, key: str) -> FaissIndexManager:
+        with self._shards_lock:
+            shard = self._shards.get(key)
+            if shard is None:
+                shard = self._shards[key] = self._open_shard(key)
+                self._generation += 1
+            return shard
+
+    def _refresh_shards(self, force: bool = False):
+        """
+        Pick up shards written by other processes, drop deleted ones and
+        reopen shards of months that have become sealed as memory-mapped.
+        """
+        now = time.monotonic()
+        if (
+            not force
+            and self._last_scan is not None
+            and now - self._last_scan < self.reload_check_interval
+        ):
+            return
+        self._last_scan = now
+        if not self._migrated:
+            self._migrated = True
+            self._migrate_legacy_index()
+        try:
+            on_disk = {
+                name
+                for name in os.listdir(self.root_path)
+                if SHARD_KEY_RE.match(name)
+                and os.path.isdir(os.path.join(self.root_path, name))
+            }
+        except FileNotFoundError:
+            on_disk = set()
+        hot = shard_key()
+        with self._shards_lock:
+            for key in on_disk - set(self._shards):
+                self._shards[key] = self._open_shard(key)
+                self._generation += 1
+            for key, shard in list(self._shards.items()):
+                if shard.dirty:
+                    continue
+                if key not in on_disk:
+                    if key in self._persisted:
+                        del self._shards[key]
+                        self._persisted.discard(key)
+                        self._generation += 1
+                elif key < hot and self.mmap_sealed and not shard.io_flags:
+                    # The month rolled over: this shard is sealed now
+                    self._shards[key] = self._open_shard(key)
+                    self._generation += 1
+            self._persisted |= on_disk
+
+    def _refresh_journals(self):
+        # A stat per call: removals by other processes show up right away
+        with self._shards_lock:
+            for journal in (self._sealed_deletes, self._late_posts):
+                if journal.refresh():
+                    self._generation += 1
+
+    def _update_journal(self, journal: _ShardJournal, change):
+        with self._shards_lock:
+            journal.update(change)
+            self._generation += 1
+
+    def _migrate_legacy_index(self):
+        if not self.legacy_index_path or os.path.isdir(self.root_path):
+            return
+        vector_index = PostVectorIndex.load(self.legacy_index_path)
+        if vector_index is None or not vector_index.live_count:
+            return
+        print(
+            f"[FAISS] Splitting {vector_index.live_count} vectors from "
+            f"{self.legacy_index_path} into monthly shards"
+        )
+        self.replace(vector_index, rebuild=True)
+
+    def _loaded_shards(self) -> List[Tuple[str, FaissIndexManager]]:
+        self._refresh_shards()
+        self._refresh_journals()
+        with self._shards_lock:
+            return sorted(self._shards.items())
+
+    def get_index(self) -> Optional[Dict[str, PostVectorIndex]]:
+        """
+        Return the resident shard indexes by month, loading them if needed,
+        or None if there are none.
+        """
+        indexes = {}
+        for key, shard in self._loaded_shards():
+            vector_index = shard.get_index()
+            if vector_index is not None:
+                indexes[key] = vector_index
+        return indexes or None
+
+    def _shards_for(
+        self, search_filter: Optional[SearchFilter]
+    ) -> List[Tuple[str, FaissIndexManager]]:
+        shards = []
+        skipped = 0
+        for key, shard in self._loaded_shards():
+            if search_filter is not None:
+                with self._shards_lock:
+                    months = [key, *self._late_posts.entries.get(key, ())]
+                start = min(shard_bounds(month)[0] for month in months)
+                end = max(shard_bounds(month)[1] for month in months)
+                # Posts without a creation time live in the hot shard; any
+                # time window excludes them, so bounds are safe to use here.
+                if (search_filter.since is not None and end <= search_filter.since) or (
+                    search_filter.until is not None and start >= search_filter.until
+                ):
+                    skipped += 1
+                    continue
+            shards.append((key, shard))
+        with self._shards_lock:
+            self._shards_skipped += skipped
+        return shards
+
+    def _search_shard(
+        self,
+        key: str,
+        shard: FaissIndexManager,
+        query_embeddings,
+        k: int,
+        search_filter: Optional[SearchFilter],
+    ) -> List[List[Tuple[str, dict, float]]]:
+        with self._shards_lock:
+            deleted = self._sealed_deletes.entries.get(key)
+        if not deleted:
+            return shard.search_vectors(query_embeddings, k, search_filter)
+        # Ask for enough extra hits to make up for the removed posts
+        rows = shard.search_vectors(query_embeddings, k + len(deleted), search_filter)
+        return [
+            [hit for hit in hits if str(hit[1].get("post_id")) not in deleted][:k]
+            for hits in rows
+        ]
+
+    def search(
+        self, query: str, k: int = 5, search_filter: Optional[SearchFilter] = None
+    ) -> List[Tuple[str, dict]]:
+        """
+        Search every shard overlapping the filter's time window in parallel
+        and return the overall top-k (text, metadata) tuples.
+        """
+        shards = self._shards_for(search_filter)
+        if not shards:
+            return []
+        normalized = normalize_text(query)
+        generation = self.generation
+        cached = self.result_cache.get((generation, normalized, k, search_filter))
+        if cached is not None:
+            return cached
+        query_embedding = self.embed_query(normalized)
+        if len(shards) == 1:
+            hits = self._search_shard(*shards[0], [query_embedding], k, search_filter)[
+                0
+            ]
+        else:
+            futures = [
+                self._executor.submit(
+                    self._search_shard, key, shard, [query_embedding], k, search_filter
+                )
+                for key, shard in shards
+            ]
+            hits = heapq.nsmallest(
+                k,
+                (hit for future in futures for hit in future.result()[0]),
+                key=lambda hit: hit[2],
+            )
+        with self._shards_lock:
+            self._searches += 1
+            self._shards_searched += len(shards)
+        results = [(text, metadata) for text, metadata, _ in hits]
+        self.result_cache.set((generation, normalized, k, search_filter), results)
+        return results
+
+    def search_many(
+        self,
+        queries: List[str],
+        k: int = 5,
+        search_filter: Optional[SearchFilter] = None,
+    ) -> List[List[Tuple[str, dict]]]:
+        """
+        search() for many queries at once: those without cached results are
+        embedded in one call and sent to each shard as a single matrix query.
+        """
+        shards = self._shards_for(search_filter)
+        if not shards:
+            return [[] for _ in queries]
+        generation = self.generation
+        normalized = [normalize_text(query) for query in queries]
+        results = {
+            query: self.result_cache.get((generation, query, k, search_filter))
+            for query in set(normalized)
+        }
+        missing = [query for query, cached in results.items() if cached is None]
+        if missing:
+            query_embeddings = self.embed_queries(missing)
+            futures = [
+                self._executor.submit(
+                    self._search_shard, key, shard, query_embeddings, k, search_filter
+                )
+                for key, shard in shards
+            ]
+            shard_hits = [future.result() for future in futures]
+            for i, query in enumerate(missing):
+                hits = heapq.nsmallest(
+                    k,
+                    (hit for rows in shard_hits for hit in rows[i]),
+                    key=lambda hit: hit[2],
+                )
+                results[query] = [(text, metadata) for text, metadata, _ in hits]
+                self.result_cache.set(
+                    (generation, query, k, search_filter), results[query]
+                )
+            with self._shards_lock:
+                self._searches += len(missing)
+                self._shards_searched += len(shards) * len(missing)
+        return [results[query] for query in normalized]
+
+    def embed_query(self, query: str) -> List[float]:
+        """
+        Embed a query, reusing the embedding of an identical normalized query.
+        """
+        normalized = normalize_text(query)
+        vector = self.query_embedding_cache.get(normalized)
+        if vector is None:
+            vector = self.embedding.embed_query(normalized)
+            self.query_embedding_cache.set(normalized, vector)
+        return vector
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        embed_query() for many queries; the ones not cached are embedded in
+        a single batched call.
+        """
+        normalized = [normalize_text(query) for query in queries]
+        vectors = {query: self.query_embedding_cache.get(query) for query in normalized}
+        missing = [query for query, vector in vectors.items() if vector is None]
+        if missing:
+            for query, vector in zip(missing, embed_queries(self.embedding, missing)):
+                vectors[query] = vector
+                self.query_embedding_cache.set(query, vector)
+        return [vectors[query] for query in normalized]
+
+    def add_texts(self, texts: List[str], metadatas: List[dict] = None, save=True):
+        """
+        Embed texts once and upsert them into the hot shard, whatever month
+        they were created in; see compact() for posts of earlier months.
+        """
+        if not texts:
+            return
+        metadatas = metadatas or [{} for _ in texts]
+        post_ids = [
+            str(metadata.get("post_id") or uuid.uuid4()) for metadata in metadatas
+        ]
+        embeddings = self.embedding.embed_documents(texts)
+        hot = shard_key()
+        # Recorded first, so time-filtered searches never skip them
+        months = {shard_key(metadata.get("created_time")) for metadata in metadatas}
+        months.discard(hot)
+        with self._shards_lock:
+            known = self._late_posts.entries.get(hot, set())
+        if not months <= known:
+            self._update_journal(
+                self._late_posts,
+                lambda entries: entries.setdefault(hot, set()).update(months),
+            )
+        # Earlier copies in other shards are superseded
+        for key, owned in self._owners(post_ids).items():
+            if key != hot:
+                self._remove_from(key, owned, save)
+        self._shard(hot).add_vectors(post_ids, texts, embeddings, metadatas, save=save)
+        self._bump()
+
+    def remove(self, post_ids: List[str], save=True) -> int:
+        """
+        Tombstone the vectors of the given posts in the shard holding each.
+        """
+        removed = sum(
+            self._remove_from(key, owned, save)
+            for key, owned in self._owners(post_ids).items()
+        )
+        if removed:
+            self._bump()
+        return removed
+
+    def _owners(self, post_ids: List[str]) -> Dict[str, List[str]]:
+        """
+        Shard key -> the given posts that shard holds a live vector of.
+        """
+        owners = {}
+        for key, shard in self._loaded_shards():
+            vector_index = shard.get_index()
+            if vector_index is None:
+                continue
+            with self._shards_lock:
+                deleted = self._sealed_deletes.entries.get(key, ())
+            owned = [
+                post_id
+                for post_id in post_ids
+                if post_id in vector_index and post_id not in deleted
+            ]
+            if owned:
+                owners[key] = owned
+        return owners
+
+    def _remove_from(self, key: str, post_ids, save: bool) -> int:
+        if not post_ids:
+            return 0
+        if key >= shard_key():
+            return self._shard(key).remove(list(post_ids), save=save)
+        # Sealed shards are only rewritten by compact()
+        self._update_journal(
+            self._sealed_deletes,
+            lambda entries: entries.setdefault(key, set()).update(post_ids),
+        )
+        return len(post_ids)
+
+    def save(self):
+        """
+        Persist the shards with unsaved changes; untouched shards are not rewritten.
+        """
+        os.makedirs(self.root_path, exist_ok=True)
+        for _, shard in self._loaded_shards():
+            if shard.dirty:
+                shard.save()
+
+    def replace(self, vector_index: PostVectorIndex, save=True, rebuild=False):
+        """
+        Replace the whole corpus with a freshly built index, split into shards.
+        """
+        groups: Dict[str, List[int]] = {}
+        for vid in vector_index.live_ids():
+            groups.setdefault(record_shard_key(vector_index.records[vid]), []).append(
+                vid
+            )
+        for key, vids in sorted(groups.items()):
+            part = PostVectorIndex(vector_index.dim)
+            records = [vector_index.records[vid] for vid in vids]
+            part.upsert(
+                [record["post_id"] for record in records],
+                [record["text"] for record in records],
+                vector_index.source_vectors(vids, self.embedding.embed_documents),
+                [record["metadata"] for record in records],
+            )
+            self._shard(key).replace(part, save=save, rebuild=rebuild)
+            if save:
+                self._reseal(key)
+        for journal in (self._sealed_deletes, self._late_posts):
+            if journal.entries or os.path.exists(journal.path):
+                self._update_journal(journal, lambda entries: entries.clear())
+        for key, _ in self._loaded_shards():
+            if key not in groups:
+                self._drop_shard(key)
+        self._bump()
+
+    def _drop_shard(self, key: str):
+        with self._shards_lock:
+            self._shards.pop(key, None)
+            self._persisted.discard(key)
+            self._generation += 1
+            journals = [
+                journal
+                for journal in (self._sealed_deletes, self._late_posts)
+                if key in journal.entries
+            ]
+        for journal in journals:
+            self._update_journal(journal, lambda entries: entries.pop(key, None))
+        shutil.rmtree(os.path.join(self.root_path, key), ignore_errors=True)
+
+    def _collect_late_posts(self):
+        """
+        Gather the posts shards hold of earlier months. Returns (month ->
+        [(post_id, text, vector, metadata)] to move there, shard key ->
+        post_ids leaving it, shard key -> months it no longer holds).
+        """
+        incoming: Dict[str, list] = {}
+        leaving: Dict[str, List[str]] = {}
+        shards = dict(self._loaded_shards())
+        with self._shards_lock:
+            holders = {
+                key: set(months) for key, months in self._late_posts.entries.items()
+            }
+            deleted = {
+                key: set(ids) for key, ids in self._sealed_deletes.entries.items()
+            }
+        for key in holders:
+            vector_index = shards[key].get_index() if key in shards else None
+            if vector_index is None:
+                continue
+            removed = deleted.get(key, ())
+            vids = [
+                vid
+                for post_id, vid in list(vector_index.post_ids.items())
+                if post_id not in removed
+                and record_shard_key(vector_index.records[vid]) != key
+            ]
+            vectors = vector_index.source_vectors(vids, self.embedding.embed_documents)
+            for vid, vector in zip(vids, vectors):
+                record = vector_index.records[vid]
+                incoming.setdefault(record_shard_key(record), []).append(
+                    (record["post_id"], record["text"], vector, record["metadata"])
+                )
+                leaving.setdefault(key, []).append(record["post_id"])
+        return incoming, leaving, holders
+
+    def compact(self):
+        """
+        Rebuild every shard without its tombstoned vectors, applying the
+        removals from sealed shards and moving late posts into the shard of
+        their month. This is the only time sealed shards are rewritten.
+        """
+        incoming, leaving, moved = self._collect_late_posts()
+        keys = {key for key, _ in self._loaded_shards()} | set(incoming)
+        for key in sorted(keys):
+            shard = self._shard(key)
+            with self._shards_lock:
+                deleted = sorted(self._sealed_deletes.entries.get(key, ()))
+            if deleted or key in leaving:
+                shard.remove(deleted + leaving.get(key, []), save=False)
+            items = incoming.get(key)
+            if items:
+                # Into a new index: a memory-mapped one must not take writes
+                vector_index = shard.get_index()
+                if vector_index is None:
+                    part = PostVectorIndex(len(items[0][2]))
+                else:
+                    part = vector_index.rebuilt(embed=self.embedding.embed_documents)
+                post_ids, texts, vectors, metadatas = zip(*items)
+                part.upsert(list(post_ids), list(texts), vectors, list(metadatas))
+                shard.replace(part)
+            else:
+                shard.compact()
+            self._reseal(key)
+            if deleted:
+                # Keep removals other processes made meanwhile
+                self._update_journal(
+                    self._sealed_deletes,
+                    lambda entries: entries.get(key, set()).difference_update(deleted),
+                )
+        if moved:
+
+            def forget_moved(entries):
+                # Months another process added meanwhile stay
+                for key, months in moved.items():
+                    entries.get(key, set()).difference_update(months)
+
+            self._update_journal(self._late_posts, forget_moved)
+        self._bump()
+
+    def stats(self) -> dict:
+        shards = {
+            key: (shard.stats(), bool(shard.io_flags))
+            for key, shard in self._loaded_shards()
+        }
+        return {
+            "shards": len(shards),
+            "hot_shard": shard_key(),
+            "memory_generation": self.generation,
+            "dirty": any(stats["dirty"] for stats, _ in shards.values()),
+            "live_vectors": sum(stats["live_vectors"] for stats, _ in shards.values()),
+            "dead_vectors": sum(stats["dead_vectors"] for stats, _ in shards.values()),
+            "late_post_shards": len(self._late_posts.entries),
+            "sealed_deletes": sum(
+                len(ids) for ids in self._sealed_deletes.entries.values()
+            ),
+            "size_bytes": sum(stats["size_bytes"] for stats, _ in shards.values()),
+            "searches": self._searches,
+            "shards_searched": self._shards_searched,
+            "shards_skipped": self._shards_skipped,
+            "per_shard": {
+                key: {
+                    "live_vectors": stats["live_vectors"],
+                    "dead_vectors": stats["dead_vectors"],
+                    "index_type": stats["index_type"],
+                    "generation": stats["generation"],
+                    "mmapped": mmapped,
+                }
+                for key, (stats, mmapped) in shards.items()
+            },
+        }
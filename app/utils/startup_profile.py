@@ -0,0 +1,113 @@
+"""
+Report how long each part of the app takes to import and how much
+resident memory it adds, so cold-start regressions are visible.
+
+    python -m app.utils.startup_profile [--warm-up]
+
+Modules are imported in the same order the server imports them; a module's
+numbers include whatever it imports that was not loaded before it. With
+--warm-up the lazy providers (LLM clients, embedding model) are built
+afterwards and reported the same way. For a per-import breakdown use
+`python -X importtime -m app.utils.startup_profile`.
+"""
+
+import argparse
+import importlib
+import os
+import pkgutil
+import resource
+import sys
+import time
+
+# Imported first, in the order app.main pulls them in
+CORE_MODULES = (
+    "app.settings",
+    "app.db.base",
+    "app.db.db_schema",
+    "app.utils.faiss_utils",
+)
+
+API_V1_PACKAGE = "app.api.v1"
+
+
+def rss_mb() -> float:
+    """
+    Current resident set size in MB (peak RSS where /proc is unavailable).
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def measure(label: str, func) -> dict:
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    error = None
+    try:
+        func()
+    except Exception as e:
+        error = str(e)
+    return {
+        "label": label,
+        "seconds": time.perf_counter() - start,
+        "rss_delta_mb": rss_mb() - rss_before,
+        "error": error,
+    }
+
+
+def router_modules():
+    import app.api.v1 as api_v1
+
+    path = os.path.dirname(api_v1.__file__)
+    return [f"{API_V1_PACKAGE}.{name}" for _, name, _ in pkgutil.iter_modules([path])]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--warm-up",
+        action="store_true",
+        help="Also build the lazy providers and report their cost",
+    )
+    args = parser.parse_args(argv)
+
+    baseline = rss_mb()
+    start = time.perf_counter()
+    results = []
+    for module in CORE_MODULES:
+        results.append(measure(module, lambda: importlib.import_module(module)))
+    for module in router_modules():
+        results.append(measure(module, lambda: importlib.import_module(module)))
+    results.append(measure("app.main", lambda: importlib.import_module("app.main")))
+    import_seconds = time.perf_counter() - start
+    import_rss = rss_mb() - baseline
+
+    if args.warm_up:
+        from app.utils.providers import registered
+
+        for name, provider in registered().items():
+            if provider.warm:
+                results.append(measure(f"provider:{name}", provider.get))
+
+    print(f"{'module':<40} {'seconds':>9} {'rss_mb':>9}")
+    for result in results:
+        line = (
+            f"{result['label']:<40} {result['seconds']:>9.3f} "
+            f"{result['rss_delta_mb']:>+9.1f}"
+        )
+        if result["error"]:
+            line += f"  FAILED: {result['error']}"
+        print(line)
+    print(f"{'total import':<40} {import_seconds:>9.3f} {import_rss:>+9.1f}")
+    print(f"resident after startup: {rss_mb():.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Server-Sent Events helpers for streaming LLM output to the client.
+
+Each chunk of generated text is sent as a `data:` event holding
+{"text": ...}; the stream ends with an `event: done` (or `event: error`)
+message so clients can tell a finished answer from a dropped connection.
+"""
+
+import json
+import time
+from typing import AsyncIterable, AsyncIterator, Callable
+
+from app.utils.metrics import LatencyRecorder
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # Stop reverse proxies (nginx) from buffering the whole response
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(data: dict, event: str = None) -> str:
+    """
+    Format one SSE message.
+    """
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+
+async def sse_stream(
+    chunks: AsyncIterable[str],
+    started_at: float,
+    time_to_first_token: LatencyRecorder,
+    total_time: LatencyRecorder,
+    on_close: Callable[[], None] = None,
+) -> AsyncIterator[str]:
+    """
+    Relay text chunks as SSE messages. Both latencies are measured from
+    `started_at` (a time.perf_counter() value taken when the request came in).
+    `on_close` runs once the stream ends, however it ends.
+    """
+    first = True
+    try:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            if first:
+                time_to_first_token.record(time.perf_counter() - started_at)
+                first = False
+            yield sse_event({"text": chunk})
+    except Exception as e:
+        print(f"[Chat] Streaming failed: {str(e)}")
+        yield sse_event({"detail": str(e)}, event="error")
+        return
+    finally:
+        if on_close is not None:
+            on_close()
+    elapsed = time.perf_counter() - started_at
+    total_time.record(elapsed)
+    yield sse_event({"elapsed_ms": round(elapsed * 1000.0, 1)}, event="done")
+
+
+def call_once(func: Callable[[], None]) -> Callable[[], None]:
+    """
+    Wrap `func` so only the first call runs it; used to release a resource
+    from both the stream and the response's background task.
+    """
+    called = False
+
+    def wrapper():
+        nonlocal called
+        if not called:
+            called = True
+            func()
+
+    return wrapper
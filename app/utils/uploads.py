@@ -0,0 +1,35 @@
+"""
+Storage for uploaded prescription images.
+
+UPLOAD_BACKEND selects where they go: "cloudinary" (the default) or
+"local", which writes them under static/uploads without any network call,
+for development and benchmarks.
+"""
+
+import hashlib
+import os
+from typing import BinaryIO, Optional
+
+from app.settings import settings
+
+LOCAL_UPLOAD_DIR = os.path.join("static", "uploads")
+
+
+def upload_image(file: BinaryIO) -> Optional[str]:
+    """
+    Store an uploaded image and return its URL, or None if that failed.
+    """
+    if settings.UPLOAD_BACKEND == "local":
+        data = file.read()
+        name = f"{hashlib.sha256(data).hexdigest()}.jpg"
+        path = os.path.join(LOCAL_UPLOAD_DIR, name)
+        if not os.path.exists(path):
+            os.makedirs(LOCAL_UPLOAD_DIR, exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+        return f"/static/uploads/{name}"
+
+    import cloudinary.uploader
+
+    upload_result = cloudinary.uploader.upload(file, access_mode="public")
+    return upload_result.get("secure_url")
@@ -0,0 +1,449 @@
+"""
+ID-mapped FAISS vector index keyed by post_id.
+
+Each vector gets an internal int64 id, mapped to the post it came from.
+Deleting or replacing a post only records a tombstone for its old vector;
+tombstoned vectors are filtered out at query time and physically dropped
+when the index is compacted. Compacting or retraining a lossy (PQ) index
+needs the original vectors, so the texts are embedded again (a cache hit
+with CachedEmbeddings) instead of re-quantizing PQ decodes.
+
+Per-vector attributes used for filtering (live, doctor-authored, creation
+time, thread) are kept in dense arrays indexed by vector id, so a filter
+turns into a bitmap that FAISS applies during the search itself instead of
+over-fetching and discarding results.
+"""
+
+import datetime
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import faiss
+import numpy as np
+
+from app.utils.faiss_index_types import (
+    LOSSY_INDEX_TYPES,
+    MIN_TRAINING_VECTORS,
+    configure_index,
+    create_faiss_index,
+    index_type_of,
+    ivf_nlist,
+    search_parameters,
+    train_index,
+)
+
+INDEX_FILE = "index.faiss"
+RECORDS_FILE = "index.json"
+
+# Creation time used for posts without one; excluded by any time window
+UNKNOWN_TIME = np.iinfo(np.int64).min
+
+SELECTOR_CACHE_SIZE = 32
+
+
+@dataclass(frozen=True)
+class SearchFilter:
+    """
+    Restricts a vector search to a subset of posts.
+
+    - doctor_only: only posts written by a doctor
+    - since / until: only posts created in this time window
+    - thread_id: only the post with this id and its (nested) replies
+    """
+
+    doctor_only: bool = False
+    since: Optional[datetime.datetime] = None
+    until: Optional[datetime.datetime] = None
+    thread_id: Optional[str] = None
+
+    @classmethod
+    def create(
+        cls,
+        doctor_only: bool = False,
+        since_days: Optional[int] = None,
+        thread_id: Optional[str] = None,
+    ) -> Optional["SearchFilter"]:
+        """
+        Build a filter from request parameters, or None if nothing is filtered.
+        The time window starts at midnight so the filter (and its bitmap)
+        stays the same for a whole day.
+        """
+        since = None
+        if since_days is not None:
+            day = datetime.date.today() - datetime.timedelta(days=since_days)
+            since = datetime.datetime.combine(day, datetime.time.min)
+        search_filter = cls(doctor_only=doctor_only, since=since, thread_id=thread_id)
+        return None if search_filter.is_empty() else search_filter
+
+    def is_empty(self) -> bool:
+        return not (self.doctor_only or self.since or self.until or self.thread_id)
+
+
+def _timestamp(value) -> int:
+    if not value:
+        return UNKNOWN_TIME
+    if isinstance(value, str):
+        try:
+            value = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            return UNKNOWN_TIME
+    return int(value.timestamp())
+
+
+class PostVectorIndex:
+    """Vector index supporting upsert and remove by post_id."""
+
+    def __init__(self, dim: int, index: faiss.Index = None):
+        self.dim = dim
+        self.index = index if index is not None else create_faiss_index("flat", dim, 0)
+        # Number of vectors the index was built (and trained) for
+        self.trained_size = 0
+        self.next_id = 0
+        # post_id -> id of its live vector
+        self.post_ids: Dict[str, int] = {}
+        # vector id -> {"post_id", "text", "metadata"}, for live and dead vectors
+        self.records: Dict[int, dict] = {}
+        self.tombstones: Set[int] = set()
+        # Dense per-vector attributes, indexed by vector id
+        self._live = np.zeros(0, dtype=bool)
+        self._doctor = np.zeros(0, dtype=bool)
+        self._created = np.zeros(0, dtype=np.int64)
+        # parent post_id -> vector ids of its replies
+        self._children: Dict[str, Set[int]] = {}
+        # Bumped on every mutation; keys the selector cache
+        self.version = 0
+        self._selectors: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._selectors_lock = threading.Lock()
+
+    @property
+    def live_count(self) -> int:
+        return len(self.records) - len(self.tombstones)
+
+    @property
+    def dead_count(self) -> int:
+        return len(self.tombstones)
+
+    @property
+    def tombstone_ratio(self) -> float:
+        if not self.records:
+            return 0.0
+        return len(self.tombstones) / len(self.records)
+
+    @property
+    def index_type(self) -> str:
+        return index_type_of(self.index)
+
+    def __contains__(self, post_id: str) -> bool:
+        return post_id in self.post_ids
+
+    def _ensure_capacity(self, size: int):
+        capacity = len(self._live)
+        if size <= capacity:
+            return
+        new_capacity = max(size, 2 * capacity, 1024)
+        grow = new_capacity - capacity
+        self._live = np.concatenate([self._live, np.zeros(grow, dtype=bool)])
+        self._doctor = np.concatenate([self._doctor, np.zeros(grow, dtype=bool)])
+        self._created = np.concatenate(
+            [self._created, np.full(grow, UNKNOWN_TIME, dtype=np.int64)]
+        )
+
+    def _index_attributes(self, vid: int, record: dict, live: bool):
+        metadata = record["metadata"] or {}
+        self._live[vid] = live
+        self._doctor[vid] = bool(metadata.get("doctor_id"))
+        self._created[vid] = _timestamp(metadata.get("created_time"))
+        parent_id = metadata.get("parent_id")
+        if parent_id:
+            self._children.setdefault(str(parent_id), set()).add(vid)
+
+    def upsert(
+        self,
+        post_ids: List[str],
+        texts: List[str],
+        vectors,
+        metadatas: List[dict] = None,
+    ):
+        """
+        Add vectors for the given posts, tombstoning any previous vector of
+        the same post.
+        """
+        if not post_ids:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        metadatas = metadatas or [{} for _ in post_ids]
+        self.remove(post_ids)
+        ids = np.arange(self.next_id, self.next_id + len(post_ids), dtype=np.int64)
+        self.index.add_with_ids(vectors, ids)
+        self._ensure_capacity(self.next_id + len(post_ids))
+        for vid, post_id, text, metadata in zip(
+            ids.tolist(), post_ids, texts, metadatas
+        ):
+            record = {"post_id": post_id, "text": text, "metadata": metadata}
+            self.records[vid] = record
+            previous = self.post_ids.get(post_id)
+            if previous is not None:
+                # Same post twice in one batch: the last one wins
+                self.tombstones.add(previous)
+                self._live[previous] = False
+            self.post_ids[post_id] = vid
+            self._index_attributes(vid, record, live=True)
+        self.next_id += len(post_ids)
+        self.version += 1
+
+    def remove(self, post_ids: Iterable[str]) -> int:
+        """
+        Tombstone the live vectors of the given posts. Returns how many were removed.
+        """
+        removed = 0
+        for post_id in post_ids:
+            vid = self.post_ids.pop(post_id, None)
+            if vid is not None:
+                self.tombstones.add(vid)
+                self._live[vid] = False
+                removed += 1
+        if removed:
+            self.version += 1
+        return removed
+
+    def _thread_mask(self, thread_id: str) -> np.ndarray:
+        mask = np.zeros(self.next_id, dtype=bool)
+        root = self.post_ids.get(thread_id)
+        if root is not None:
+            mask[root] = True
+        pending = [thread_id]
+        seen = {thread_id}
+        while pending:
+            for vid in self._children.get(pending.pop(), ()):
+                mask[vid] = True
+                child_post_id = self.records[vid]["post_id"]
+                if child_post_id not in seen:
+                    seen.add(child_post_id)
+                    pending.append(child_post_id)
+        return mask
+
+    def filter_mask(self, search_filter: Optional[SearchFilter] = None) -> np.ndarray:
+        """
+        Boolean mask over vector ids of the live vectors matching the filter.
+        """
+        n = self.next_id
+        mask = self._live[:n].copy()
+        if search_filter is None:
+            return mask
+        if search_filter.doctor_only:
+            mask &= self._doctor[:n]
+        if search_filter.since is not None:
+            mask &= self._created[:n] >= int(search_filter.since.timestamp())
+        if search_filter.until is not None:
+            mask &= (self._created[:n] != UNKNOWN_TIME) & (
+                self._created[:n] < int(search_filter.until.timestamp())
+            )
+        if search_filter.thread_id:
+            mask &= self._thread_mask(search_filter.thread_id)
+        return mask
+
+    def _selector(self, search_filter: Optional[SearchFilter]) -> tuple:
+        """
+        Return (selector, bitmap, match count) for the filter, cached per index
+        version. The selector only points into the bitmap, so callers must keep
+        the whole tuple alive while searching.
+        """
+        key = (self.version, search_filter)
+        with self._selectors_lock:
+            cached = self._selectors.get(key)
+            if cached is not None:
+                self._selectors.move_to_end(key)
+                return cached
+        mask = self.filter_mask(search_filter)
+        bitmap = np.packbits(mask, bitorder="little")
+        selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+        entry = (selector, bitmap, int(mask.sum()))
+        with self._selectors_lock:
+            self._selectors[key] = entry
+            while len(self._selectors) > SELECTOR_CACHE_SIZE:
+                self._selectors.popitem(last=False)
+        return entry
+
+    def search(
+        self, vectors, k: int = 5, search_filter: Optional[SearchFilter] = None
+    ) -> List[List[Tuple[dict, float]]]:
+        """
+        Search the top-k live records matching the filter for each query vector.
+        Returns one list of (record, distance) pairs per query.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if self.index.ntotal == 0 or k <= 0:
+            return [[] for _ in range(len(vectors))]
+        if search_filter is None and not self.tombstones:
+            distances, ids = self.index.search(vectors, min(k, self.index.ntotal))
+        else:
+            # _bitmap backs the selector and must stay referenced during the search
+            selector, _bitmap, matches = self._selector(search_filter)
+            if not matches:
+                return [[] for _ in range(len(vectors))]
+            distances, ids = self.index.search(
+                vectors,
+                min(k, matches),
+                params=search_parameters(self.index, selector),
+            )
+        results = []
+        for row_distances, row_ids in zip(distances, ids):
+            results.append(
+                [
+                    (self.records[vid], distance)
+                    for distance, vid in zip(row_distances.tolist(), row_ids.tolist())
+                    if vid >= 0
+                ]
+            )
+        return results
+
+    def live_ids(self) -> List[int]:
+        return sorted(self.post_ids.values())
+
+    @property
+    def lossy(self) -> bool:
+        return self.index_type in LOSSY_INDEX_TYPES
+
+    def reconstruct(self, vids: List[int]) -> np.ndarray:
+        if not vids:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.vstack([self.index.reconstruct(int(vid)) for vid in vids])
+
+    def source_vectors(
+        self, vids: List[int], embed: Callable[[List[str]], list] = None
+    ) -> np.ndarray:
+        """
+        The original vectors of the given ids, for building another index.
+        A lossy index only holds approximations, so its texts are embedded
+        again with `embed`; without it a ValueError is raised.
+        """
+        if not self.lossy:
+            return self.reconstruct(vids)
+        if embed is None:
+            raise ValueError(
+                f"Cannot rebuild an {self.index_type} index without "
+                "re-embedding its texts"
+            )
+        if not vids:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        vectors = embed([self.records[vid]["text"] for vid in vids])
+        return np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+
+    def rebuilt(
+        self,
+        index_type: str = None,
+        seed: int = 1234,
+        embed: Callable[[List[str]], list] = None,
+    ) -> "PostVectorIndex":
+        """
+        Return a new index of the given type (default: the current one) holding
+        only the live vectors. Approximate index types are trained on a sample
+        of the live vectors first. `embed` (texts -> vectors) is required to
+        rebuild a lossy index; see source_vectors().
+        """
+        index_type = index_type or self.index_type
+        if self.lossy and embed is None:
+            raise ValueError(
+                f"Cannot rebuild an {self.index_type} index without "
+                "re-embedding its texts"
+            )
+        vids = self.live_ids()
+        if len(vids) < MIN_TRAINING_VECTORS[index_type]:
+            index_type = "flat"
+        index = create_faiss_index(index_type, self.dim, len(vids))
+        if not index.is_trained:
+            sample_size = min(len(vids), 256 * ivf_nlist(len(vids)))
+            rng = np.random.default_rng(seed)
+            sample = sorted(rng.choice(vids, sample_size, replace=False).tolist())
+            train_index(index, self.source_vectors(sample, embed))
+        rebuilt = PostVectorIndex(self.dim, index=index)
+        rebuilt.trained_size = len(vids)
+        for start in range(0, len(vids), 10000):
+            chunk = vids[start : start + 10000]
+            records = [self.records[vid] for vid in chunk]
+            rebuilt.upsert(
+                [record["post_id"] for record in records],
+                [record["text"] for record in records],
+                self.source_vectors(chunk, embed),
+                [record["metadata"] for record in records],
+            )
+        return rebuilt
+
+    def copy(self) -> "PostVectorIndex":
+        """
+        An independent copy, to rebuild from while this index keeps changing.
+        """
+        copied = PostVectorIndex(self.dim, index=faiss.clone_index(self.index))
+        configure_index(copied.index)
+        copied.trained_size = self.trained_size
+        copied.next_id = self.next_id
+        copied.post_ids = dict(self.post_ids)
+        # Records are never changed in place, only added
+        copied.records = dict(self.records)
+        copied.tombstones = set(self.tombstones)
+        copied._live = self._live.copy()
+        copied._doctor = self._doctor.copy()
+        copied._created = self._created.copy()
+        copied._children = {
+            parent: set(vids) for parent, vids in self._children.items()
+        }
+        copied.version = self.version
+        return copied
+
+    def compacted(self, embed: Callable[[List[str]], list] = None) -> "PostVectorIndex":
+        """
+        Return a new index of the same type holding only the live vectors.
+        """
+        return self.rebuilt(embed=embed)
+
+    def save(self, path: str):
+        """
+        Write the FAISS index and the record mapping into the given directory.
+        """
+        os.makedirs(path, exist_ok=True)
+        faiss.write_index(self.index, os.path.join(path, INDEX_FILE))
+        with open(os.path.join(path, RECORDS_FILE), "w") as f:
+            json.dump(
+                {
+                    "dim": self.dim,
+                    "trained_size": self.trained_size,
+                    "next_id": self.next_id,
+                    "records": [
+                        [vid, r["post_id"], r["text"], r["metadata"]]
+                        for vid, r in self.records.items()
+                    ],
+                    "tombstones": sorted(self.tombstones),
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, path: str, io_flags: int = 0) -> Optional["PostVectorIndex"]:
+        """
+        Load an index previously written by save(), or None if there is none.
+        """
+        index_file = os.path.join(path, INDEX_FILE)
+        records_file = os.path.join(path, RECORDS_FILE)
+        if not (os.path.exists(index_file) and os.path.exists(records_file)):
+            return None
+        with open(records_file, "r") as f:
+            data = json.load(f)
+        index = faiss.read_index(index_file, io_flags)
+        configure_index(index)
+        vector_index = cls(data["dim"], index=index)
+        vector_index.trained_size = data.get("trained_size", 0)
+        vector_index.next_id = data["next_id"]
+        vector_index.tombstones = set(data["tombstones"])
+        vector_index._ensure_capacity(vector_index.next_id)
+        for vid, post_id, text, metadata in data["records"]:
+            record = {"post_id": post_id, "text": text, "metadata": metadata}
+            vector_index.records[vid] = record
+            live = vid not in vector_index.tombstones
+            if live:
+                vector_index.post_ids[post_id] = vid
+            vector_index._index_attributes(vid, record, live=live)
+        return vector_index
@@ -0,0 +1,46 @@
+"""
+Test settings: a throwaway SQLite database, offline embeddings and LLM.
+They must be in the environment before anything imports app.settings.
+"""
+
+import os
+import tempfile
+
+import pytest
+
+_TMP_DIR = tempfile.mkdtemp(prefix="cognimed-tests-")
+
+for name, value in {
+    "DATABASE_URL": f"sqlite:///{os.path.join(_TMP_DIR, 'test.db')}",
+    "SECRET_KEY": "test",
+    "CLOUDINARY_CLOUD_NAME": "test",
+    "CLOUDINARY_API_KEY": "test",
+    "CLOUDINARY_API_SECRET": "test",
+    "GENAI_API_KEY": "test",
+    "EMBEDDING_BACKEND": "hashing",
+    "EMBEDDING_CACHE_ENABLED": "false",
+    "LLM_BACKEND": "fake",
+    "JOB_QUEUE_PATH": os.path.join(_TMP_DIR, "jobs.sqlite3"),
+}.items():
+    os.environ.setdefault(name, value)
+
+
+@pytest.fixture
+def embedding():
+    from app.utils.embeddings import HashingEmbeddings
+
+    return HashingEmbeddings(dim=16)
+
+
+@pytest.fixture
+def db_session():
+    pytest.importorskip("sqlalchemy")
+    # Importing the schema creates the tables
+    import app.db.db_schema
+    from app.db.base import SessionLocal
+
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
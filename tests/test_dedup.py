@@ -0,0 +1,150 @@
+import io
+import uuid
+
+import pytest
+
+from app.utils.image_hash import dhash, hamming, sha256_hex
+
+FIELDS = {
+    "doctor_name": "Dr. Rao",
+    "visit_date": "2026-03-02",
+    "visit_time": "10:30",
+    "hospital_name": "City Hospital",
+}
+
+
+def image_bytes(image, format="PNG", **options) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **options)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def photo():
+    Image = pytest.importorskip("PIL.Image")
+    image = Image.new("L", (240, 320))
+    image.putdata(
+        [(x * 7 + (x // 40) * y) % 256 for y in range(320) for x in range(240)]
+    )
+    return image
+
+
+def test_hamming():
+    assert hamming("0000000000000000", "0000000000000000") == 0
+    assert hamming("0000000000000000", "ffffffffffffffff") == 64
+    assert hamming("00000000000000f0", "0000000000000010") == 3
+
+
+def test_dhash_survives_reencoding_and_resizing(photo):
+    original = dhash(image_bytes(photo))
+    copies = [
+        image_bytes(photo.convert("RGB"), "JPEG", quality=60),
+        image_bytes(photo.resize((120, 160))),
+    ]
+    for copy in copies:
+        assert hamming(dhash(copy), original) <= 6
+
+
+def test_dhash_tells_different_images_apart(photo):
+    other = photo.transpose(0)
+    assert hamming(dhash(image_bytes(other)), dhash(image_bytes(photo))) > 10
+
+
+def test_dhash_of_non_image_is_none():
+    pytest.importorskip("PIL")
+    assert dhash(b"%PDF-1.4 not an image") is None
+
+
+@pytest.fixture
+def upload(db_session):
+    from app.db.priscription import add_priscription, add_priscription_upload
+
+    username = f"patient-{uuid.uuid4()}"
+    priscription = add_priscription(
+        username=username, file_url="https://files/1", db=db_session, **FIELDS
+    )
+    return add_priscription_upload(
+        username,
+        sha256_hex(b"scan"),
+        "00000000000000ff",
+        priscription.id,
+        "https://files/1",
+        db=db_session,
+    )
+
+
+def find(upload, db_session, sha256="other", phash=None, fields=FIELDS, **options):
+    from app.db.priscription import find_duplicate_upload
+
+    return find_duplicate_upload(
+        upload.username, sha256, phash, fields=fields, db=db_session, **options
+    )
+
+
+def test_same_bytes_always_match(upload, db_session):
+    found, match = find(upload, db_session, sha256=upload.sha256, fields=None)
+    assert (found.id, match) == (upload.id, "exact")
+
+
+def test_lookalike_within_threshold_matches(upload, db_session):
+    found, match = find(upload, db_session, phash="00000000000000f0", max_distance=4)
+    assert (found.id, match) == (upload.id, "perceptual")
+
+
+def test_lookalike_over_threshold_does_not_match(upload, db_session):
+    assert find(upload, db_session, phash="00000000000000f0", max_distance=3) == (
+        None,
+        None,
+    )
+    # The default threshold only accepts identical hashes
+    assert find(upload, db_session, phash="00000000000000fe") == (None, None)
+    found, _ = find(upload, db_session, phash=upload.phash)
+    assert found.id == upload.id
+
+
+def test_lookalike_with_other_form_fields_does_not_match(upload, db_session):
+    for name in FIELDS:
+        fields = {**FIELDS, name: "something else"}
+        assert find(
+            upload, db_session, phash=upload.phash, fields=fields, max_distance=64
+        ) == (None, None)
+    assert find(upload, db_session, phash=upload.phash, fields=None) == (None, None)
+
+
+def test_other_patients_uploads_do_not_match(upload, db_session):
+    from app.db.priscription import find_duplicate_upload
+
+    assert find_duplicate_upload(
+        "someone-else",
+        upload.sha256,
+        upload.phash,
+        max_distance=64,
+        fields=FIELDS,
+        db=db_session,
+    ) == (None, None)
+
+
+def test_uploads_of_a_deleted_prescription_do_not_match(upload, db_session):
+    from app.db.db_schema import Priscription
+
+    # An upload row left behind by a deletion from before uploads were removed
+    db_session.query(Priscription).filter(
+        Priscription.id == upload.priscription_id
+    ).delete()
+    db_session.commit()
+    assert find(upload, db_session, sha256=upload.sha256, fields=None) == (None, None)
+    assert find(upload, db_session, phash=upload.phash) == (None, None)
+
+
+def test_deleting_a_prescription_deletes_its_uploads(upload, db_session):
+    from app.db.db_schema import PriscriptionUpload
+    from app.db.priscription import delete_priscription
+
+    username = upload.username
+    assert delete_priscription(upload.priscription_id, db_session)
+    assert (
+        db_session.query(PriscriptionUpload)
+        .filter(PriscriptionUpload.username == username)
+        .count()
+        == 0
+    )
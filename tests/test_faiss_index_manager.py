@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+
+pytest.importorskip("faiss")
+
+from app.utils.faiss_index_manager import FaissIndexManager
+from app.utils.vector_store import PostVectorIndex
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    return str(tmp_path / "index")
+
+
+def open_manager(index_path, embedding):
+    return FaissIndexManager(index_path, embedding, reload_check_interval=0)
+
+
+def add(manager, post_id, save=True):
+    manager.add_texts([f"post {post_id}"], [{"post_id": post_id}], save=save)
+
+
+def test_save_publishes_a_new_generation(index_path, embedding):
+    manager = open_manager(index_path, embedding)
+    add(manager, "1")
+    add(manager, "2")
+    assert manager.read_disk_generation() == 2
+    reader = open_manager(index_path, embedding)
+    assert set(reader.get_index().post_ids) == {"1", "2"}
+
+
+def test_unsaved_changes_are_merged_into_a_newer_generation(index_path, embedding):
+    first = open_manager(index_path, embedding)
+    add(first, "1")
+    second = open_manager(index_path, embedding)
+    second.get_index()
+
+    add(first, "2", save=False)
+    first.remove(["1"], save=False)
+    # Published while `first` has unsaved changes
+    add(second, "3")
+    first.save()
+
+    published = open_manager(index_path, embedding).get_index()
+    assert set(published.post_ids) == {"2", "3"}
+    assert first.stats()["merges"] == 1
+    assert set(first.get_index().post_ids) == {"2", "3"}
+
+
+def test_replace_overrides_what_was_published(index_path, embedding):
+    first = open_manager(index_path, embedding)
+    add(first, "1")
+    second = open_manager(index_path, embedding)
+    second.get_index()
+    add(first, "2")
+
+    fresh = PostVectorIndex(16)
+    fresh.upsert(["9"], ["post 9"], embedding.embed_documents(["post 9"]))
+    second.replace(fresh)
+
+    published = open_manager(index_path, embedding).get_index()
+    assert set(published.post_ids) == {"9"}
+    assert second.stats()["merges"] == 0
+
+
+def test_writes_during_a_rebuild_are_not_blocked_or_lost(
+    index_path, embedding, monkeypatch
+):
+    manager = open_manager(index_path, embedding)
+    add(manager, "1")
+    add(manager, "2")
+    rebuilt = PostVectorIndex.rebuilt
+
+    def rebuilt_while_writing(self, *args, **kwargs):
+        def write():
+            add(manager, "3")
+            manager.remove(["1"])
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        writer.join(timeout=10)
+        assert not writer.is_alive(), "writer blocked by the rebuild"
+        return rebuilt(self, *args, **kwargs)
+
+    monkeypatch.setattr(PostVectorIndex, "rebuilt", rebuilt_while_writing)
+    manager.rebuild()
+
+    assert set(manager.get_index().post_ids) == {"2", "3"}
+    published = open_manager(index_path, embedding).get_index()
+    assert set(published.post_ids) == {"2", "3"}
+    assert manager.stats()["rebuilds"] == 1
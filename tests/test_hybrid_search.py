@@ -0,0 +1,106 @@
+import time
+
+import pytest
+
+from app.utils.hybrid_search import RRF_K, HybridRetriever, reciprocal_rank_fusion
+
+
+def ranking(*post_ids):
+    return [(f"text {post_id}", {"post_id": post_id}) for post_id in post_ids]
+
+
+def fused_ids(fused):
+    return [metadata["post_id"] for _, metadata in fused]
+
+
+def test_posts_ranked_by_both_retrievers_come_first():
+    lexical = ranking("a", "b", "c")
+    vector = ranking("d", "c", "e")
+    fused = reciprocal_rank_fusion([lexical, vector], k=5)
+    assert fused_ids(fused) == ["c", "a", "d", "b", "e"]
+    scores = {metadata["post_id"]: metadata["score"] for _, metadata in fused}
+    assert scores["c"] == pytest.approx(1 / (RRF_K + 3) + 1 / (RRF_K + 2))
+    assert scores["a"] == pytest.approx(1 / (RRF_K + 1))
+
+
+def test_top_k_and_metadata_is_copied():
+    lexical = ranking("a", "b", "c")
+    fused = reciprocal_rank_fusion([lexical], k=2)
+    assert fused_ids(fused) == ["a", "b"]
+    assert "score" not in lexical[0][1]
+
+
+def test_results_without_post_id_are_keyed_by_text():
+    fused = reciprocal_rank_fusion(
+        [[("same", {}), ("only lexical", None)], [("same", {})]], k=5
+    )
+    assert [text for text, _ in fused] == ["same", "only lexical"]
+
+
+def test_rrf_k_flattens_rank_differences():
+    # "a" tops one ranking, "b" is third in both
+    rankings = [ranking("a", "x", "b"), ranking("y", "z", "b")]
+
+    def order(rrf_k):
+        ids = fused_ids(reciprocal_rank_fusion(rankings, k=5, rrf_k=rrf_k))
+        return [post_id for post_id in ids if post_id in ("a", "b")]
+
+    assert order(0) == ["a", "b"]
+    assert order(RRF_K) == ["b", "a"]
+
+
+def test_empty_rankings():
+    assert reciprocal_rank_fusion([[], []], k=5) == []
+
+
+class FlakyIndex:
+    """
+    Vector side that sleeps `delay` seconds, or raises while `failing`.
+    """
+
+    def __init__(self):
+        self.delay = 0.0
+        self.failing = False
+        self.calls = 0
+
+    def search(self, query, limit, search_filter=None):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.failing:
+            raise RuntimeError("embedding backend down")
+        return ranking("v")
+
+
+@pytest.fixture
+def retriever(monkeypatch):
+    retriever = HybridRetriever(
+        FlakyIndex(), vector_timeout=0.05, cooldown_seconds=60, failure_threshold=3
+    )
+    monkeypatch.setattr(retriever, "_lexical_search", lambda *args: ranking("l"))
+    yield retriever
+    retriever._executor.shutdown(wait=True)
+
+
+def test_one_timeout_does_not_disable_vector_search(retriever):
+    retriever.index_manager.delay = 0.5
+    assert fused_ids(retriever.search("q")) == ["l"]
+    retriever.index_manager.delay = 0.0
+    assert not retriever.stats()["lexical_only"]
+    assert set(fused_ids(retriever.search("q"))) == {"l", "v"}
+    assert retriever.stats()["vector_timeouts"] == 1
+    assert retriever.stats()["vector_consecutive_failures"] == 0
+
+
+def test_failures_in_a_row_switch_to_lexical_only(retriever):
+    index = retriever.index_manager
+    index.failing = True
+    for _ in range(2):
+        retriever.search("q")
+    assert not retriever.stats()["lexical_only"]
+    retriever.search("q")
+    assert retriever.stats()["lexical_only"]
+
+    index.failing = False
+    calls = index.calls
+    assert fused_ids(retriever.search("q")) == ["l"]
+    assert index.calls == calls
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from app.utils import indexing_queue
+from app.utils.indexing_queue import (
+    MAX_BATCH_ATTEMPTS,
+    IndexingQueue,
+    finish_dead_letters,
+    return_dead_letters,
+    take_dead_letters,
+)
+
+
+class FailingIndex:
+    """Index manager whose first `failures` calls raise."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+        self.added = []
+
+    def add_texts(self, texts, metadatas=None, save=True):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError("embedding service unavailable")
+        self.added += [metadata["post_id"] for metadata in metadatas]
+
+    def remove(self, post_ids, save=True):
+        raise RuntimeError("index is read-only")
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(indexing_queue.time, "sleep", lambda seconds: None)
+
+
+@pytest.fixture
+def dead_letter_path(tmp_path):
+    return str(tmp_path / "dead_letter.jsonl")
+
+
+def batch(*post_ids):
+    return [("upsert", f"post {post_id}", {"post_id": post_id}) for post_id in post_ids]
+
+
+def read_lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_batch_is_retried_before_giving_up(dead_letter_path):
+    index = FailingIndex(failures=MAX_BATCH_ATTEMPTS - 1)
+    queue = IndexingQueue(index, dead_letter_path=dead_letter_path)
+    queue._index_batch(batch("1", "2"))
+    assert index.added == ["1", "2"]
+    assert queue.stats()["dead_lettered"] == 0
+
+
+def test_failed_posts_are_dead_lettered(dead_letter_path):
+    queue = IndexingQueue(FailingIndex(failures=99), dead_letter_path=dead_letter_path)
+    queue._index_batch(batch("1", "2") + [("delete", "3", None)])
+    entries = read_lines(dead_letter_path)
+    assert [(e["op"], e["post_id"]) for e in entries] == [
+        ("upsert", "1"),
+        ("upsert", "2"),
+        ("delete", "3"),
+    ]
+    assert entries[0]["error"] == "embedding service unavailable"
+    assert queue.stats()["failed"] == 3
+    assert queue.stats()["dead_lettered"] == 3
+
+
+def test_dead_letters_are_claimed_returned_and_finished(dead_letter_path):
+    queue = IndexingQueue(FailingIndex(failures=99), dead_letter_path=dead_letter_path)
+    queue._index_batch(batch("1", "2"))
+    queue._index_batch(batch("1"))
+
+    entries = take_dead_letters(dead_letter_path)
+    assert sorted(entries) == ["1", "2"]
+    # Posts failing meanwhile start a new file
+    queue._index_batch(batch("3"))
+    assert [e["post_id"] for e in read_lines(dead_letter_path)] == ["3"]
+    # A crashed retry is picked up again by the next one
+    assert sorted(take_dead_letters(dead_letter_path)) == ["1", "2"]
+
+    return_dead_letters(dead_letter_path, [entries["2"]])
+    finish_dead_letters(dead_letter_path)
+    assert sorted(take_dead_letters(dead_letter_path)) == ["2", "3"]
+    finish_dead_letters(dead_letter_path)
+    assert take_dead_letters(dead_letter_path) == {}
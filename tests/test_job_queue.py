@@ -0,0 +1,197 @@
+import time
+
+import pytest
+
+from app.utils.job_queue import (
+    FAILED,
+    QUEUED,
+    RUNNING,
+    SKIPPED,
+    SUCCEEDED,
+    JobQueue,
+    JobSkipped,
+    PermanentJobError,
+)
+
+
+@pytest.fixture
+def make_queue(tmp_path):
+    """
+    Queues without worker threads: tests claim and execute jobs themselves.
+    """
+    queues = []
+
+    def make(**options):
+        options.setdefault("retry_backoff_seconds", 0)
+        queue = JobQueue(str(tmp_path / "jobs.sqlite3"), **options)
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue._conn.close()
+
+
+def run_next(queue):
+    job = queue._claim()
+    assert job is not None
+    queue._execute(job)
+    return queue.get(job["id"])
+
+
+def test_result_and_checkpoints_are_stored(make_queue):
+    queue = make_queue()
+
+    def handler(context):
+        with context.stage("parse"):
+            context.checkpoint("parsed", context.payload["n"] * 2)
+        return {"total": context.payload["parsed"] + 1}
+
+    queue.register("work", handler)
+    job_id = queue.enqueue("work", {"n": 4})
+    job = run_next(queue)
+    assert job["state"] == SUCCEEDED
+    assert job["result"] == {"total": 9}
+    assert job["payload"]["parsed"] == 8
+    assert [stage["name"] for stage in job["stages"]] == ["parse"]
+    assert queue.status(job_id)["run_seconds"] is not None
+
+
+def test_failures_are_retried_with_exponential_backoff(make_queue):
+    queue = make_queue(max_attempts=3, retry_backoff_seconds=10)
+    queue.register("flaky", lambda context: 1 / 0)
+    job_id = queue.enqueue("flaky", {})
+
+    delays = []
+    for _ in range(2):
+        before = time.time()
+        job = run_next(queue)
+        assert job["state"] == QUEUED
+        delays.append(job["run_after"] - before)
+        assert queue._claim() is None
+        # Make the retry due now
+        queue._conn.execute("UPDATE jobs SET run_after = 0 WHERE id = ?", (job_id,))
+    assert delays[0] == pytest.approx(10, abs=1)
+    assert delays[1] == pytest.approx(20, abs=1)
+
+    job = run_next(queue)
+    assert job["state"] == FAILED
+    assert job["attempts"] == 3
+    assert job["error"].startswith("ZeroDivisionError")
+    assert queue.stats()["retries"] == 2
+
+
+def test_retries_skip_completed_stages(make_queue):
+    queue = make_queue()
+    calls = []
+
+    def handler(context):
+        if "uploaded" not in context.payload:
+            with context.stage("upload"):
+                calls.append("upload")
+                context.checkpoint("uploaded", "url")
+        with context.stage("save"):
+            calls.append("save")
+            if context.attempt == 1:
+                raise RuntimeError("database is locked")
+
+    queue.register("upload", handler)
+    queue.enqueue("upload", {})
+    assert run_next(queue)["state"] == QUEUED
+    job = run_next(queue)
+    assert job["state"] == SUCCEEDED
+    assert calls == ["upload", "save", "save"]
+    assert [(s["name"], s["attempt"], s["ok"]) for s in job["stages"]] == [
+        ("upload", 1, True),
+        ("save", 1, False),
+        ("save", 2, True),
+    ]
+
+
+def test_permanent_errors_are_not_retried(make_queue):
+    queue = make_queue(max_attempts=5)
+
+    def handler(context):
+        raise PermanentJobError("not a prescription")
+
+    queue.register("parse", handler)
+    queue.enqueue("parse", {})
+    job = run_next(queue)
+    assert job["state"] == FAILED
+    assert job["attempts"] == 1
+    assert queue._claim() is None
+
+
+def test_skipped_jobs_keep_their_result(make_queue):
+    queue = make_queue()
+
+    def handler(context):
+        raise JobSkipped("duplicate upload", result={"priscription_id": "p1"})
+
+    queue.register("parse", handler)
+    queue.enqueue("parse", {})
+    job = run_next(queue)
+    assert job["state"] == SKIPPED
+    assert job["result"] == {"priscription_id": "p1"}
+    assert job["error"] == "duplicate upload"
+
+
+def test_unknown_kind_fails(make_queue):
+    queue = make_queue()
+    queue.enqueue("missing", {})
+    assert run_next(queue)["state"] == FAILED
+
+
+def test_expired_lease_is_reclaimed(make_queue):
+    crashed = make_queue(lease_seconds=-1)
+    job_id = crashed.enqueue("work", {})
+    # Claimed by a worker that dies without finishing
+    assert crashed._claim()["id"] == job_id
+    assert crashed.get(job_id)["state"] == RUNNING
+
+    queue = make_queue(lease_seconds=60)
+    queue.register("work", lambda context: context.attempt)
+    job = run_next(queue)
+    assert job["id"] == job_id
+    assert job["state"] == SUCCEEDED
+    assert job["result"] == 2
+
+
+def test_live_lease_is_not_reclaimed(make_queue):
+    queue = make_queue(lease_seconds=60)
+    queue.enqueue("work", {})
+    assert queue._claim() is not None
+    assert queue._claim() is None
+
+
+def test_lost_job_fails_after_its_last_attempt(make_queue):
+    queue = make_queue(max_attempts=1, lease_seconds=-1)
+    queue.register("work", lambda context: None)
+    queue.enqueue("work", {})
+    queue._claim()
+    job = run_next(queue)
+    assert job["state"] == FAILED
+    assert job["error"] == "Worker lost"
+
+
+def test_jobs_with_the_same_key_run_in_order(make_queue):
+    queue = make_queue(retry_backoff_seconds=60)
+    queue.register("flaky", lambda context: 1 / 0)
+    queue.register("work", lambda context: context.payload["n"])
+    first = queue.enqueue("flaky", {}, key="alice")
+    second = queue.enqueue("work", {"n": 2}, key="alice")
+    other = queue.enqueue("work", {"n": 3}, key="bob")
+
+    job = queue._claim()
+    assert job["id"] == first
+    # The same key waits while the first job runs; other keys do not
+    assert queue._claim()["id"] == other
+    assert queue._claim() is None
+
+    queue._execute(job)
+    assert queue.get(first)["state"] == QUEUED
+    # ...and while it waits for its retry
+    assert queue._claim() is None
+
+    queue._conn.execute("UPDATE jobs SET run_after = 0 WHERE id = ?", (first,))
+    assert queue._claim()["id"] == first
@@ -0,0 +1,51 @@
+import datetime
+import json
+import os
+import uuid
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+
+@pytest.fixture
+def user(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return f"patient-{uuid.uuid4()}"
+
+
+def write_legacy_file(username):
+    from app.db.medication import LEGACY_NOTIFICATIONS_FILE
+
+    os.makedirs(os.path.join("static", username))
+    path = os.path.join("static", username, LEGACY_NOTIFICATIONS_FILE)
+    with open(path, "w") as f:
+        json.dump(
+            [
+                {
+                    "processing_time": datetime.datetime.now().isoformat(),
+                    "medications": [{"name": "Paracetamol", "duration": "5 days"}],
+                }
+            ],
+            f,
+        )
+    return path
+
+
+def test_reads_do_not_import_legacy_files(user, db_session):
+    from app.db.medication import active_medications
+
+    path = write_legacy_file(user)
+    assert active_medications(db_session, user) == []
+    assert os.path.exists(path)
+
+
+def test_legacy_files_are_imported_once_at_startup(user, db_session):
+    from app.db.medication import active_medications, import_all_legacy_notifications
+
+    path = write_legacy_file(user)
+    assert import_all_legacy_notifications(db_session) == 1
+    assert not os.path.exists(path)
+    assert [row.name for row in active_medications(db_session, user)] == ["Paracetamol"]
+    assert import_all_legacy_notifications(db_session) == 0
+    assert len(active_medications(db_session, user)) == 1
@@ -0,0 +1,109 @@
+import datetime
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def thread(db_session):
+    """
+    A thread with a unique word in every post:
+    root <- reply (doctor) <- nested, and an unrelated post.
+    """
+    from sqlalchemy import text as sql_text
+
+    from app.db import db_schema
+    from app.db.db_schema import Post
+
+    word = f"w{uuid.uuid4().hex}"
+    ids = {name: str(uuid.uuid4()) for name in ("root", "reply", "nested", "other")}
+    posts = [
+        ("root", None, None, datetime.datetime(2001, 1, 1, 9)),
+        ("reply", "root", "doctor-1", datetime.datetime(2001, 1, 2, 9)),
+        ("nested", "reply", None, datetime.datetime(2001, 1, 3, 9)),
+        ("other", None, "doctor-2", datetime.datetime(2001, 1, 2, 12)),
+    ]
+    for name, parent, doctor_id, created_time in posts:
+        db_session.add(
+            Post(
+                post_id=ids[name],
+                doctor_id=doctor_id,
+                text=f"{word} {name}",
+                created_time=created_time,
+                parent_id=ids[parent] if parent else None,
+            )
+        )
+        db_session.flush()
+        if db_schema.POSTS_FTS_ENABLED:
+            db_session.execute(
+                sql_text(
+                    "INSERT INTO posts_fts (rowid, text) "
+                    "SELECT rowid, text FROM posts WHERE post_id = :post_id"
+                ),
+                {"post_id": ids[name]},
+            )
+    db_session.commit()
+    names = {post_id: name for name, post_id in ids.items()}
+    return word, ids, names
+
+
+def searched(db_session, thread, **scope):
+    from app.db import db_schema
+    from app.db.post import search_posts_text
+
+    if not db_schema.POSTS_FTS_ENABLED:
+        pytest.skip("SQLite without FTS5")
+    word, _, names = thread
+    return {
+        names[post.post_id]
+        for post, _ in search_posts_text(db_session, word, limit=10, **scope)
+    }
+
+
+def recent(db_session, thread, **scope):
+    from app.db.post import get_recent_posts
+
+    _, _, names = thread
+    return [
+        names[post.post_id]
+        for post in get_recent_posts(db_session, limit=1000, **scope)
+        if post.post_id in names
+    ]
+
+
+def test_thread_scope_includes_nested_replies(db_session, thread):
+    _, ids, _ = thread
+    assert searched(db_session, thread, thread_id=ids["root"]) == {
+        "root",
+        "reply",
+        "nested",
+    }
+    assert searched(db_session, thread, thread_id=ids["reply"]) == {"reply", "nested"}
+
+
+def test_doctor_only_and_time_window(db_session, thread):
+    assert searched(db_session, thread, doctor_only=True) == {"reply", "other"}
+    window = {
+        "since": datetime.datetime(2001, 1, 2),
+        "until": datetime.datetime(2001, 1, 2, 12),
+    }
+    # `until` is exclusive
+    assert searched(db_session, thread, **window) == {"reply"}
+
+
+def test_recent_posts_are_scoped_like_the_search(db_session, thread):
+    _, ids, _ = thread
+    assert recent(db_session, thread, thread_id=ids["root"]) == [
+        "nested",
+        "reply",
+        "root",
+    ]
+    assert recent(db_session, thread, doctor_only=True, thread_id=ids["root"]) == [
+        "reply"
+    ]
+    assert recent(
+        db_session,
+        thread,
+        since=datetime.datetime(2001, 1, 2),
+        until=datetime.datetime(2001, 1, 3),
+    ) == ["other", "reply"]
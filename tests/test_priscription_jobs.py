@@ -0,0 +1,74 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("google.generativeai")
+
+from app.utils import med_record_processor, priscription_jobs
+from app.utils.job_queue import QUEUED, SUCCEEDED, JobQueue
+
+EXTRACTION = {
+    "section_title": "Extracted Medical Record (2026-01-01 10:00:00)",
+    "recorded_at": "2026-01-01 10:00:00",
+    "structured_text": "Paracetamol 500mg",
+    "json_data": {"medications": [{"name": "Paracetamol"}]},
+}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), retry_backoff_seconds=0)
+    queue.register(
+        priscription_jobs.PRISCRIPTION_JOB, priscription_jobs.process_priscription
+    )
+    yield queue
+    queue._conn.close()
+
+
+def run_next(queue):
+    job = queue._claim()
+    assert job is not None
+    queue._execute(job)
+    return queue.get(job["id"])
+
+
+def test_failed_medications_are_saved_again_from_the_extraction(queue, monkeypatch):
+    sections = []
+    saved = []
+
+    def save_record_section(extraction, username, stage=None, section_id=None):
+        sections.append(extraction["section_title"])
+        return {"section_title": extraction["section_title"]}
+
+    def save_notification_data(json_data, username, source=None):
+        if not saved:
+            saved.append(None)
+            raise RuntimeError("database is locked")
+        saved.append(json_data)
+
+    monkeypatch.setattr(priscription_jobs, "save_record_section", save_record_section)
+    monkeypatch.setattr(
+        med_record_processor, "save_notification_data", save_notification_data
+    )
+    monkeypatch.setattr(priscription_jobs, "_save_fingerprint", lambda payload: None)
+    # Spooled image already processed up to the extraction
+    queue.enqueue(
+        priscription_jobs.PRISCRIPTION_JOB,
+        {
+            "image_path": "gone.upload",
+            "username": "alice",
+            "fingerprint": {"sha256": "", "phash": ""},
+            "file_url": "https://example.com/p.jpg",
+            "priscription_id": 1,
+            "extraction": EXTRACTION,
+        },
+    )
+
+    job = run_next(queue)
+    assert job["state"] == QUEUED
+    assert "notifications_saved" not in job["payload"]
+
+    job = run_next(queue)
+    assert job["state"] == SUCCEEDED
+    assert saved == [None, EXTRACTION["json_data"]]
+    # The section was added once
+    assert sections == [EXTRACTION["section_title"]]
@@ -0,0 +1,89 @@
+import os
+import time
+import uuid
+
+import pytest
+
+pytest.importorskip("fpdf")
+pytest.importorskip("PyPDF2")
+
+from app.settings import settings
+from app.utils import record_store
+from app.utils.record_store import (
+    append_section,
+    read_sections,
+    record_pdf,
+    sections_version,
+)
+from app.utils.record_text import read_record_text
+
+
+@pytest.fixture
+def user(tmp_path, monkeypatch):
+    # Unique per test: record texts are cached in memory by username
+    monkeypatch.chdir(tmp_path)
+    return f"patient-{uuid.uuid4()}"
+
+
+def test_sections_are_read_up_to_a_version(user):
+    append_section(user, "Visit 1", "Fever")
+    version = sections_version(user)
+    append_section(user, "Visit 2", "Cough")
+    assert [s["title"] for s in read_sections(user)] == ["Visit 1", "Visit 2"]
+    assert [s["title"] for s in read_sections(user, version)] == ["Visit 1"]
+
+
+def test_partially_written_section_is_not_read(user):
+    append_section(user, "Visit 1", "Fever")
+    with open(
+        os.path.join(record_store.record_dir(user), record_store.SECTIONS_FILE), "a"
+    ) as f:
+        f.write('{"title": "Visit 2", "con')
+    assert [s["title"] for s in read_sections(user)] == ["Visit 1"]
+
+
+def test_record_text_follows_the_sections(user):
+    assert read_record_text(user) == ""
+    append_section(user, "Visit 1", "Fever")
+    assert read_record_text(user) == "Visit 1\nFever\n\n"
+    append_section(user, "Visit 2", "Cough")
+    assert read_record_text(user).endswith("Visit 2\nCough\n\n")
+
+
+def test_render_is_reused_until_the_record_grows(user):
+    assert record_pdf(user) is None
+    append_section(user, "Visit 1", "Fever")
+    first = record_pdf(user)
+    assert record_pdf(user) == first
+    append_section(user, "Visit 2", "Cough")
+    second = record_pdf(user)
+    assert second != first
+    assert os.path.basename(second) == (
+        f"{record_store.RENDERED_PREFIX}{sections_version(user)}.pdf"
+    )
+
+
+def test_superseded_render_is_kept_for_the_grace_period(user, monkeypatch):
+    monkeypatch.setattr(settings, "RECORD_RENDER_GRACE_SECONDS", 60.0)
+    append_section(user, "Visit 1", "Fever")
+    first = record_pdf(user)
+    append_section(user, "Visit 2", "Cough")
+    second = record_pdf(user)
+    # Still being served to a slow client
+    assert os.path.exists(first)
+
+    stale = time.time() - 120
+    os.utime(first, (stale, stale))
+    append_section(user, "Visit 3", "Better")
+    record_pdf(user)
+    assert not os.path.exists(first)
+    # Served less than a grace period ago
+    assert os.path.exists(second)
+
+
+def test_a_retried_section_is_added_once(user):
+    assert append_section(user, "Visit 1", "Fever", section_id="priscription-1")
+    assert not append_section(user, "Visit 1", "Fever", section_id="priscription-1")
+    assert append_section(user, "Visit 2", "Cough" * 2000, section_id="priscription-2")
+    assert not append_section(user, "Visit 2", "Cough", section_id="priscription-2")
+    assert [s["title"] for s in read_sections(user)] == ["Visit 1", "Visit 2"]
@@ -0,0 +1,141 @@
+import datetime
+
+import pytest
+
+from app.utils.reminders import DoseWheel, ReminderScheduler, Schedule, parse_slots
+
+SLOTS = {"morning": 8 * 60, "night": 21 * 60}
+DAY = datetime.date(2026, 3, 2)
+
+
+def at(hour, minute=0, day=DAY):
+    return datetime.datetime.combine(day, datetime.time(hour, minute))
+
+
+def schedule(
+    medication_id=1,
+    username="alice",
+    name="Metformin",
+    slots=("morning", "night"),
+    start_date=DAY,
+    end_date=None,
+    created_at=None,
+):
+    return Schedule(
+        medication_id=medication_id,
+        username=username,
+        name=name,
+        dosage="500mg",
+        instructions=None,
+        slots=slots,
+        start_date=start_date,
+        end_date=end_date,
+        created_at=created_at,
+    )
+
+
+def due(wheel, after, until):
+    return [
+        (dose.schedule.medication_id, dose.slot, dose.due_at)
+        for dose in wheel.due(after, until)
+    ]
+
+
+def test_parse_slots():
+    assert parse_slots("morning=08:00, night=21:30,") == {
+        "morning": 480,
+        "night": 1290,
+    }
+    for spec in ("lunch=12:00", "morning=24:00", "night=-1:00"):
+        with pytest.raises(ValueError):
+            parse_slots(spec)
+
+
+def test_doses_are_due_once_at_their_minute():
+    wheel = DoseWheel(SLOTS)
+    wheel.add(schedule())
+    assert due(wheel, at(7, 58), at(7, 59)) == []
+    assert due(wheel, at(7, 59), at(8)) == [(1, "morning", at(8))]
+    assert due(wheel, at(8), at(20, 59)) == []
+    assert due(wheel, at(7), at(21)) == [(1, "morning", at(8)), (1, "night", at(21))]
+
+
+def test_ticks_across_midnight_cover_both_days():
+    wheel = DoseWheel(SLOTS)
+    wheel.add(schedule())
+    next_day = DAY + datetime.timedelta(days=1)
+    assert due(wheel, at(20), at(9, day=next_day)) == [
+        (1, "night", at(21)),
+        (1, "morning", at(8, day=next_day)),
+    ]
+
+
+def test_doses_wait_for_the_start_date():
+    wheel = DoseWheel(SLOTS)
+    wheel.add(schedule(start_date=DAY + datetime.timedelta(days=1)))
+    assert due(wheel, at(7), at(22)) == []
+    assert len(wheel) == 1
+
+
+def test_ended_schedules_are_dropped():
+    wheel = DoseWheel(SLOTS)
+    wheel.add(schedule(end_date=DAY))
+    assert due(wheel, at(7), at(22)) == [(1, "morning", at(8)), (1, "night", at(21))]
+    next_day = DAY + datetime.timedelta(days=1)
+    assert due(wheel, at(7, day=next_day), at(22, day=next_day)) == []
+    assert len(wheel) == 0
+    assert wheel.dropped == 1
+
+
+def test_latest_prescription_of_a_medicine_wins():
+    wheel = DoseWheel(SLOTS)
+    old = at(0, day=DAY - datetime.timedelta(days=30))
+    new = at(0, day=DAY - datetime.timedelta(days=1))
+    wheel.add(schedule(medication_id=2, slots=("night",), created_at=new))
+    # Loaded after the newer one, e.g. in id order: ignored
+    wheel.add(schedule(medication_id=1, name="metformin", created_at=old))
+    assert len(wheel) == 1
+    assert due(wheel, at(7), at(22)) == [(2, "night", at(21))]
+
+
+def test_newer_prescription_without_dose_times_stops_the_old_one():
+    wheel = DoseWheel(SLOTS)
+    wheel.add(schedule(medication_id=1, created_at=at(0)))
+    wheel.add(schedule(medication_id=2, slots=(), created_at=at(1)))
+    assert due(wheel, at(7), at(22)) == []
+    assert len(wheel) == 1
+
+
+def test_other_patients_and_medicines_are_kept_apart():
+    wheel = DoseWheel(SLOTS)
+    wheel.add(schedule(medication_id=1))
+    wheel.add(schedule(medication_id=2, username="bob"))
+    wheel.add(schedule(medication_id=3, name="Aspirin", slots=("morning",)))
+    assert len(wheel) == 3
+    assert sorted(due(wheel, at(7), at(9))) == [
+        (1, "morning", at(8)),
+        (2, "morning", at(8)),
+        (3, "morning", at(8)),
+    ]
+
+
+def test_removed_medicines_are_no_longer_due():
+    wheel = DoseWheel(SLOTS)
+    wheel.add(schedule())
+    wheel.remove("alice", "METFORMIN")
+    assert len(wheel) == 0
+    assert due(wheel, at(7), at(22)) == []
+
+
+def test_scheduler_fills_outboxes_and_subscribers():
+    scheduler = ReminderScheduler(SLOTS, outbox_size=1)
+    scheduler.wheel.add(schedule())
+    delivered = []
+    scheduler.subscribe(delivered.extend)
+    assert scheduler.tick(at(7)) == []
+    assert len(scheduler.tick(at(22))) == 2
+    assert len(delivered) == 2
+    # The outbox only keeps the latest doses
+    assert [r["slot"] for r in scheduler.reminders("alice")] == ["night"]
+    assert scheduler.reminders("alice", since=at(21)) == []
+    assert scheduler.stats()["delivered"] == 2
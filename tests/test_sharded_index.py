@@ -0,0 +1,164 @@
+import datetime
+import json
+import os
+
+import pytest
+
+pytest.importorskip("faiss")
+
+from app.utils.sharded_index import ShardedIndexManager, shard_key
+from app.utils.vector_store import SearchFilter
+
+SEALED = "2020-01"
+IN_SEALED_MONTH = SearchFilter(
+    since=datetime.datetime(2020, 1, 1), until=datetime.datetime(2020, 2, 1)
+)
+
+
+@pytest.fixture
+def manager(tmp_path, embedding):
+    return ShardedIndexManager(
+        str(tmp_path / "shards"), embedding, reload_check_interval=0
+    )
+
+
+def add(manager, post_id, created_time=None):
+    manager.add_texts(
+        [f"post {post_id}"], [{"post_id": post_id, "created_time": created_time}]
+    )
+
+
+def add_sealed(manager, *post_ids):
+    for day, post_id in enumerate(post_ids, start=1):
+        add(manager, post_id, f"2020-01-{day:02d}T12:00:00")
+    manager.compact()
+
+
+def found(manager, query="post", search_filter=None):
+    return {
+        metadata["post_id"]
+        for _, metadata in manager.search(query, k=10, search_filter=search_filter)
+    }
+
+
+def shard_files(tmp_path, key):
+    directory = tmp_path / "shards" / key
+    return {path.name: path.read_bytes() for path in directory.iterdir()}
+
+
+def test_late_posts_wait_in_the_hot_shard_until_compaction(manager):
+    add(manager, "old", "2020-01-15T12:00:00")
+    add(manager, "new")
+    assert set(manager.get_index()) == {shard_key()}
+    # Its month's searches still visit the hot shard
+    assert found(manager, search_filter=IN_SEALED_MONTH) == {"old"}
+    assert manager.stats()["late_post_shards"] == 1
+
+    manager.compact()
+    indexes = manager.get_index()
+    assert "old" in indexes[SEALED]
+    assert "old" not in indexes[shard_key()]
+    assert found(manager, search_filter=IN_SEALED_MONTH) == {"old"}
+    assert found(manager) == {"old", "new"}
+    assert manager.stats()["late_post_shards"] == 0
+
+
+def test_upserting_an_old_post_leaves_its_sealed_shard_untouched(
+    manager, tmp_path, monkeypatch
+):
+    add_sealed(manager, "old", "kept")
+    before = shard_files(tmp_path, SEALED)
+    sealed = dict(manager._loaded_shards())[SEALED]
+
+    def refuse(*args, **kwargs):
+        raise AssertionError("sealed shard written")
+
+    monkeypatch.setattr(sealed, "add_vectors", refuse)
+    monkeypatch.setattr(sealed, "remove", refuse)
+    add(manager, "old", "2020-01-01T12:00:00")
+    add(manager, "late", "2020-01-20T12:00:00")
+    add(manager, "new")
+    manager.save()
+
+    assert shard_files(tmp_path, SEALED) == before
+    hits = manager.search("post", k=10)
+    assert sorted(metadata["post_id"] for _, metadata in hits) == [
+        "kept",
+        "late",
+        "new",
+        "old",
+    ]
+
+
+def test_generation_only_increases(manager):
+    generations = [manager.generation]
+
+    def step():
+        generations.append(manager.generation)
+
+    add_sealed(manager, "old")
+    step()
+    add(manager, "new")
+    step()
+    manager.remove(["new"])
+    step()
+    manager._drop_shard(SEALED)
+    step()
+    # Reopening a shard starts its own generation over
+    add_sealed(manager, "again")
+    step()
+    manager.compact()
+    step()
+    assert generations == sorted(set(generations))
+
+
+def test_removal_from_a_sealed_shard_waits_for_compaction(manager, tmp_path):
+    add_sealed(manager, "old", "kept")
+    before = shard_files(tmp_path, SEALED)
+
+    assert manager.remove(["old"]) == 1
+    assert shard_files(tmp_path, SEALED) == before
+    assert found(manager) == {"kept"}
+    assert manager.stats()["sealed_deletes"] == 1
+
+    manager.compact()
+    assert manager.stats()["sealed_deletes"] == 0
+    assert "old" not in manager.get_index()[SEALED]
+    assert found(manager) == {"kept"}
+
+
+def test_other_processes_see_sealed_removals(manager, tmp_path, embedding):
+    add_sealed(manager, "old")
+    other = ShardedIndexManager(
+        str(tmp_path / "shards"), embedding, reload_check_interval=0
+    )
+    assert found(other) == {"old"}
+    manager.remove(["old"])
+    assert found(other) == set()
+
+
+def test_readding_a_removed_sealed_post(manager):
+    add_sealed(manager, "old")
+    manager.remove(["old"])
+    add(manager, "old", "2020-01-01T12:00:00")
+    assert found(manager) == {"old"}
+
+    manager.compact()
+    assert manager.stats()["sealed_deletes"] == 0
+    assert "old" in manager.get_index()[SEALED]
+    assert found(manager) == {"old"}
+
+
+def test_concurrent_sealed_removals_are_merged(manager, tmp_path, embedding):
+    add_sealed(manager, "a", "b", "c")
+    other = ShardedIndexManager(
+        str(tmp_path / "shards"), embedding, reload_check_interval=60
+    )
+    other.get_index()
+    manager.remove(["a"])
+    # `other` has not re-read the file since; its removal must not drop "a"
+    other.remove(["b"])
+    manager.remove(["c"])
+    with open(tmp_path / "shards" / "sealed_deletes.json") as f:
+        assert json.load(f) == {SEALED: ["a", "b", "c"]}
+    assert found(other) == set()
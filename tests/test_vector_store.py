@@ -0,0 +1,118 @@
+import datetime
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+
+from app.utils.faiss_index_types import create_faiss_index, train_index
+from app.utils.vector_store import PostVectorIndex, SearchFilter
+
+DIM = 8
+
+
+def vectors(n, seed=0):
+    return np.random.default_rng(seed).random((n, DIM)).astype("float32")
+
+
+def post_ids(hits):
+    return {record["post_id"] for record, _ in hits}
+
+
+@pytest.fixture
+def forum():
+    """
+    root (user) <- reply (doctor) <- nested (user); other (doctor) elsewhere.
+    """
+    index = PostVectorIndex(DIM)
+    index.upsert(
+        ["root", "reply", "nested", "other"],
+        ["root", "reply", "nested", "other"],
+        vectors(4),
+        [
+            {"created_time": "2026-01-01T10:00:00"},
+            {"parent_id": "root", "doctor_id": "d1", "created_time": "2026-01-02"},
+            {"parent_id": "reply", "created_time": "2026-01-03T10:00:00"},
+            {"doctor_id": "d2"},
+        ],
+    )
+    return index
+
+
+def search_all(index, search_filter):
+    return post_ids(
+        index.search(vectors(1, seed=1), k=10, search_filter=search_filter)[0]
+    )
+
+
+def test_unfiltered_search_returns_every_live_post(forum):
+    assert search_all(forum, None) == {"root", "reply", "nested", "other"}
+
+
+def test_doctor_only(forum):
+    assert search_all(forum, SearchFilter(doctor_only=True)) == {"reply", "other"}
+
+
+def test_thread_filter_follows_nested_replies(forum):
+    assert search_all(forum, SearchFilter(thread_id="root")) == {
+        "root",
+        "reply",
+        "nested",
+    }
+    assert search_all(forum, SearchFilter(thread_id="reply")) == {"reply", "nested"}
+
+
+def test_time_window_excludes_posts_without_creation_time(forum):
+    window = SearchFilter(
+        since=datetime.datetime(2026, 1, 2), until=datetime.datetime(2026, 1, 3)
+    )
+    assert search_all(forum, window) == {"reply"}
+    assert search_all(forum, SearchFilter(since=datetime.datetime(2000, 1, 1))) == {
+        "root",
+        "reply",
+        "nested",
+    }
+
+
+def test_upsert_and_remove_tombstone_the_old_vector(forum):
+    forum.upsert(["root"], ["root v2"], vectors(1, seed=2), [{}])
+    assert forum.remove(["other", "missing"]) == 1
+    assert forum.live_count == 3
+    assert forum.dead_count == 2
+    hits = forum.search(vectors(1, seed=1), k=10)[0]
+    assert sorted(record["text"] for record, _ in hits) == [
+        "nested",
+        "reply",
+        "root v2",
+    ]
+
+
+def test_compacted_drops_tombstones(forum):
+    forum.remove(["other"])
+    compacted = forum.compacted()
+    assert compacted.dead_count == 0
+    assert set(compacted.post_ids) == {"root", "reply", "nested"}
+    assert search_all(compacted, SearchFilter(thread_id="root")) == {
+        "root",
+        "reply",
+        "nested",
+    }
+
+
+def test_lossy_index_is_rebuilt_from_source_vectors_only():
+    n = 10000
+    source = vectors(n)
+    texts = [f"post {i}" for i in range(n)]
+    by_text = dict(zip(texts, source))
+    index = create_faiss_index("ivf_pq", DIM, n)
+    train_index(index, source)
+    pq = PostVectorIndex(DIM, index=index)
+    pq.upsert([str(i) for i in range(n)], texts, source)
+    assert pq.lossy
+
+    with pytest.raises(ValueError):
+        pq.rebuilt("flat")
+
+    rebuilt = pq.rebuilt("flat", embed=lambda batch: [by_text[t] for t in batch])
+    assert rebuilt.index_type == "flat"
+    assert np.allclose(rebuilt.reconstruct([rebuilt.post_ids["42"]])[0], source[42])